@@ -0,0 +1,67 @@
+#!/usr/bin/env python
+"""
+Measures the memory used by the AST and the code generation time on a
+large generated translation unit.
+
+The size of a node includes its token, its list of children and the
+instance dictionaries of both, if they have any.
+"""
+from __future__ import absolute_import
+import argparse
+import sys
+import time
+
+from c_llvm.compiler import Compiler
+
+from corpus import generate_program
+
+
+def object_size(obj):
+    size = sys.getsizeof(obj)
+    try:
+        size += sys.getsizeof(object.__getattribute__(obj, '__dict__'))
+    except AttributeError:
+        pass
+    return size
+
+
+def walk(node):
+    stack = [node]
+    while stack:
+        node = stack.pop()
+        yield node
+        stack.extend(node.children)
+
+
+def node_size(node):
+    return (object_size(node) + object_size(node.token) +
+            sys.getsizeof(node.children))
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description=__doc__.strip())
+    arg_parser.add_argument('--functions', type=int, default=64)
+    arg_parser.add_argument('--repeat', type=int, default=3)
+    args = arg_parser.parse_args()
+
+    source = generate_program(functions=args.functions)
+    root = Compiler().parse(source)
+    nodes = list(walk(root))
+    total = sum(node_size(node) for node in nodes)
+
+    best = None
+    for i in range(args.repeat):
+        start = time.time()
+        root.generate_code([])
+        elapsed = time.time() - start
+        best = elapsed if best is None else min(best, elapsed)
+
+    print "lines:      %d" % (source.count('\n'),)
+    print "nodes:      %d" % (len(nodes),)
+    print "bytes/node: %.0f" % (float(total) / len(nodes),)
+    print "AST MiB:    %.1f" % (total / 1024.0 / 1024.0,)
+    print "codegen s:  %.4f" % (best,)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,227 @@
+#!/usr/bin/env python
+"""
+Generator of synthetic C programs for benchmarking the compiler.
+
+The programs only use the subset of C supported by the grammar: int and
+char scalars, structs, arrays, if/else, while, for, switch and calls
+to previously defined functions. Every knob scales one property of the
+program, so that the cost of each compiler phase can be measured as a
+function of it.
+"""
+import argparse
+import random
+
+
+DEFAULTS = {
+    # Number of functions besides main.
+    'functions': 8,
+    # Number of statements in the body of each function.
+    'statements': 20,
+    # Number of operands in each generated expression.
+    'expression_length': 4,
+    # Depth of nested compound statements.
+    'nesting': 2,
+    # Number of string literal occurrences in the whole program.
+    'strings': 16,
+    # Number of struct types.
+    'structs': 2,
+}
+
+ARITHMETIC_OPERATORS = ['+', '-', '*', '&', '|', '^']
+COMPARE_OPERATORS = ['<', '>', '<=', '>=', '==', '!=']
+LOCALS = ['x0', 'x1', 'x2', 'x3']
+FORMATS = ['"%lld\\n"', '"value: %lld\\n"', '"%lld %lld\\n"',
+           '"result = %lld\\n"']
+
+
+class ProgramGenerator(object):
+    def __init__(self, seed=0, **knobs):
+        self.random = random.Random(seed)
+        self.knobs = dict(DEFAULTS)
+        self.knobs.update(knobs)
+        self.lines = []
+        self.indent = 0
+        self.functions = []
+        # Only functions which don't call anything are called, to keep the
+        # running time of the programs reasonable.
+        self.leaf_functions = []
+        self.leaf = False
+        self.strings_left = self.knobs['strings']
+
+    def line(self, text):
+        self.lines.append("    " * self.indent + text)
+
+    def operand(self, struct_var):
+        choice = self.random.randint(0, 5)
+        if choice == 0:
+            return str(self.random.randint(0, 1000))
+        if choice == 1 and struct_var is not None:
+            return "%s.f%d" % (struct_var, self.random.randint(0, 2))
+        if choice == 2 and self.leaf_functions and not self.leaf:
+            return "%s(%s, %s)" % (self.random.choice(self.leaf_functions),
+                                   self.random.choice(LOCALS),
+                                   self.random.randint(0, 9))
+        if choice == 3:
+            return "arr[%s & 7]" % (self.random.choice(LOCALS),)
+        return self.random.choice(LOCALS)
+
+    def expression(self, struct_var):
+        length = max(1, self.knobs['expression_length'])
+        parts = [self.operand(struct_var)]
+        for i in range(length - 1):
+            parts.append(self.random.choice(ARITHMETIC_OPERATORS))
+            parts.append(self.operand(struct_var))
+        return " ".join(parts)
+
+    def condition(self, struct_var):
+        return "%s %s %s" % (self.operand(struct_var),
+                             self.random.choice(COMPARE_OPERATORS),
+                             self.operand(struct_var))
+
+    def print_statement(self):
+        self.strings_left -= 1
+        fmt = self.random.choice(FORMATS)
+        args = ", ".join(self.random.choice(LOCALS)
+                         for i in range(fmt.count('%lld')))
+        self.line("printf(%s, %s);" % (fmt, args))
+
+    def statement(self, depth, struct_var, strings_here):
+        kind = self.random.randint(0, 5)
+        if strings_here > 0 and kind == 0:
+            self.print_statement()
+            return strings_here - 1
+        if depth > 0 and kind in (1, 2, 3):
+            if kind == 1:
+                self.line("if (%s) {" % (self.condition(struct_var),))
+            elif kind == 2:
+                self.line("for (i%d = 0; i%d < %d; i%d++) {" % (
+                    depth, depth, self.random.randint(2, 5), depth))
+            else:
+                # Every nesting level has its own loop counter, which is
+                # not assigned anywhere else, so that the loops terminate.
+                self.line("i%d = 0;" % (depth,))
+                self.line("while (i%d < %d && %s) {" % (
+                    depth, self.random.randint(2, 5),
+                    self.condition(struct_var)))
+                self.indent += 1
+                self.line("i%d = i%d + 1;" % (depth, depth))
+                self.indent -= 1
+            self.indent += 1
+            for i in range(2):
+                strings_here = self.statement(depth - 1, struct_var,
+                                              strings_here)
+            self.indent -= 1
+            if kind == 1:
+                self.line("} else {")
+                self.indent += 1
+                strings_here = self.statement(depth - 1, struct_var,
+                                              strings_here)
+                self.indent -= 1
+            self.line("}")
+            return strings_here
+        if kind == 4:
+            self.line("switch (%s & 3) {" % (self.random.choice(LOCALS),))
+            for case in range(3):
+                self.line("case %d: %s = %s; break;" % (
+                    case, self.random.choice(LOCALS),
+                    self.expression(struct_var)))
+            self.line("default: %s = 0;" % (self.random.choice(LOCALS),))
+            self.line("}")
+            return strings_here
+        target = self.random.choice(LOCALS + ['arr[%d]' % (
+            self.random.randint(0, 7),)])
+        if struct_var is not None and self.random.randint(0, 3) == 0:
+            target = "%s.f%d" % (struct_var, self.random.randint(0, 2))
+        self.line("%s = %s;" % (target, self.expression(struct_var)))
+        return strings_here
+
+    def struct_definitions(self):
+        for i in range(self.knobs['structs']):
+            self.line("struct s%d {" % (i,))
+            self.indent += 1
+            for member in range(3):
+                self.line("int f%d;" % (member,))
+            self.indent -= 1
+            self.line("};")
+            self.line("")
+
+    def function(self, name, strings_here, leaf):
+        self.leaf = leaf
+        self.line("int %s(int a, int b)" % (name,))
+        self.line("{")
+        self.indent += 1
+        counters = ["i%d" % (depth + 1,)
+                    for depth in range(self.knobs['nesting'])]
+        self.line("int %s;" % (", ".join(LOCALS + counters),))
+        self.line("int arr[8];")
+        struct_var = None
+        if self.knobs['structs']:
+            struct_var = 'st'
+            self.line("struct s%d st;" % (
+                self.random.randint(0, self.knobs['structs'] - 1),))
+            for member in range(3):
+                self.line("st.f%d = %d;" % (member, member))
+        self.line("x0 = a;")
+        self.line("x1 = b;")
+        self.line("x2 = a + b;")
+        self.line("x3 = 1;")
+        for i in range(8):
+            self.line("arr[%d] = %d;" % (i, i))
+        for i in range(self.knobs['statements']):
+            strings_here = self.statement(self.knobs['nesting'], struct_var,
+                                          strings_here)
+        while strings_here > 0:
+            self.print_statement()
+            strings_here -= 1
+        self.line("return %s;" % (self.expression(struct_var),))
+        self.indent -= 1
+        self.line("}")
+        self.line("")
+        self.functions.append(name)
+        if leaf:
+            self.leaf_functions.append(name)
+
+    def generate(self):
+        self.line("int printf(char *format, ...);")
+        self.line("")
+        self.struct_definitions()
+        count = self.knobs['functions']
+        per_function = self.knobs['strings'] // (count + 1)
+        for i in range(count):
+            self.function("f%d" % (i,), per_function, i % 4 == 0)
+        self.line("int main()")
+        self.line("{")
+        self.indent += 1
+        self.line("int r;")
+        self.line("r = 0;")
+        for name in self.functions:
+            self.line("r = r + %s(r, %d);" % (name, len(self.lines) % 10))
+        while self.strings_left > 0:
+            self.strings_left -= 1
+            self.line('printf("%lld\\n", r);')
+        self.line("return 0;")
+        self.indent -= 1
+        self.line("}")
+        return "\n".join(self.lines) + "\n"
+
+
+def generate_program(seed=0, **knobs):
+    """
+    Returns the source code of a program generated with the given knobs,
+    see DEFAULTS for the available ones.
+    """
+    return ProgramGenerator(seed, **knobs).generate()
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description=__doc__.strip())
+    for knob, default in sorted(DEFAULTS.items()):
+        arg_parser.add_argument('--%s' % (knob.replace('_', '-'),),
+                                type=int, default=default)
+    arg_parser.add_argument('--seed', type=int, default=0)
+    args = vars(arg_parser.parse_args())
+    print generate_program(**args),
+
+
+if __name__ == '__main__':
+    main()
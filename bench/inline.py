@@ -0,0 +1,154 @@
+#!/usr/bin/env python
+"""
+Compiles call-heavy programs with and without inlining functions
+(--inline-functions).
+
+Each program is compiled with local variables kept in memory and in
+registers (--ssa-locals), both times with --simplify-cfg. This reports
+the number of calls and lines of the generated code and the time lli
+takes to run it, skipped if lli isn't installed.
+"""
+from __future__ import absolute_import
+import argparse
+
+from c_llvm.compiler import Compiler
+from c_llvm.inliner import DEFAULT_INLINE_LIMIT
+
+from ssa_locals import run
+
+
+PROGRAMS = {
+    'accessors': """
+int printf(char *format, ...);
+int values[%(size)d];
+
+int get(int i)
+{
+    return values[i];
+}
+
+void set(int i, int value)
+{
+    values[i] = value;
+}
+
+int clamp(int x, int low, int high)
+{
+    if (x < low)
+        return low;
+    if (x > high)
+        return high;
+    return x;
+}
+
+int main()
+{
+    int i, round;
+    for (i = 0; i < %(size)d; i++)
+        set(i, i %% 100);
+    for (round = 0; round < %(rounds)d; round++)
+        for (i = 1; i < %(size)d; i++)
+            set(i, clamp(get(i - 1) + get(i) - 45, 5, 95));
+    printf("%%lld\\n", get(%(size)d - 1));
+    return 0;
+}
+""",
+    'arithmetic': """
+int printf(char *format, ...);
+
+int square(int x)
+{
+    return x * x;
+}
+
+int magnitude(int x)
+{
+    return x < 0 ? -x : x;
+}
+
+int max(int a, int b)
+{
+    return a > b ? a : b;
+}
+
+int distance(int x1, int y1, int x2, int y2)
+{
+    return square(magnitude(x1 - x2)) + square(magnitude(y1 - y2));
+}
+
+int main()
+{
+    int i, j, round, best;
+    best = 0;
+    for (round = 0; round < %(rounds)d / 20; round++)
+        for (i = 0; i < 100; i++)
+            for (j = 0; j < 100; j++)
+                best = max(best, distance(i, j, round %% 100, 50) %% 9973);
+    printf("%%lld\\n", best);
+    return 0;
+}
+""",
+    'recursive': """
+int printf(char *format, ...);
+
+int add(int a, int b)
+{
+    return a + b;
+}
+
+int fib(int n)
+{
+    if (n < 2)
+        return n;
+    return add(fib(n - 1), fib(n - 2));
+}
+
+int main()
+{
+    printf("%%lld\\n", fib(%(depth)d));
+    return 0;
+}
+""",
+}
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description=__doc__.strip())
+    arg_parser.add_argument('programs', nargs='*',
+                            default=sorted(PROGRAMS.keys()))
+    arg_parser.add_argument('--size', type=int, default=1000)
+    arg_parser.add_argument('--rounds', type=int, default=20000)
+    arg_parser.add_argument('--depth', type=int, default=32)
+    arg_parser.add_argument('--inline-limit', type=int,
+                            default=DEFAULT_INLINE_LIMIT)
+    arg_parser.add_argument('--repeat', type=int, default=3)
+    arg_parser.add_argument('--lli', default='lli')
+    args = arg_parser.parse_args()
+
+    compiler = Compiler()
+    print "%-10s %-8s %5s %5s %7s %7s %9s %9s" % (
+        "program", "locals", "calls", "after", "lines", "after", "lli s",
+        "after")
+    for name in args.programs:
+        root = compiler.parse(PROGRAMS[name] % vars(args))
+        for ssa_locals in (False, True):
+            codes = [root.generate_code([], ssa_locals=ssa_locals,
+                                        simplify_cfg=True,
+                                        inline_functions=inline_functions,
+                                        inline_limit=args.inline_limit)
+                     for inline_functions in (False, True)]
+            calls = [code.count("call ") for code in codes]
+            sizes = [code.count('\n') for code in codes]
+            try:
+                times = [run(args.lli, code, "", args.repeat)
+                         for code in codes]
+            except OSError:
+                times = [None, None]
+            times = ["-" if t is None else "%.4f" % (t,) for t in times]
+            print "%-10s %-8s %5d %5d %7d %7d %9s %9s" % (
+                (name, "ssa" if ssa_locals else "memory") + tuple(calls) +
+                tuple(sizes) + tuple(times))
+
+
+if __name__ == '__main__':
+    main()
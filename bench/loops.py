@@ -0,0 +1,119 @@
+#!/usr/bin/env python
+"""
+Compiles loop-heavy programs with and without optimizing loops
+(--optimize-loops).
+
+Each program is compiled with local variables kept in memory and in
+registers (--ssa-locals), this reports the number of lines of the
+generated code and the time lli takes to run it, skipped if lli isn't
+installed. Induction variables are only recognized in registers, so
+indexing is only strength reduced with --ssa-locals.
+"""
+from __future__ import absolute_import
+import argparse
+
+from c_llvm.compiler import Compiler
+
+from ssa_locals import run
+
+
+PROGRAMS = {
+    'sum': """
+int printf(char *format, ...);
+int values[%(size)d];
+
+int main()
+{
+    int i, round, sum;
+    for (i = 0; i < %(size)d; i++)
+        values[i] = i %% 7;
+    sum = 0;
+    for (round = 0; round < %(rounds)d; round++)
+        for (i = 0; i < %(size)d; i++)
+            sum = sum + values[i];
+    printf("%%lld\\n", sum);
+    return 0;
+}
+""",
+    'stencil': """
+int printf(char *format, ...);
+int a[%(size)d], b[%(size)d];
+
+int main()
+{
+    int i, round, weight;
+    weight = 3;
+    for (i = 0; i < %(size)d; i++)
+        a[i] = i %% 13;
+    for (round = 0; round < %(rounds)d; round++) {
+        for (i = 1; i < %(size)d - 1; i++)
+            b[i] = (a[i - 1] + a[i] * weight + a[i + 1]) %% 1009;
+        for (i = 1; i < %(size)d - 1; i++)
+            a[i] = b[i];
+    }
+    printf("%%lld\\n", a[%(size)d / 2]);
+    return 0;
+}
+""",
+    'matmul': """
+int printf(char *format, ...);
+int a[%(side)d][%(side)d], b[%(side)d][%(side)d], c[%(side)d][%(side)d];
+
+int main()
+{
+    int i, j, k, round, sum;
+    for (i = 0; i < %(side)d; i++)
+        for (j = 0; j < %(side)d; j++) {
+            a[i][j] = i + j;
+            b[i][j] = i - j;
+        }
+    for (round = 0; round < %(matmul_rounds)d; round++)
+        for (i = 0; i < %(side)d; i++)
+            for (j = 0; j < %(side)d; j++) {
+                sum = 0;
+                for (k = 0; k < %(side)d; k++)
+                    sum = sum + a[i][k] * b[k][j];
+                c[i][j] = sum;
+            }
+    printf("%%lld\\n", c[%(side)d - 1][%(side)d / 2]);
+    return 0;
+}
+""",
+}
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description=__doc__.strip())
+    arg_parser.add_argument('programs', nargs='*',
+                            default=sorted(PROGRAMS.keys()))
+    arg_parser.add_argument('--size', type=int, default=1000)
+    arg_parser.add_argument('--rounds', type=int, default=100000)
+    arg_parser.add_argument('--side', type=int, default=120)
+    arg_parser.add_argument('--matmul-rounds', type=int, default=20)
+    arg_parser.add_argument('--repeat', type=int, default=3)
+    arg_parser.add_argument('--lli', default='lli')
+    args = arg_parser.parse_args()
+
+    compiler = Compiler()
+    print "%-10s %-8s %7s %7s %9s %9s" % ("program", "locals", "lines",
+                                          "after", "lli s", "after")
+    for name in args.programs:
+        root = compiler.parse(PROGRAMS[name] % vars(args))
+        for ssa_locals in (False, True):
+            codes = [root.generate_code([], ssa_locals=ssa_locals,
+                                        optimize_loops=optimize_loops)
+                     for optimize_loops in (False, True)]
+            sizes = [code.count('\n') for code in codes]
+            try:
+                times = [run(args.lli, code, "", args.repeat)
+                         for code in codes]
+            except OSError:
+                times = [None, None]
+            times = ["-" if t is None else "%.4f" % (t,) for t in times]
+            print "%-10s %-8s %7d %7d %9s %9s" % (
+                (name, "ssa" if ssa_locals else "memory") + tuple(sizes) +
+                tuple(times))
+
+
+if __name__ == '__main__':
+    main()
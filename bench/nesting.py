@@ -0,0 +1,114 @@
+#!/usr/bin/env python
+"""
+Measures parsing and code generation on deeply nested expressions and
+statements.
+
+Parsing and code generation are timed separately for each nesting depth.
+If both are linear, the time per nesting level stays flat as the depth
+grows. The if-else and call workloads go through the syntactic
+predicates of selection_statement and assignment_expression, which
+speculatively parse whole statements and operands before parsing them
+for real.
+"""
+from __future__ import absolute_import
+import sys
+# Pop the first entry which is the path to the directory containing this
+# script.
+sys.path.pop(0)
+
+import argparse
+import threading
+import time
+
+from c_llvm.compiler import Compiler
+
+
+def nested_expression(depth):
+    expression = "x"
+    for i in range(depth):
+        expression = "(%s %s x)" % (expression, "+-*"[i % 3])
+    return "int f(int x) { return %s; }\n" % (expression,)
+
+
+def nested_statements(depth):
+    body = "x = x + 1;"
+    for i in range(depth):
+        if i % 2:
+            body = "if (x > %d) { %s } else { x = x - 1; }" % (i, body)
+        else:
+            body = "while (x < %d) { %s }" % (i, body)
+    return "int f(int x) { %s return x; }\n" % (body,)
+
+
+def nested_if_else(depth):
+    body = "x = x + 1;"
+    for i in range(depth):
+        body = "if (x > %d) %s else x = x - 1;" % (i, body)
+    return "int f(int x) { %s return x; }\n" % (body,)
+
+
+def nested_calls(depth):
+    expression = "x"
+    for i in range(depth):
+        expression = "g(%s + %d)" % (expression, i)
+    return ("int g(int x) { return x; }\n"
+            "int f(int x) { %s; return x; }\n" % (expression,))
+
+
+WORKLOADS = [
+    ('expression', nested_expression),
+    ('statement', nested_statements),
+    ('if-else', nested_if_else),
+    ('call', nested_calls),
+]
+
+
+def best_time(function, repeat):
+    best = None
+    for i in range(repeat):
+        start = time.time()
+        result = function()
+        elapsed = time.time() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+
+def measure(compiler, generator, depth, repeat):
+    source = generator(depth)
+    parse_time, root = best_time(lambda: compiler.parse(source), repeat)
+    codegen_time, code = best_time(root.generate_code, repeat)
+    return parse_time, codegen_time, len(code)
+
+
+def run(args):
+    compiler = Compiler()
+    print "%-10s %6s %10s %10s %10s %10s %10s" % (
+        "workload", "depth", "parse s", "us/level", "codegen s",
+        "us/level", "output B")
+    for name, generator in WORKLOADS:
+        for depth in args.depths:
+            parse_time, codegen_time, size = measure(compiler, generator,
+                                                     depth, args.repeat)
+            print "%-10s %6d %10.4f %10.1f %10.4f %10.1f %10d" % (
+                name, depth, parse_time, parse_time / depth * 1e6,
+                codegen_time, codegen_time / depth * 1e6, size)
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description=__doc__.strip())
+    arg_parser.add_argument('--depths', type=int, nargs='+',
+                            default=[50, 100, 200, 400, 800])
+    arg_parser.add_argument('--repeat', type=int, default=3)
+    args = arg_parser.parse_args()
+
+    # Both the parser and the code generator recurse once per nesting
+    # level, so we need a large stack.
+    sys.setrecursionlimit(1000000)
+    threading.stack_size(512 * 1024 * 1024)
+    thread = threading.Thread(target=run, args=(args,))
+    thread.start()
+    thread.join()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,145 @@
+#!/usr/bin/env python
+"""
+Checks that the current grammar parses the same language as a reference
+one.
+
+The reference lexer and parser are loaded from a directory into which
+antlr generated them from another revision of grammar/c_grammar.g, see
+`make check-grammar`. The sample programs in test/, a few generated
+programs and some snippets exercising the ambiguous parts of the
+grammar are parsed by both parsers; their syntax trees (node classes
+and token texts) and the code generated from them have to be identical.
+"""
+from __future__ import absolute_import
+import argparse
+import glob
+import imp
+import os
+
+import antlr3
+
+from c_llvm.ast.base import AstTreeAdaptor
+from c_llvm.compiler import DiagnosticsRecognizerMixin, Lexer, Parser
+from c_llvm.diagnostics import DiagnosticEngine
+from c_llvm.exceptions import CompilationError
+
+from corpus import generate_program
+
+
+TEST_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                        os.pardir, 'test')
+
+SNIPPETS = [
+    ('dangling else',
+     "int f(int x) { if (x) if (x > 1) x = 1; else x = 2; return x; }\n"),
+    ('nested if-else',
+     "int f(int x) { if (x > 0) if (x > 1) x = 1; else if (x > 2) x = 2; "
+     "else x = 3; else x = 4; return x; }\n"),
+    ('chained assignment',
+     "int f(int x) { int y; int z; x = y = z = 1; x += y -= 2; "
+     "return x; }\n"),
+    ('assignment operands',
+     "int f(int *p) { int a[3]; *p = 1; a[1] = *p + 1; p[0] <<= a[1]; "
+     "*(p + 1) = (a[0] = 2); return a[0] ? a[1] : (a[2] = 3); }\n"),
+    ('nested calls',
+     "int g(int x) { return x; }\n"
+     "int f(int x) { g(g(g(x + 1) + 2) + 3); return g(x = g(x)); }\n"),
+    ('comma and conditional',
+     "int f(int x) { int y; y = (x, x + 1); return x ? y = 1, y : x; }\n"),
+    ('typedef in block',
+     "typedef int t;\n"
+     "int f(int x) { t y; y = x; { t z; z = y; y = z; } "
+     "for (t i = 0; i < x; i++) y++; return y; }\n"),
+]
+
+
+def load_reference(directory):
+    """
+    Returns the reference lexer and parser classes, extended to collect
+    their syntax errors the same way as the current ones.
+    """
+    lexer_module = imp.load_source(
+        'reference_c_grammarLexer',
+        os.path.join(directory, 'c_grammarLexer.py'))
+    parser_module = imp.load_source(
+        'reference_c_grammarParser',
+        os.path.join(directory, 'c_grammarParser.py'))
+
+    class ReferenceLexer(DiagnosticsRecognizerMixin,
+                         lexer_module.c_grammarLexer):
+        pass
+
+    class ReferenceParser(DiagnosticsRecognizerMixin,
+                          parser_module.c_grammarParser):
+        pass
+
+    return ReferenceLexer, ReferenceParser
+
+
+def describe(node):
+    """
+    Returns a nested tuple of the node classes and token texts of a tree.
+    """
+    return (type(node).__name__, node.getText(),
+            tuple(describe(child) for child in node.getChildren()))
+
+
+def compile_source(lexer_class, parser_class, source):
+    """
+    Returns a tuple (syntax errors, tree, code or semantic errors).
+    """
+    diagnostics = DiagnosticEngine(0)
+    lexer = lexer_class(antlr3.ANTLRStringStream(source))
+    parser = parser_class(antlr3.CommonTokenStream(lexer))
+    parser.setTreeAdaptor(AstTreeAdaptor())
+    lexer.diagnostics = parser.diagnostics = diagnostics
+    root = parser.translation_unit().tree
+    syntax_errors = [str(diagnostic) for diagnostic in diagnostics.errors]
+    if syntax_errors:
+        return syntax_errors, None, None
+    try:
+        output = root.generate_code()
+    except CompilationError as e:
+        output = [str(diagnostic) for diagnostic in e.diagnostics]
+    return syntax_errors, describe(root), output
+
+
+def check(name, source, reference):
+    """
+    Returns True if both parsers agree on source, otherwise prints what
+    differs.
+    """
+    expected = compile_source(reference[0], reference[1], source)
+    actual = compile_source(Lexer, Parser, source)
+    for what, a, b in zip(("syntax errors", "syntax tree", "output"),
+                          expected, actual):
+        if a != b:
+            print "%s: %s differ:\n  reference: %r\n  current:   %r" % (
+                name, what, a, b)
+            return False
+    return True
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description=__doc__.strip())
+    arg_parser.add_argument('reference', metavar='DIR',
+                            help="directory containing the reference "
+                            "c_grammarLexer.py and c_grammarParser.py")
+    args = arg_parser.parse_args()
+
+    reference = load_reference(args.reference)
+    samples = [(path, open(path).read())
+               for path in sorted(glob.glob(os.path.join(TEST_DIR, '*.c')))]
+    samples.extend(("generated seed=%d" % (seed,), generate_program(seed))
+                   for seed in range(5))
+    samples.extend(SNIPPETS)
+    failed = 0
+    for name, source in samples:
+        if not check(name, source, reference):
+            failed += 1
+    print "%d of %d samples differ" % (failed, len(samples))
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
@@ -0,0 +1,73 @@
+#!/usr/bin/env python
+"""
+Compares the descriptive and the compact register and label names on a
+large generated program.
+
+For both naming schemes this reports the size of the generated code, the
+time to generate it and the time the LLVM assembler takes to parse it.
+The assembler is skipped if it isn't installed.
+"""
+from __future__ import absolute_import
+import argparse
+import os
+import subprocess
+import tempfile
+import time
+
+from c_llvm.compiler import Compiler
+
+from corpus import generate_program
+
+
+def best_time(function, repeat):
+    best = None
+    for i in range(repeat):
+        start = time.time()
+        result = function()
+        elapsed = time.time() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+
+def assemble(llvm_as, code):
+    """
+    Runs llvm_as on code and returns whether it succeeded.
+    """
+    with tempfile.NamedTemporaryFile(suffix='.ll') as f:
+        f.write(code)
+        f.flush()
+        with open(os.devnull, 'w') as devnull:
+            return subprocess.call([llvm_as, '-o', os.devnull, f.name],
+                                   stderr=devnull) == 0
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description=__doc__.strip())
+    arg_parser.add_argument('--functions', type=int, default=256)
+    arg_parser.add_argument('--repeat', type=int, default=3)
+    arg_parser.add_argument('--llvm-as', default='llvm-as',
+                            help="assembler used to measure the parse time")
+    args = arg_parser.parse_args()
+
+    source = generate_program(functions=args.functions)
+    root = Compiler().parse(source)
+
+    print "%-12s %10s %10s %10s" % ("names", "bytes", "codegen s",
+                                    "llvm-as s")
+    for compact_names in (False, True):
+        codegen_time, code = best_time(
+            lambda: root.generate_code([], compact_names=compact_names),
+            args.repeat)
+        try:
+            parse_time, ok = best_time(lambda: assemble(args.llvm_as, code),
+                                       args.repeat)
+            parse_time = "%10.4f" % (parse_time,) if ok else "%10s" % "failed"
+        except OSError:
+            parse_time = "%10s" % "-"
+        print "%-12s %10d %10.4f %s" % (
+            "compact" if compact_names else "descriptive", len(code),
+            codegen_time, parse_time)
+
+
+if __name__ == '__main__':
+    main()
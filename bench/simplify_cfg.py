@@ -0,0 +1,64 @@
+#!/usr/bin/env python
+"""
+Compares the programs in test/ compiled with and without cleaning up the
+control flow graph (--simplify-cfg).
+
+For each program this reports the number of lines and bytes of the
+generated code and the time lli takes to load and run it, with the
+given input on stdin. Programs which don't compile are skipped, lli is
+skipped if it isn't installed.
+"""
+from __future__ import absolute_import
+import argparse
+import glob
+import os
+
+from c_llvm.compiler import Compiler
+from c_llvm.exceptions import CompilationError
+
+from ssa_locals import TEST_DIR, run
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description=__doc__.strip())
+    arg_parser.add_argument('files', nargs='*',
+                            default=sorted(glob.glob(os.path.join(TEST_DIR,
+                                                                  '*.c'))))
+    arg_parser.add_argument('--repeat', type=int, default=3)
+    arg_parser.add_argument('--input', default="10\n",
+                            help="standard input of the programs")
+    arg_parser.add_argument('--ssa-locals', action='store_true',
+                            help="compile with --ssa-locals as well")
+    arg_parser.add_argument('--lli', default='lli')
+    args = arg_parser.parse_args()
+
+    compiler = Compiler()
+    print "%-16s %7s %7s %8s %8s %9s %9s" % (
+        "program", "lines", "after", "bytes", "after", "lli s", "after")
+    totals = [0, 0, 0, 0]
+    for path in args.files:
+        with open(path) as f:
+            source = f.read()
+        try:
+            root = compiler.parse(source)
+            codes = [root.generate_code([], ssa_locals=args.ssa_locals,
+                                        simplify_cfg=simplify_cfg)
+                     for simplify_cfg in (False, True)]
+        except CompilationError:
+            continue
+        sizes = [code.count('\n') for code in codes]
+        sizes += [len(code) for code in codes]
+        totals = [total + size for total, size in zip(totals, sizes)]
+        try:
+            times = [run(args.lli, code, args.input, args.repeat)
+                     for code in codes]
+        except OSError:
+            times = [None, None]
+        times = ["-" if t is None else "%.4f" % (t,) for t in times]
+        print "%-16s %7d %7d %8d %8d %9s %9s" % (
+            (os.path.basename(path),) + tuple(sizes) + tuple(times))
+    print "%-16s %7d %7d %8d %8d" % (("total",) + tuple(totals))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,86 @@
+#!/usr/bin/env python
+"""
+Compares the programs in test/ compiled with and without keeping local
+variables in registers (--ssa-locals).
+
+For each program this reports the number of memory instructions (alloca,
+load and store) in the generated code and the time lli takes to run it,
+with the given input on stdin. Programs which don't compile are skipped,
+lli is skipped if it isn't installed.
+"""
+from __future__ import absolute_import
+import argparse
+import glob
+import os
+import re
+import subprocess
+import tempfile
+import time
+
+from c_llvm.compiler import Compiler
+from c_llvm.exceptions import CompilationError
+
+
+TEST_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                        os.pardir, 'test')
+MEMORY_INSTRUCTION = re.compile(r'^(%\S+ = (alloca|load) |store )', re.M)
+
+
+def run(lli, code, input, repeat):
+    """
+    Returns the best time of running code with lli, or None if it fails.
+    """
+    best = None
+    with tempfile.NamedTemporaryFile(suffix='.ll') as f:
+        f.write(code)
+        f.flush()
+        for i in range(repeat):
+            process = subprocess.Popen([lli, f.name], stdin=subprocess.PIPE,
+                                       stdout=subprocess.PIPE,
+                                       stderr=subprocess.PIPE)
+            start = time.time()
+            process.communicate(input)
+            elapsed = time.time() - start
+            if process.returncode < 0:
+                return None
+            best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description=__doc__.strip())
+    arg_parser.add_argument('files', nargs='*',
+                            default=sorted(glob.glob(os.path.join(TEST_DIR,
+                                                                  '*.c'))))
+    arg_parser.add_argument('--repeat', type=int, default=3)
+    arg_parser.add_argument('--input', default="10\n",
+                            help="standard input of the programs")
+    arg_parser.add_argument('--lli', default='lli')
+    args = arg_parser.parse_args()
+
+    compiler = Compiler()
+    print "%-16s %10s %10s %10s %10s" % ("program", "memory", "ssa memory",
+                                         "lli s", "ssa lli s")
+    for path in args.files:
+        with open(path) as f:
+            source = f.read()
+        try:
+            root = compiler.parse(source)
+            codes = [root.generate_code([], ssa_locals=ssa_locals)
+                     for ssa_locals in (False, True)]
+        except CompilationError:
+            continue
+        counts = [len(MEMORY_INSTRUCTION.findall(code)) for code in codes]
+        try:
+            times = [run(args.lli, code, args.input, args.repeat)
+                     for code in codes]
+        except OSError:
+            times = [None, None]
+        times = ["-" if t is None else "%.4f" % (t,) for t in times]
+        print "%-16s %10d %10d %10s %10s" % (os.path.basename(path),
+                                             counts[0], counts[1],
+                                             times[0], times[1])
+
+
+if __name__ == '__main__':
+    main()
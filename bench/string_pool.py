@@ -0,0 +1,36 @@
+#!/usr/bin/env python
+"""
+Reports the number of string constants and the size of the output for a
+generated program full of printf calls, with and without sharing the
+suffixes of strings.
+"""
+from __future__ import absolute_import
+import argparse
+
+from c_llvm.compiler import Compiler
+
+from corpus import generate_program
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description=__doc__.strip())
+    arg_parser.add_argument('--functions', type=int, default=64)
+    arg_parser.add_argument('--strings', type=int, default=2000,
+                            help="number of string literal occurrences")
+    args = arg_parser.parse_args()
+
+    source = generate_program(functions=args.functions,
+                              strings=args.strings)
+    root = Compiler().parse(source)
+
+    print "literals: %d" % (args.strings,)
+    print "%-16s %10s %10s" % ("suffixes", "globals", "bytes")
+    for share in (False, True):
+        code = root.generate_code([], share_string_suffixes=share)
+        print "%-16s %10d %10d" % ("shared" if share else "separate",
+                                   code.count("unnamed_addr constant"),
+                                   len(code))
+
+
+if __name__ == '__main__':
+    main()
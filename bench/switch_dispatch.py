@@ -0,0 +1,91 @@
+#!/usr/bin/env python
+"""
+Compiles interpreter-style dispatch loops over switch statements with
+thousands of cases.
+
+The generated program runs a loop dispatching on an opcode: one switch
+updates an accumulator differently in each case, another one only
+returns a constant per case, which --simplify-cfg turns into a lookup
+table. For each number of cases this reports the time it takes to
+generate the code with and without --simplify-cfg, which should grow
+linearly, and the time lli takes to run the results, skipped if lli
+isn't installed.
+"""
+from __future__ import absolute_import
+import argparse
+import time
+
+from c_llvm.compiler import Compiler
+
+from ssa_locals import run
+
+
+OPERATIONS = [
+    "acc = acc + %d;",
+    "acc = acc * 3 %% 1000003 + %d;",
+    "acc = acc ^ %d;",
+    "acc = acc - %d / 2;",
+]
+
+
+def generate_program(cases, iterations):
+    lines = ["int printf(char *format, ...);", "",
+             "int step(int op, int acc)", "{", "    switch (op) {"]
+    for case in range(cases):
+        lines.append("        case %d: %s break;" % (
+            case, OPERATIONS[case % len(OPERATIONS)] % (case,)))
+    lines += ["    }", "    return acc;", "}", "",
+              "int cost(int op)", "{", "    switch (op) {"]
+    for case in range(cases):
+        lines.append("        case %d: return %d;" % (case, case * 7 % 13))
+    lines += ["    }", "    return 1;", "}", "",
+              "int main()", "{", "    int i, acc, op;",
+              "    acc = 0;", "    op = 0;",
+              "    for (i = 0; i < %d; i++) {" % (iterations,),
+              "        acc = step(op, acc) % 1000003;",
+              "        op = (op + cost(op) + 1) %% %d;" % (cases,),
+              "    }",
+              '    printf("%lld\\n", acc);',
+              "    return 0;", "}"]
+    return "\n".join(lines) + "\n"
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description=__doc__.strip())
+    arg_parser.add_argument('--cases', type=int, nargs='+',
+                            default=[500, 1000, 2000, 4000])
+    arg_parser.add_argument('--iterations', type=int, default=1000000)
+    arg_parser.add_argument('--repeat', type=int, default=3)
+    arg_parser.add_argument('--ssa-locals', action='store_true',
+                            help="compile with --ssa-locals as well")
+    arg_parser.add_argument('--lli', default='lli')
+    args = arg_parser.parse_args()
+
+    compiler = Compiler()
+    print "%-8s %10s %10s %10s %10s" % ("cases", "codegen s", "simplify s",
+                                        "lli s", "simplify s")
+    for cases in args.cases:
+        root = compiler.parse(generate_program(cases, args.iterations))
+        codes, times = [], []
+        for simplify_cfg in (False, True):
+            best = None
+            for i in range(args.repeat):
+                start = time.time()
+                code = root.generate_code([], ssa_locals=args.ssa_locals,
+                                          simplify_cfg=simplify_cfg)
+                elapsed = time.time() - start
+                best = elapsed if best is None else min(best, elapsed)
+            codes.append(code)
+            times.append(best)
+        try:
+            run_times = [run(args.lli, code, "", args.repeat)
+                         for code in codes]
+        except OSError:
+            run_times = [None, None]
+        run_times = ["-" if t is None else "%.4f" % (t,) for t in run_times]
+        print "%-8d %10.4f %10.4f %10s %10s" % (cases, times[0], times[1],
+                                                run_times[0], run_times[1])
+
+
+if __name__ == '__main__':
+    main()
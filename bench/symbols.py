@@ -0,0 +1,73 @@
+#!/usr/bin/env python
+"""
+Micro-benchmark of the scoped symbol table under deep nesting.
+
+For each depth, that many scopes are pushed with a number of identifiers
+declared in each of them. Then names from all the scopes, and names
+which aren't defined at all, are looked up from the innermost scope.
+Finally, all scopes are popped again. With constant-time lookups the
+time per lookup stays flat as the depth grows.
+"""
+from __future__ import absolute_import
+import sys
+# Pop the first entry which is the path to the directory containing this
+# script.
+sys.path.pop(0)
+
+import argparse
+import random
+import time
+
+from c_llvm.traversal_state import ScopedSymbolTable
+
+
+def measure(depth, identifiers, lookups):
+    table = ScopedSymbolTable()
+    names = []
+    start = time.time()
+    for level in range(depth):
+        table.push()
+        for i in range(identifiers):
+            name = "v%d_%d" % (level, i)
+            table[name] = level
+            names.append(name)
+        # Shadow a name from the outermost scope in every scope.
+        table['shadowed'] = level
+    push_time = time.time() - start
+
+    rng = random.Random(depth)
+    queries = [rng.choice(names) for i in range(lookups)]
+    queries.extend("undefined%d" % (i,) for i in range(lookups // 10))
+
+    start = time.time()
+    for name in queries:
+        table.get(name)
+        table['shadowed']
+    lookup_time = time.time() - start
+
+    start = time.time()
+    for level in range(depth):
+        table.pop()
+    pop_time = time.time() - start
+    return push_time, lookup_time / len(queries), pop_time
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description=__doc__.strip())
+    arg_parser.add_argument('--depths', type=int, nargs='+',
+                            default=[1, 10, 100, 1000])
+    arg_parser.add_argument('--identifiers', type=int, default=20,
+                            help="identifiers declared in each scope")
+    arg_parser.add_argument('--lookups', type=int, default=100000)
+    args = arg_parser.parse_args()
+
+    print "%6s %10s %12s %10s" % ("depth", "push s", "ns/lookup", "pop s")
+    for depth in args.depths:
+        push_time, lookup_time, pop_time = measure(depth, args.identifiers,
+                                                   args.lookups)
+        print "%6d %10.4f %12.0f %10.4f" % (depth, push_time,
+                                           lookup_time * 1e9, pop_time)
+
+
+if __name__ == '__main__':
+    main()
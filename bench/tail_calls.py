@@ -0,0 +1,116 @@
+#!/usr/bin/env python
+"""
+Compiles recursive programs with and without optimizing tail calls
+(--optimize-tail-calls).
+
+Each program is compiled with local variables kept in memory and in
+registers (--ssa-locals). This reports the number of calls and lines of
+the generated code and the time lli takes to run it, skipped if lli
+isn't installed. A program which runs out of stack is reported as "-".
+"""
+from __future__ import absolute_import
+import argparse
+
+from c_llvm.compiler import Compiler
+
+from ssa_locals import run
+
+
+PROGRAMS = {
+    'gcd': """
+int printf(char *format, ...);
+
+int gcd(int a, int b)
+{
+    if (b == 0)
+        return a;
+    return gcd(b, a %% b);
+}
+
+int main()
+{
+    int i, total;
+    total = 0;
+    for (i = 1; i < %(rounds)d; i++)
+        total = total + gcd(i * 7919, 1000003);
+    printf("%%lld\\n", total);
+    return 0;
+}
+""",
+    'sum': """
+int printf(char *format, ...);
+
+int sum(int n)
+{
+    if (n == 0)
+        return 0;
+    return n + sum(n - 1);
+}
+
+int main()
+{
+    int round, total;
+    total = 0;
+    for (round = 0; round < %(rounds)d / 1000; round++)
+        total = total + sum(%(depth)d - round %% 10) %% 1000;
+    printf("%%lld\\n", total);
+    return 0;
+}
+""",
+    'countdown': """
+int printf(char *format, ...);
+int steps;
+
+void count_down(int n)
+{
+    if (n == 0)
+        return;
+    steps = steps + 1;
+    count_down(n - 1);
+}
+
+int main()
+{
+    count_down(%(depth)d * 100);
+    printf("%%lld\\n", steps);
+    return 0;
+}
+""",
+}
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description=__doc__.strip())
+    arg_parser.add_argument('programs', nargs='*',
+                            default=sorted(PROGRAMS.keys()))
+    arg_parser.add_argument('--rounds', type=int, default=1000000)
+    arg_parser.add_argument('--depth', type=int, default=10000)
+    arg_parser.add_argument('--repeat', type=int, default=3)
+    arg_parser.add_argument('--lli', default='lli')
+    args = arg_parser.parse_args()
+
+    compiler = Compiler()
+    print "%-10s %-8s %5s %5s %7s %7s %9s %9s" % (
+        "program", "locals", "calls", "after", "lines", "after", "lli s",
+        "after")
+    for name in args.programs:
+        root = compiler.parse(PROGRAMS[name] % vars(args))
+        for ssa_locals in (False, True):
+            codes = [root.generate_code([], ssa_locals=ssa_locals,
+                                        optimize_tail_calls=optimize)
+                     for optimize in (False, True)]
+            calls = [code.count("call ") for code in codes]
+            sizes = [code.count('\n') for code in codes]
+            try:
+                times = [run(args.lli, code, "", args.repeat)
+                         for code in codes]
+            except OSError:
+                times = [None, None]
+            times = ["-" if t is None else "%.4f" % (t,) for t in times]
+            print "%-10s %-8s %5d %5d %7d %7d %9s %9s" % (
+                (name, "ssa" if ssa_locals else "memory") + tuple(calls) +
+                tuple(sizes) + tuple(times))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,130 @@
+#!/usr/bin/env python
+"""
+Measures the throughput of the compiler on synthetic programs.
+
+Each axis scales one knob of the corpus generator while the others keep
+their default values. Lexing, parsing and code generation are timed
+separately. With --save the results are stored as a baseline, otherwise
+they are compared against the stored baseline, if there is one, and the
+script fails if any phase got slower than the allowed threshold.
+"""
+from __future__ import absolute_import
+import argparse
+import json
+import os
+
+from c_llvm.compiler import Compiler
+from c_llvm.timing import PhaseTimer
+
+from corpus import generate_program
+
+
+AXES = [
+    ('functions', [4, 8, 16, 32]),
+    ('statements', [10, 20, 40, 80]),
+    ('expression_length', [2, 4, 8, 16]),
+    ('nesting', [1, 2, 3, 4]),
+    ('strings', [16, 64, 256, 1024]),
+    ('structs', [1, 4, 16, 64]),
+]
+
+PHASES = ('lex', 'parse', 'codegen')
+
+DEFAULT_BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                'throughput-baseline.json')
+
+
+def measure_once(compiler, source):
+    timer = PhaseTimer()
+    root = compiler.parse(source, timer)
+    with timer.phase('codegen'):
+        root.generate_code([])
+    return dict((phase['phase'], phase['wall']) for phase in timer.phases)
+
+
+def measure(compiler, source, repeat):
+    """
+    Returns the best time of each phase out of the given number of runs.
+    """
+    best = {}
+    for i in range(repeat):
+        for phase, elapsed in measure_once(compiler, source).items():
+            best[phase] = min(elapsed, best.get(phase, elapsed))
+    return best
+
+
+def run(args):
+    compiler = Compiler()
+    results = {}
+    print "%-18s %6s %7s %9s %9s %9s %11s" % (
+        "axis", "value", "lines", "lex s", "parse s", "codegen s",
+        "lines/s")
+    for axis, values in AXES:
+        if args.axes and axis not in args.axes:
+            continue
+        for value in values:
+            source = generate_program(args.seed, **{axis: value})
+            lines = source.count('\n')
+            timings = measure(compiler, source, args.repeat)
+            total = sum(timings.values())
+            print "%-18s %6d %7d %9.4f %9.4f %9.4f %11.0f" % (
+                axis, value, lines, timings['lex'], timings['parse'],
+                timings['codegen'], lines / total)
+            timings['lines'] = lines
+            results["%s=%d" % (axis, value)] = timings
+    return results
+
+
+def compare(results, baseline, threshold):
+    """
+    Prints every measurement which is slower than the baseline by more
+    than the threshold. Returns the number of such measurements.
+    """
+    regressions = 0
+    for point, timings in sorted(results.items()):
+        if point not in baseline:
+            continue
+        for phase in PHASES:
+            old, new = baseline[point][phase], timings[phase]
+            if old > 0 and new / old > threshold:
+                print "regression: %s %s %.4fs -> %.4fs (%.2fx)" % (
+                    point, phase, old, new, new / old)
+                regressions += 1
+    return regressions
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description=__doc__.strip())
+    arg_parser.add_argument('--axes', nargs='+', metavar='AXIS',
+                            choices=[axis for axis, values in AXES],
+                            help="only measure the given axes")
+    arg_parser.add_argument('--repeat', type=int, default=3)
+    arg_parser.add_argument('--seed', type=int, default=0)
+    arg_parser.add_argument('--baseline', default=DEFAULT_BASELINE,
+                            metavar='FILE')
+    arg_parser.add_argument('--save', action='store_true',
+                            help="store the results as the new baseline")
+    arg_parser.add_argument('--threshold', type=float, default=1.25,
+                            help="maximum allowed ratio of the measured "
+                            "time to the baseline")
+    args = arg_parser.parse_args()
+
+    results = run(args)
+    if args.save:
+        baseline = {}
+        if os.path.exists(args.baseline):
+            with open(args.baseline) as f:
+                baseline = json.load(f)
+        baseline.update(results)
+        with open(args.baseline, 'w') as f:
+            json.dump(baseline, f, indent=2, sort_keys=True)
+        return 0
+    if not os.path.exists(args.baseline):
+        return 0
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    return 1 if compare(results, baseline, args.threshold) else 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
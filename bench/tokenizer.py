@@ -0,0 +1,115 @@
+#!/usr/bin/env python
+"""
+Compares the fast lexer against the lexer generated by antlr.
+
+First both lexers are run on the sample programs in test/ and on a few
+generated programs, and the tokens on the default channel are checked to
+be identical (type, text, line and column). Then the throughput of both
+lexers is measured on generated programs of increasing size.
+"""
+from __future__ import absolute_import
+import argparse
+import glob
+import os
+import time
+
+import antlr3
+
+from c_llvm.lexer import FastLexer
+from c_llvm.parser.c_grammarLexer import c_grammarLexer
+from c_llvm.parser.c_grammarParser import c_grammarParser
+
+from corpus import generate_program
+
+
+TEST_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                        os.pardir, 'test')
+
+
+def antlr_tokens(source):
+    lexer = c_grammarLexer(antlr3.ANTLRStringStream(source))
+    tokens = antlr3.CommonTokenStream(lexer)
+    tokens.fillBuffer()
+    return tokens.tokens
+
+
+def fast_tokens(source, lexer=None):
+    if lexer is None:
+        lexer = FastLexer(c_grammarParser.tokenNames)
+    lexer.set_source(source)
+    tokens = antlr3.CommonTokenStream(lexer)
+    tokens.fillBuffer()
+    return tokens.tokens
+
+
+def describe(token):
+    return (c_grammarParser.tokenNames[token.type], token.text, token.line,
+            token.charPositionInLine)
+
+
+def check(name, source):
+    """
+    Returns True if both lexers agree on source, otherwise prints the
+    first difference.
+    """
+    expected = map(describe, antlr_tokens(source))
+    actual = map(describe, fast_tokens(source))
+    if expected == actual:
+        return True
+    for index, (a, b) in enumerate(zip(expected, actual)):
+        if a != b:
+            print "%s: token %d differs: antlr %r, fast %r" % (
+                name, index, a, b)
+            return False
+    print "%s: antlr produced %d tokens, fast %d" % (
+        name, len(expected), len(actual))
+    return False
+
+
+def measure(function, source, repeat):
+    best = None
+    for i in range(repeat):
+        start = time.time()
+        count = len(function(source))
+        elapsed = time.time() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, count
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description=__doc__.strip())
+    arg_parser.add_argument('--sizes', type=int, nargs='+',
+                            default=[4, 16, 64],
+                            help="numbers of functions of the generated "
+                            "programs")
+    arg_parser.add_argument('--repeat', type=int, default=3)
+    args = arg_parser.parse_args()
+
+    samples = [(path, open(path).read())
+               for path in sorted(glob.glob(os.path.join(TEST_DIR, '*.c')))]
+    samples.extend(("generated seed=%d" % (seed,), generate_program(seed))
+                   for seed in range(5))
+    failed = 0
+    for name, source in samples:
+        if not check(name, source):
+            failed += 1
+    print "differential check: %d of %d samples differ" % (failed,
+                                                          len(samples))
+
+    print "%8s %8s %10s %10s %12s %12s %8s" % (
+        "funcs", "tokens", "antlr s", "fast s", "antlr tok/s",
+        "fast tok/s", "speedup")
+    lexer = FastLexer(c_grammarParser.tokenNames)
+    for size in args.sizes:
+        source = generate_program(functions=size)
+        antlr_time, count = measure(antlr_tokens, source, args.repeat)
+        fast_time, count = measure(lambda s: fast_tokens(s, lexer), source,
+                                   args.repeat)
+        print "%8d %8d %10.4f %10.4f %12.0f %12.0f %7.1fx" % (
+            size, count, antlr_time, fast_time, count / antlr_time,
+            count / fast_time, antlr_time / fast_time)
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
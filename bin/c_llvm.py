@@ -5,29 +5,283 @@ import sys
 # script.
 sys.path.pop(0)
 
-import os.path
-
-import antlr3
-
-from c_llvm.parser.c_grammarLexer import c_grammarLexer
-from c_llvm.parser.c_grammarParser import c_grammarParser
-from c_llvm.ast.base import AstTreeAdaptor
-
-# input = '...what you want to feed into the parser...'
-# char_stream = antlr3.ANTLRStringStream(input)
-# or to parse a file:
-char_stream = antlr3.ANTLRFileStream(sys.argv[1])
-# or to parse an opened file or any other file-like object:
-# char_stream = antlr3.ANTLRInputStream(file)
-
-lexer = c_grammarLexer(char_stream)
-tokens = antlr3.CommonTokenStream(lexer)
-parser = c_grammarParser(tokens)
-parser.setTreeAdaptor(AstTreeAdaptor())
-r = parser.translation_unit()
-
-root = r.tree
-print "tree = " + root.toStringTree()
-output_file = os.path.splitext(sys.argv[1])[0] + '.ll'
-with open(output_file, 'w') as f:
-    f.write(root.generate_code())
+import argparse
+import json
+import multiprocessing
+import os
+import threading
+import time
+
+from c_llvm.cache import CompilationCache
+from c_llvm.compiler import Compiler
+from c_llvm.diagnostics import DEFAULT_ERROR_LIMIT, Diagnostic
+from c_llvm.inliner import DEFAULT_INLINE_LIMIT
+from c_llvm.server import CompileServer
+from c_llvm.timing import NullTimer, PhaseTimer
+
+
+# The lexer and parser are expensive to set up, each process keeps one
+# compiler instance and only swaps the input between files.
+_compiler = None
+_print_tree = False
+
+
+def init_worker(cache_args=(), time_report=False, print_tree=False,
+                fast_lexer=False, codegen_options=None):
+    global _compiler, _print_tree
+    cache = CompilationCache(*cache_args) if cache_args else None
+    _compiler = Compiler(cache, time_report, fast_lexer,
+                         **(codegen_options or {}))
+    _print_tree = print_tree
+
+
+def compile_source(source):
+    return _compiler.compile_string(source)
+
+
+def compile_file(filename):
+    """
+    Compiles a single file into a .ll file next to it. Returns a tuple
+    (filename, number of lines, success, list of diagnostics, list of
+    phase timings).
+    """
+    timer = PhaseTimer() if _compiler.time_report else NullTimer()
+    try:
+        with timer.phase('read'):
+            with open(filename) as f:
+                source = f.read()
+    except IOError as e:
+        return (filename, 0, False,
+                [Diagnostic('error', None, None, e.strerror)],
+                list(timer.phases))
+    lines = source.count('\n')
+    output_file = os.path.splitext(filename)[0] + '.ll'
+
+    # Any exception has to be turned into a diagnostic for this file,
+    # otherwise it would abort the compilation of all the other files.
+    try:
+        result = _compiler.compile_string(source, timer=timer,
+                                          print_tree=_print_tree)
+        if not result.ok:
+            return (filename, lines, False, result.diagnostics,
+                    list(timer.phases))
+
+        with timer.phase('write'):
+            with open(output_file, 'w') as f:
+                f.write(result.code)
+    except EnvironmentError as e:
+        message = e.strerror or str(e)
+        if e.filename:
+            message = "%s: %s" % (e.filename, message)
+        return (filename, lines, False,
+                [Diagnostic('error', None, None, message)],
+                list(timer.phases))
+    except Exception as e:
+        return (filename, lines, False,
+                [Diagnostic('error', None, None,
+                            "internal compiler error: %s: %s" % (
+                                type(e).__name__, e))],
+                list(timer.phases))
+    return filename, lines, True, result.diagnostics, list(timer.phases)
+
+
+def serve(socket_path, jobs, idle_timeout, cache_args, fast_lexer,
+          codegen_options):
+    """
+    Runs the compile server. With more than one job the requests are
+    compiled on a pool of warm worker processes, otherwise in this
+    process one at a time.
+    """
+    if jobs > 1:
+        pool = multiprocessing.Pool(jobs, initializer=init_worker,
+                                    initargs=(cache_args, False, False,
+                                              fast_lexer, codegen_options))
+
+        def compile_function(source):
+            return pool.apply(compile_source, (source,))
+    else:
+        pool = None
+        init_worker(cache_args, fast_lexer=fast_lexer,
+                    codegen_options=codegen_options)
+        lock = threading.Lock()
+
+        def compile_function(source):
+            with lock:
+                return compile_source(source)
+
+    server = CompileServer(socket_path, compile_function, idle_timeout)
+    try:
+        server.serve()
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+    return 0
+
+
+def print_cache_stats(cache_args, arg_parser):
+    if not cache_args:
+        arg_parser.error("--cache-stats requires a cache directory")
+    stats = CompilationCache(*cache_args).get_stats()
+    print json.dumps(stats, indent=2, sort_keys=True)
+    return 0
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(
+        description="Compile C source files into LLVM assembly.")
+    arg_parser.add_argument('files', nargs='*', metavar='FILE')
+    arg_parser.add_argument('-j', '--jobs', type=int, default=1,
+                            help="number of worker processes")
+    arg_parser.add_argument('--serve', metavar='SOCKET',
+                            help="run as a compile server listening on "
+                            "the given Unix domain socket")
+    arg_parser.add_argument('--idle-timeout', type=float, default=600,
+                            metavar='SECONDS',
+                            help="shut the server down after being idle "
+                            "for this long (0 means never)")
+    arg_parser.add_argument('--cache-dir', metavar='DIR',
+                            default=os.environ.get('C_LLVM_CACHE_DIR'),
+                            help="cache compiled outputs in DIR "
+                            "(default: $C_LLVM_CACHE_DIR)")
+    arg_parser.add_argument('--cache-size', type=int, default=256,
+                            metavar='MB',
+                            help="maximum size of the cache")
+    arg_parser.add_argument('--cache-stats', action='store_true',
+                            help="print the cache statistics")
+    arg_parser.add_argument('--time-report', nargs='?', const='text',
+                            choices=('text', 'json'),
+                            help="print wall time, CPU time and peak "
+                            "memory of each compilation phase")
+    arg_parser.add_argument('--print-tree', action='store_true',
+                            help="print the syntax tree of each file")
+    arg_parser.add_argument('--fast-lexer', action='store_true',
+                            help="use the regular expression based lexer "
+                            "instead of the one generated by antlr")
+    arg_parser.add_argument('--compact-names', action='store_true',
+                            help="emit short register and label names "
+                            "instead of descriptive ones")
+    arg_parser.add_argument('--share-string-suffixes', action='store_true',
+                            help="store string constants which end "
+                            "another one inside of it")
+    arg_parser.add_argument('--ssa-locals', action='store_true',
+                            help="keep local variables whose address is "
+                            "never taken in registers instead of memory")
+    arg_parser.add_argument('--optimize-tail-calls', action='store_true',
+                            help="turn functions returning the result of "
+                            "calling themselves into loops and mark other "
+                            "calls followed by a return as tail calls")
+    arg_parser.add_argument('--inline-functions', action='store_true',
+                            help="replace calls to small functions defined "
+                            "in the same file with their body")
+    arg_parser.add_argument('-finline-limit', '--inline-limit', type=int,
+                            default=DEFAULT_INLINE_LIMIT, metavar='N',
+                            dest='inline_limit',
+                            help="only inline functions adding at most N "
+                            "instructions to a caller (default: "
+                            "%(default)s)")
+    arg_parser.add_argument('--simplify-cfg', action='store_true',
+                            help="remove unreachable code and merge blocks "
+                            "which only jump to another one")
+    arg_parser.add_argument('--optimize-loops', action='store_true',
+                            help="move code computing the same value on "
+                            "each iteration out of loops and index arrays "
+                            "with pointers advanced by each iteration")
+    arg_parser.add_argument('-ferror-limit', '--error-limit', type=int,
+                            default=DEFAULT_ERROR_LIMIT, metavar='N',
+                            dest='error_limit',
+                            help="stop compiling a file after N errors, 0 "
+                            "means no limit (default: %(default)s)")
+    arg_parser.add_argument('--diagnostics-format', default='text',
+                            choices=('text', 'json'),
+                            help="print diagnostics as text or as one JSON "
+                            "object per line")
+    args = arg_parser.parse_args()
+    codegen_options = {
+        'compact_names': args.compact_names,
+        'error_limit': args.error_limit,
+        'inline_functions': args.inline_functions,
+        'inline_limit': args.inline_limit,
+        'optimize_loops': args.optimize_loops,
+        'optimize_tail_calls': args.optimize_tail_calls,
+        'share_string_suffixes': args.share_string_suffixes,
+        'simplify_cfg': args.simplify_cfg,
+        'ssa_locals': args.ssa_locals,
+    }
+
+    if args.cache_dir:
+        cache_args = (args.cache_dir, args.cache_size * 1024 * 1024)
+    else:
+        cache_args = ()
+
+    if args.serve:
+        return serve(args.serve, args.jobs, args.idle_timeout or None,
+                     cache_args, args.fast_lexer, codegen_options)
+    if args.cache_stats and not args.files:
+        return print_cache_stats(cache_args, arg_parser)
+    if not args.files:
+        arg_parser.error("no input files")
+
+    start = time.time()
+    if args.jobs > 1 and len(args.files) > 1:
+        pool = multiprocessing.Pool(args.jobs, initializer=init_worker,
+                                    initargs=(cache_args,
+                                              bool(args.time_report),
+                                              args.print_tree,
+                                              args.fast_lexer,
+                                              codegen_options))
+        results = pool.imap_unordered(compile_file, args.files)
+    else:
+        pool = None
+        init_worker(cache_args, bool(args.time_report), args.print_tree,
+                    args.fast_lexer, codegen_options)
+        results = (compile_file(filename) for filename in args.files)
+
+    failed, total_lines = 0, 0
+    time_reports = []
+    for filename, lines, ok, diagnostics, phases in results:
+        total_lines += lines
+        if not ok:
+            failed += 1
+        for diagnostic in diagnostics:
+            if args.diagnostics_format == 'json':
+                data = diagnostic.to_dict()
+                data['file'] = filename
+                print >>sys.stderr, json.dumps(data, sort_keys=True)
+            else:
+                print >>sys.stderr, diagnostic.format(filename)
+        if args.time_report:
+            time_reports.append({
+                'file': filename,
+                'lines': lines,
+                'phases': phases,
+            })
+
+    if pool is not None:
+        pool.close()
+        pool.join()
+
+    elapsed = max(time.time() - start, 1e-9)
+    print >>sys.stderr, ("%d files (%d failed), %d lines in %.3fs: "
+                         "%.1f files/s, %.1f lines/s" % (
+                             len(args.files), failed, total_lines, elapsed,
+                             len(args.files) / elapsed,
+                             total_lines / elapsed))
+    if args.time_report == 'json':
+        print json.dumps(time_reports, indent=2)
+    elif args.time_report:
+        for report in time_reports:
+            timer = PhaseTimer()
+            timer.phases = report['phases']
+            print >>sys.stderr, "%s (%d lines):" % (report['file'],
+                                                   report['lines'])
+            print >>sys.stderr, timer.format_report()
+    if args.cache_stats:
+        if _compiler is not None and _compiler.cache is not None:
+            _compiler.cache.flush_stats()
+        print_cache_stats(cache_args, arg_parser)
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,67 @@
+#!/usr/bin/env python
+"""
+Thin client for the compile server started with `c_llvm.py --serve`.
+Accepts the same file arguments as c_llvm.py, but doesn't load the
+parser at all.
+"""
+from __future__ import absolute_import
+import sys
+# Pop the first entry which is the path to the directory containing this
+# script.
+sys.path.pop(0)
+
+import argparse
+import json
+import os.path
+import socket
+
+from c_llvm.diagnostics import Diagnostic
+from c_llvm.server import send_request
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(
+        description="Compile C source files using a running compile "
+        "server.")
+    arg_parser.add_argument('files', nargs='*', metavar='FILE')
+    arg_parser.add_argument('-s', '--socket', required=True,
+                            help="path to the server socket")
+    arg_parser.add_argument('--stats', action='store_true',
+                            help="print the server statistics")
+    arg_parser.add_argument('--shutdown', action='store_true',
+                            help="stop the server")
+    args = arg_parser.parse_args()
+
+    failed = 0
+    try:
+        for filename in args.files:
+            with open(filename) as f:
+                source = f.read()
+            response = send_request(args.socket, {
+                'command': 'compile',
+                'source': source,
+            })
+            for diagnostic in response.get('diagnostics', ()):
+                print >>sys.stderr, Diagnostic.from_dict(
+                    diagnostic).format(filename)
+            if response['status'] != 'ok':
+                failed += 1
+                continue
+            output_file = os.path.splitext(filename)[0] + '.ll'
+            with open(output_file, 'w') as f:
+                f.write(response['code'])
+
+        if args.stats:
+            response = send_request(args.socket, {'command': 'stats'})
+            print json.dumps(response, indent=2, sort_keys=True)
+        if args.shutdown:
+            send_request(args.socket, {'command': 'shutdown'})
+    except (IOError, socket.error) as e:
+        print >>sys.stderr, e
+        return 2
+
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,57 +1,109 @@
+import gc
+from contextlib import contextmanager
 from sys import stderr
 
 from antlr3.tokens import CommonToken
 from antlr3.tree import CommonTree, CommonTreeAdaptor
 
-from c_llvm.exceptions import CompilationError
+from c_llvm import cfg, inliner, loops, tailcalls
+from c_llvm.diagnostics import Diagnostic
+from c_llvm.inliner import DEFAULT_INLINE_LIMIT
+from c_llvm.exceptions import CompilationError, ErrorLimitReached
+from c_llvm.tokens import CompactToken
 from c_llvm.traversal_state import CompilerState
 
 
+@contextmanager
+def collector_paused():
+    """
+    Disables the cyclic garbage collector for the duration of the block.
+    The IR of a module consists of lots of small objects which all stay
+    alive until it is serialized, the collector would just traverse them
+    over and over again.
+    """
+    enabled = gc.isenabled()
+    gc.disable()
+    try:
+        yield
+    finally:
+        if enabled:
+            gc.enable()
+
+
+def child_property(index):
+    def get_child(self):
+        try:
+            return self.children[index]
+        except IndexError:
+            return None
+
+    def set_child(self, value):
+        self.setChild(index, value)
+
+    return property(get_child, set_child)
+
+
+class AstNodeType(type):
+    """
+    Metaclass of all AST nodes. It turns the child_attributes of each
+    class into properties and gives every class empty __slots__ so that
+    nodes never need an instance dictionary.
+    """
+    def __new__(mcs, name, bases, attrs):
+        attrs.setdefault('__slots__', ())
+        for attr, index in attrs.get('child_attributes', {}).items():
+            attrs[attr] = child_property(index)
+        return super(AstNodeType, mcs).__new__(mcs, name, bases, attrs)
+
+
 class AstNode(CommonTree):
     """
     Common base class for all our AST nodes describing all relevant tree
     traversal operations.
     """
+    __metaclass__ = AstNodeType
+    # The attributes assigned by CommonTree, nodes don't have any others.
+    __slots__ = ('token', 'startIndex', 'stopIndex', 'parent', 'childIndex',
+                 'children')
+
     # Subclasses should override this for convenient access to child nodes
     # as attributes (like left or right). It should map attribute names to
     # indices in the child list.
     child_attributes = {}
 
+    # What scan_function_body looks for in nodes of this class: 'loop',
+    # 'switch', 'case', 'address', 'assignment', 'increment' or None for
+    # nothing.
+    scan_kind = None
+
     def __init__(self, payload):
         """
         We need to work around a bug in the antlr runtime where if you
         pass an imaginary token to a custom AST node type, it passes the
         integer type of the token instead of a token instance.
+
+        Tokens coming from the lexer are replaced with compact copies.
         """
         if isinstance(payload, (int, long)):
-            payload = CommonToken(type=payload)
+            payload = CompactToken(type=payload)
+        elif isinstance(payload, CommonToken):
+            payload = CompactToken.from_token(payload)
         super(AstNode, self).__init__(payload)
 
-    def __getattr__(self, name):
-        try:
-            return self.getChild(self.child_attributes[name])
-        except KeyError:
-            raise AttributeError("%s has no attribute %s"
-                                 % (self.__class__.__name__, name))
-
-    def __setattr__(self, name, value):
-        try:
-            self.setChild(self.child_attributes[name], value)
-        except KeyError:
-            super(AstNode, self).__setattr__(name, value)
-
     def dupNode(self):
         return self.__class__(self)
 
     def log_error(self, state, message):
-        state.errors.append("%d:%d: %s" % (
+        state.report(Diagnostic(
+            'error',
             self.getLine(),
             self.getCharPositionInLine(),
             message,
         ))
 
     def log_warning(self, state, message):
-        state.warnings.append("Warning: %d:%d: %s" % (
+        state.report(Diagnostic(
+            'warning',
             self.getLine(),
             self.getCharPositionInLine(),
             message,
@@ -59,13 +111,10 @@ class AstNode(CommonTree):
 
     def process_children(self, state):
         """
-        Process the child nodes and return a list of pieces of output
-        code for each child.
+        Generate the code for all child nodes in order.
         """
-        output = []
         for child in self.children:
-            output.append(child.generate_code(state))
-        return output
+            child.generate_code(state)
 
     def generate_code(self, state):
         """
@@ -74,9 +123,10 @@ class AstNode(CommonTree):
         kinds of information like all symbol tables, next free register,
         list of compilation errors etc.
 
-        Should return a string, which is the output LLVM code for this AST
-        node. If an error is encountered, it should be logged using
-        log_error but a string should be returned anyway.
+        The output LLVM code for this AST node should be appended to the
+        state using state.emit, nothing is returned. If an error is
+        encountered, it should be logged using log_error and the walk
+        should continue.
         """
         raise NotImplementedError
 
@@ -98,34 +148,83 @@ class AstTreeAdaptor(CommonTreeAdaptor):
     def createWithPayload(self, payload):
         return AstNode(payload)
 
+    def createToken(self, fromToken=None, tokenType=None, text=None):
+        if fromToken is not None:
+            return CompactToken.from_token(fromToken)
+        return CompactToken(type=tokenType, text=text)
+
 
 class TranslationUnitNode(AstNode):
     def toString(self):
         return "translation unit\n"
 
-    def generate_code(self):
-        state = CompilerState()
+    def generate_module(self, warnings=None, optimize_tail_calls=False,
+                        inline_functions=False,
+                        inline_limit=DEFAULT_INLINE_LIMIT, simplify_cfg=False,
+                        optimize_loops=False, **options):
+        """
+        Walks the whole tree and returns the resulting ir.Module.
+
+        Warnings are appended to the warnings list if one is given,
+        otherwise they are printed. With optimize_tail_calls, functions
+        returning the result of calling themselves are turned into loops
+        by c_llvm.tailcalls first, and the remaining calls followed by a
+        return are marked as tail calls at the very end. With
+        inline_functions, calls to functions whose cost is at most
+        inline_limit are inlined by c_llvm.inliner. With simplify_cfg,
+        unreachable and trivial blocks are cleaned up by c_llvm.cfg, with
+        optimize_loops, c_llvm.loops optimizes the loops afterwards. Any
+        other options are passed on to CompilerState.
+        """
+        state = CompilerState(**options)
 
-        children = self.process_children(state)
+        with collector_paused():
+            try:
+                self.process_children(state)
+            except ErrorLimitReached:
+                pass
 
         if state.errors:
-            raise CompilationError("\n".join(state.errors))
-
-        if state.warnings:
-            print "\n".join(state.warnings)
-
-        children_code = "\n".join(children)
-        global_code = "\n".join(state.global_declarations)
-
-        if not children_code.endswith('\n'):
-            children_code += '\n'
+            raise CompilationError("\n".join(map(str, state.errors)),
+                                   state.errors + state.warnings)
+        state.strings.finish(state)
+        if optimize_tail_calls:
+            with collector_paused():
+                tailcalls.eliminate_module(state.module)
+        if inline_functions:
+            with collector_paused():
+                inliner.inline_module(state.module, inline_limit)
+        if simplify_cfg:
+            with collector_paused():
+                cfg.simplify_module(state.module)
+        if optimize_loops:
+            with collector_paused():
+                loops.optimize_module(state.module)
+        if optimize_tail_calls:
+            with collector_paused():
+                tailcalls.mark_module(state.module)
+
+        if warnings is not None:
+            warnings.extend(state.warnings)
+        elif state.warnings:
+            print "\n".join(map(str, state.warnings))
+
+        return state.module
+
+    def generate_fragments(self, warnings=None, **options):
+        """
+        Returns the list of lines of the output code, global declarations
+        first. See generate_module.
+        """
+        return self.generate_module(warnings, **options).serialize()
 
-        return "%s\n\n%s" % (global_code, children_code)
+    def generate_code(self, warnings=None, **options):
+        return "\n".join(self.generate_fragments(warnings, **options)) + "\n"
 
 
 class EmptyNode(AstNode):
     def generate_code(self, state):
-        return ""
+        pass
 
 
 class OptionalNode(AstNode):
@@ -134,4 +233,4 @@ class OptionalNode(AstNode):
     nonterminal is optional but we need an AST node anyway.
     """
     def generate_code(self, state):
-        return "\n".join(self.process_children(state))
+        self.process_children(state)
@@ -1,6 +1,8 @@
 from collections import Counter
 
+from c_llvm import ir
 from c_llvm.ast.base import AstNode
+from c_llvm.ast.statements import scan_function_body
 from c_llvm.types import PointerType, TypedefType
 from c_llvm.variables import Variable
 
@@ -27,37 +29,40 @@ class DeclarationNode(AstNode):
             var = Variable(type=TypedefType(type), name=identifier,
                            register=None, is_global=is_global)
             state.symbols[identifier] = var
-            return ""
+            return
 
+        in_register = (not is_global and not type.is_function and
+                       state.keeps_in_register(identifier, type))
         if is_global:
             register = '@%s' % (identifier,)
+        elif in_register:
+            register = None
         else:
             register = state.get_var_register(identifier)
         var = Variable(type=type, name=identifier, register=register,
-                       is_global=is_global)
+                       is_global=is_global, in_register=in_register)
 
         if type.is_function:
             if not is_global:
                 self.log_error(state, "can't declare a non-global function")
-            declaration = "declare %(ret_type)s %(register)s%(arg_types)s" % {
+            state.emit("declare %(ret_type)s %(register)s%(arg_types)s" % {
                 'ret_type': type.return_type.llvm_type,
                 'register': register,
                 'arg_types': type.arg_types_str,
-            }
+            })
         elif is_global:
-            declaration = "%(register)s = global %(type)s %(value)s" % {
+            state.emit("%(register)s = global %(type)s %(value)s" % {
                 'register': var.register,
                 'type': var.type.llvm_type,
                 'value': var.type.default_value,
-            }
+            })
+        elif in_register:
+            state.ssa.declare(var)
         else:
-            declaration = "%(register)s = alloca %(type)s" % {
-                'register': var.register,
-                'type': var.type.llvm_type,
-            }
+            state.emit_alloca(ir.AllocaInstruction(var.register,
+                                                   var.type.llvm_type))
 
         state.symbols[identifier] = var
-        return declaration
 
     def toString(self):
         return "declaration"
@@ -78,7 +83,6 @@ class EmptyDeclarationNode(AstNode):
 
     def generate_code(self, state):
         self.specifier.get_type(state)
-        return ""
 
 
 class FunctionDefinitionNode(AstNode):
@@ -87,19 +91,6 @@ class FunctionDefinitionNode(AstNode):
         'declarator': 1,
         'body': 2,
     }
-    template = """
-define %(type)s @%(name)s(%(args)s)
-{
-%(init)s
-%(contents)s
-%(return)s
-}
-"""
-    init_template = """
-%(register)s = alloca %(type)s
-store %(type)s %%%(name)s, %(type)s* %(register)s
-"""
-
     def generate_code(self, state):
         specifier_type = self.specifier.get_type(state)
         state.declaration_stack.append(specifier_type)
@@ -111,61 +102,71 @@ store %(type)s %%%(name)s, %(type)s* %(register)s
         if not function_type.is_function:
             self.log_error(state, "invalid function definition -- "
                            "symbol of a non-function type declared")
-            return ""
+            return
 
         if name in state.symbols:
             declared = state.symbols[name]
             if declared.type is not function_type:
                 self.log_error(state, "%s already declared as %s" %
                                declared.type.name)
-                return ""
+                return
             if declared.is_defined:
                 self.log_error(state, "function already defined")
-                return ""
+                return
             declared.is_defined = True
         else:
             state.symbols[name] = Variable(name, function_type, register,
                                            True, True)
 
+        if state.ssa is not None:
+            state.enter_function(*scan_function_body(self.body))
+        else:
+            state.enter_function()
         arguments = zip(self.declarator.get_argument_names(state),
                         function_type.arg_types)
-        arg_init, arg_header = [], []
+        arg_header, register_args, memory_args = [], [], []
         pending_scope = {}
         for arg_name, arg_type in arguments:
-            arg_header.append("%s %%%s" % (arg_type.llvm_type, arg_name))
-            arg_register = state.get_var_register(arg_name)
-            arg_init.append(self.init_template % {
-                'type': arg_type.llvm_type,
-                'register': arg_register,
-                'name': arg_name,
-            })
-            pending_scope[arg_name] = Variable(arg_name, arg_type,
-                                               arg_register, False)
+            arg_header.append((arg_type.llvm_type, arg_name))
+            if state.keeps_in_register(arg_name, arg_type):
+                var = Variable(arg_name, arg_type, None, False,
+                               in_register=True)
+                register_args.append(var)
+            else:
+                arg_register = state.get_var_register(arg_name)
+                var = Variable(arg_name, arg_type, arg_register, False)
+                memory_args.append(var)
+            pending_scope[arg_name] = var
 
         state.set_pending_scope(pending_scope)
 
         return_type = function_type.return_type
         state.return_type = return_type
         state.return_found = False
+
+        state.start_function_body(ir.Function(
+            name, return_type.llvm_type, arg_header))
+        for var in register_args:
+            state.ssa.declare(var, "%%%s" % (var.name,))
+        for var in memory_args:
+            state.emit_alloca(ir.AllocaInstruction(var.register,
+                                                   var.type.llvm_type))
+            state.emit(ir.StoreInstruction(var.type.llvm_type,
+                                           "%%%s" % (var.name,),
+                                           var.register))
+        self.body.generate_code(state)
         # return something to keep LLVM happy
         if return_type.is_void:
-            ret_statement = "ret void"
+            state.emit_terminator(ir.ReturnInstruction())
         else:
-            ret_statement = "ret %s undef" % (
-                    function_type.return_type.llvm_type,)
-        result = self.template % {
-            'type': function_type.return_type.llvm_type,
-            'name': name,
-            'args': ', '.join(arg_header),
-            'init': '\n'.join(arg_init),
-            'contents': self.body.generate_code(state),
-            'return': ret_statement,
-        }
+            state.emit_terminator(ir.ReturnInstruction(return_type.llvm_type,
+                                                       'undef'))
+        state.finish_function_body()
+
         if not state.return_found and not state.return_type.is_void:
             self.log_warning(state, "missing return statement in "
                     "non void function %s" % self.declarator.get_identifier())
         state.return_type = None
-        return result
 
     def toString(self):
         return "function definition"
@@ -223,7 +224,7 @@ class FunctionDeclaratorNode(DeclaratorNode):
             self.log_error(state, 'a function cannot return a function')
         if return_type.is_array:
             self.log_error(state, 'a function cannot return an array')
-        arg_list = self.arg_list.children
+        arg_list = self.arg_list.children[:]
         variable_arguments = len(arg_list) > 0 and str(arg_list[-1]) == '...'
         if variable_arguments:
             arg_list.pop()
@@ -353,7 +354,7 @@ class StructIdentifierNode(AstNode):
     def get_identifier(self, state):
         if self.getChildCount() > 0:
             return str(self.identifier)
-        return "anonymous.%d" % (state._get_next_number(),)
+        return state.get_global_name('anonymous')
 
 
 class StructDeclarationListNode(AstNode):
@@ -398,9 +399,7 @@ class StructDefinitionNode(AstNode):
         'identifier': 0,
         'definition': 1,
     }
-    declaration_template = """
-%(alias)s = type %(type)s
-"""
+    declaration_template = "%(alias)s = type %(type)s"
 
     def get_type(self, state):
         name = self.identifier.get_identifier(state)
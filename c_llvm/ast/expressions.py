@@ -1,12 +1,41 @@
+from c_llvm import constants, ir
 from c_llvm.ast.base import AstNode
 from c_llvm.exceptions import CompilationError
+from c_llvm.variables import Variable
 
 
 class ExpressionNode(AstNode):
     """
     Common superclass for all expression type AST nodes.
     """
-    pass
+    def generate_condition(self, state, true_label, false_label):
+        """
+        Generates the expression as the condition of a branch to
+        true_label if it is nonzero and to false_label otherwise, without
+        materializing its value if possible. If the condition turns out
+        to be constant, no branch is emitted and its truth value is
+        returned instead, otherwise None.
+        """
+        self.generate_code(state)
+        result = state.pop_result()
+        if result is None:
+            # There was a compilation error somewhere down the line.
+            return None
+        result = state.types.cast(result, state,
+                                  state.types.get_type('_Bool'), self)
+        if result.is_constant:
+            return bool(result.value)
+        state.emit_branch(result.value, true_label, false_label)
+        return None
+
+    def generate_branch(self, state, true_label, false_label):
+        """
+        Like generate_condition, but a constant condition ends the
+        current basic block with a jump to the label it selects.
+        """
+        value = self.generate_condition(state, true_label, false_label)
+        if value is not None:
+            state.emit_jump(true_label if value else false_label)
 
 
 class BinaryExpressionNode(ExpressionNode):
@@ -18,19 +47,15 @@ class BinaryExpressionNode(ExpressionNode):
     @classmethod
     def cast_if_necessary(self, left_result, right_result, state):
         # assuming for both type.is_arithmetic is true (int or float)
-        if (left_result.type.is_integer and
-                right_result.type.is_float):
-            code = left_result.type.cast_to_float(left_result, state)
-            left_result = state.pop_result()
-            return code, left_result, right_result
+        left_type, right_type = left_result.type, right_result.type
+        if left_type is right_type:
+            return left_result, right_result
 
-        if (left_result.type.is_float and
-                right_result.type.is_integer):
-            code = right_result.type.cast_to_float(right_result, state)
-            right_result = state.pop_result()
-            return code, left_result, right_result
-        
-        return "", left_result, right_result
+        if left_type.is_integer and right_type.is_float:
+            left_result = state.types.cast(left_result, state, right_type)
+        elif left_type.is_float and right_type.is_integer:
+            right_result = state.types.cast(right_result, state, left_type)
+        return left_result, right_result
 
     @classmethod
     def common_type(self, left_type, right_type):
@@ -38,43 +63,49 @@ class BinaryExpressionNode(ExpressionNode):
             return left_type
         return right_type
 
+    def convert_constants(self, left_result, right_result, state):
+        """
+        Converts two arithmetic constants to their common type. Returns
+        the converted pair, or None if either of them isn't one.
+        """
+        if not (left_result.is_constant and right_result.is_constant and
+                left_result.type.is_arithmetic and
+                right_result.type.is_arithmetic):
+            return None
+        common_type = self.common_type(left_result.type, right_result.type)
+        return (state.types.cast(left_result, state, common_type),
+                state.types.cast(right_result, state, common_type))
+
 
 class BinaryArithmeticExpressionNode(BinaryExpressionNode):
-    template = """
-%(left_code)s
-%(right_code)s
-%(operation_code)s
-"""
+    # The C operator, as understood by constants.fold_binary.
+    operator = None
 
     def generate_code(self, state):
-        left_code = self.left.generate_code(state)
+        self.left.generate_code(state)
         left_result = state.pop_result()
-        right_code = self.right.generate_code(state)
+        self.right.generate_code(state)
         right_result = state.pop_result()
         if right_result is None or left_result is None:
-            return "Surely this does not happen :-)"
-
-        if right_result.is_constant and left_result.is_constant:
-            state.set_result(
-                    self.operation(left_result.value, right_result.value),
-                    self.common_type(left_result.type, right_result.type),
-                    True)
-            return ""
+            # Surely this does not happen :-)
+            return
+
+        constants_pair = self.convert_constants(left_result, right_result,
+                                                state)
+        if constants_pair is not None:
+            left_const, right_const = constants_pair
+            value = constants.fold_binary(self.operator, left_const.value,
+                                          right_const.value, left_const.type)
+            if value is not None:
+                state.set_result(value, left_const.type, True)
+                return
 
         try:
-            operation_code = self.perform_operation(
-                    self, state, left_result, right_result)
+            self.perform_operation(self, state, left_result, right_result)
         except CompilationError:
             # fake the result, otherwise AssignmentExpressionNode
             # can't handle the situation
             state.push_result(left_result)
-            return ""
-
-        return self.template % {
-            'left_code': left_code,
-            'right_code': right_code,
-            'operation_code': operation_code,
-        }
 
 
 class UnaryExpressionNode(ExpressionNode):
@@ -84,19 +115,15 @@ class UnaryExpressionNode(ExpressionNode):
 
 
 class CommaOperatorNode(BinaryExpressionNode):
-    template = """
-%(left_code)s
-%(right_code)s
-"""
-
     def generate_code(self, state):
-        left_code = self.left.generate_code(state)
-        right_code = self.right.generate_code(state)
+        self.left.generate_code(state)
+        self.right.generate_code(state)
         # right's result expression should stay in the state I hope
-        return self.template % {
-                'left_code': left_code,
-                'right_code': right_code,
-            }
+
+    def generate_condition(self, state, true_label, false_label):
+        self.left.generate_code(state)
+        state.pop_result()
+        return self.right.generate_condition(state, true_label, false_label)
 
 
 class ConditionalExpressionNode(ExpressionNode):
@@ -106,106 +133,170 @@ class ConditionalExpressionNode(ExpressionNode):
         'conditional_exp': 2,
     }
 
-    template = """
-%(exp_code)s
-%(exp_cast_code)s
-br i1 %(exp_cast_value)s, label %%CondIf%(num)d.True, label %%CondIf%(num)d.False
-CondIf%(num)d.True:
-%(statement1_code)s
-br label %%CondIf%(num)d.End
-CondIf%(num)d.False:
-%(statement2_code)s
-br label %%CondIf%(num)d.End
-CondIf%(num)d.End:
-"""
+    def get_result_type(self, true_type, false_type):
+        if true_type.is_arithmetic and false_type.is_arithmetic:
+            return BinaryExpressionNode.common_type(true_type, false_type)
+        if true_type is false_type:
+            return true_type
+        return None
 
     def generate_code(self, state):
-        exp_code = self.logical_exp.generate_code(state)
-        exp_result = state.pop_result()
-        if exp_result is None:
-            # There was a compilation error somewhere down the line.
-            return ""
-
-        exp_cast_code = exp_result.type.cast_to_bool(exp_result, state)
-        exp_cast_result = state.pop_result()
-
-        return self.template % {
-            'exp_code': exp_code,
-            'exp_cast_code': exp_cast_code,
-            'exp_cast_value': exp_cast_result.value,
-            'num': state._get_next_number(),
-            'statement1_code': self.expression.generate_code(state),
-            'statement2_code': self.conditional_exp.generate_code(state),
-        }
+        num = state.get_label_number()
+        true_label = state.make_label('CondIf', num, 'True')
+        false_label = state.make_label('CondIf', num, 'False')
+        end_label = state.make_label('CondIf', num, 'End')
+
+        value = self.logical_exp.generate_condition(state, true_label,
+                                                    false_label)
+        if value is not None:
+            # Only the selected operand would be evaluated, the other one
+            # doesn't need any code at all.
+            if value:
+                self.expression.generate_code(state)
+            else:
+                self.conditional_exp.generate_code(state)
+            return
+
+        state.emit_label(true_label)
+        self.expression.generate_code(state)
+        true_result = state.pop_result()
+        # The conversion to the common type is only known once both
+        # operands have been generated.
+        true_cast_slot = state.reserve_code()
+        true_end_label = state.current_label
+        true_reachable = state.is_reachable()
+        state.emit_jump(end_label)
+
+        state.emit_label(false_label)
+        self.conditional_exp.generate_code(state)
+        false_result = state.pop_result()
+        if true_result is None or false_result is None:
+            # void operands or an error
+            state.emit_jump(end_label)
+            state.emit_label(end_label)
+            return
+        result_type = self.get_result_type(true_result.type,
+                                           false_result.type)
+        if result_type is None:
+            self.log_error(state, "type mismatch in conditional expression")
+            # fake the result, otherwise AssignmentExpressionNode can't
+            # handle the situation
+            state.push_result(false_result)
+            return
+        false_result = state.types.cast(false_result, state, result_type,
+                                        self)
+        false_end_label = state.current_label
+        false_reachable = state.is_reachable()
+        state.emit_jump(end_label)
+
+        code, state.code = state.code, []
+        true_result = state.types.cast(true_result, state, result_type, self)
+        true_cast_code, state.code = state.code, code
+        state.fill_code(true_cast_slot, true_cast_code)
+
+        state.emit_label(end_label)
+        # A part of the condition may be constant, with ssa_locals an
+        # operand which can't be reached doesn't get a block at all.
+        if true_reachable != false_reachable:
+            result = true_result if true_reachable else false_result
+            state.set_result(result.value, result_type)
+            return
+        register = state.get_tmp_register()
+        state.emit(ir.PhiInstruction(register, result_type.llvm_type, [
+            (true_result.value, true_end_label),
+            (false_result.value, false_end_label),
+        ]))
+        state.set_result(register, result_type)
 
 
 class LogicalExpressionNode(BinaryExpressionNode):
-    template = """
-%(left_code)s
-%(left_bool_cast)s
-br i1 %(left_bool_value)s, label %%%(left_true_target)s, label %%%(left_false_target)s
-%(right_label)s:
-%(right_code)s
-%(right_bool_cast)s
-br i1 %(right_bool_value)s, label %%%(right_true_target)s, label %%%(right_false_target)s
-%(is_true_label)s:
-br label %%%(end_label)s
-%(is_false_label)s:
-br label %%%(end_label)s
-%(end_label)s:
-%(result_register)s = phi %(result_type)s [0, %%%(is_false_label)s], [1, %%%(is_true_label)s]
-"""
+    def generate_constant(self, state, left_value, is_or):
+        """
+        Generates the code for a constant left operand: either it
+        decides the result on its own and the right operand isn't
+        evaluated at all, or the result is the truth value of the right
+        operand.
+        """
+        int_type = state.types.get_type('int')
+        if bool(left_value) == is_or:
+            state.set_result(int(is_or), int_type, True)
+            return
+        self.right.generate_code(state)
+        right_cast_result = state.types.cast(
+            state.pop_result(), state, state.types.get_type('_Bool'), self)
+        if right_cast_result.is_constant:
+            state.set_result(int(bool(right_cast_result.value)), int_type,
+                             True)
+            return
+        state.types.cast_value(right_cast_result, state, int_type, self)
+
+    def generate_left(self, state, true_label, false_label, right_label):
+        """
+        Generates the left operand as a condition jumping to right_label
+        if the right one needs to be evaluated. Returns its truth value
+        if it is constant, like generate_condition.
+        """
+        if str(self) == '||':
+            return self.left.generate_condition(state, true_label,
+                                                right_label)
+        return self.left.generate_condition(state, right_label, false_label)
+
+    def generate_condition(self, state, true_label, false_label):
+        is_or = str(self) == '||'
+        right_label = state.get_label()
+        left_value = self.generate_left(state, true_label, false_label,
+                                        right_label)
+        if left_value is not None:
+            if left_value == is_or:
+                return left_value
+            return self.right.generate_condition(state, true_label,
+                                                 false_label)
+        state.emit_label(right_label)
+        self.right.generate_branch(state, true_label, false_label)
+        return None
 
     def generate_code(self, state):
-        left_code = self.left.generate_code(state)
-        left_result = state.pop_result()
-        left_bool_cast = left_result.type.cast_to_bool(left_result, state)
-        left_bool_result = state.pop_result()
-
-        right_code = self.right.generate_code(state)
-        right_result = state.pop_result()
-        right_bool_cast = right_result.type.cast_to_bool(right_result, state)
-        right_bool_result = state.pop_result()
-
-        result_register = state.get_tmp_register()
-        state.set_result(result_register, state.types.get_type('int'))
-
+        is_or = str(self) == '||'
+        int_type = state.types.get_type('int')
         right_label = state.get_label()
         is_true_label = state.get_label()
         is_false_label = state.get_label()
         end_label = state.get_label()
-        context = {
-            'left_code': left_code,
-            'left_bool_cast': left_bool_cast,
-            'left_bool_value': left_bool_result.value,
-            'right_label': right_label,
-            'right_code': right_code,
-            'right_bool_cast': right_bool_cast,
-            'right_bool_value': right_bool_result.value,
-            'is_true_label': is_true_label,
-            'is_false_label': is_false_label,
-            'end_label': end_label,
-            'result_register': result_register,
-            'result_type': state.types.get_type('int').llvm_type,
-        }
-
-        if str(self.getToken()) == '||':
-            context.update(left_true_target=is_true_label,
-                           left_false_target=right_label,
-                           right_true_target=is_true_label,
-                           right_false_target=is_false_label)
-        else:
-            context.update(left_true_target=right_label,
-                           left_false_target=is_false_label,
-                           right_true_target=is_true_label,
-                           right_false_target=is_false_label)
 
-        return self.template % context
+        left_value = self.generate_left(state, is_true_label, is_false_label,
+                                        right_label)
+        if left_value is not None:
+            self.generate_constant(state, left_value, is_or)
+            return
+
+        state.emit_label(right_label)
+        self.right.generate_branch(state, is_true_label, is_false_label)
+
+        incoming = []
+        state.emit_label(is_true_label)
+        if state.is_reachable():
+            incoming.append((1, is_true_label))
+        state.emit_jump(end_label)
+        state.emit_label(is_false_label)
+        if state.is_reachable():
+            incoming.append((0, is_false_label))
+        state.emit_jump(end_label)
+        state.emit_label(end_label)
+
+        if len(incoming) == 1:
+            # With ssa_locals, only one of the values can be reached if a
+            # part of the right operand is constant.
+            state.set_result(incoming[0][0], int_type)
+            return
+        result_register = state.get_tmp_register()
+        state.set_result(result_register, int_type)
+        state.emit(ir.PhiInstruction(
+            result_register, int_type.llvm_type,
+            [(0, is_false_label), (1, is_true_label)]))
 
 
 class BitwiseOrExpressionNode(BinaryArithmeticExpressionNode):
-    def operation(self, left, right):
-        return left | right
+    operator = '|'
 
     @classmethod
     def perform_operation(cls, instance, state, left_result, right_result):
@@ -214,17 +305,14 @@ class BitwiseOrExpressionNode(BinaryArithmeticExpressionNode):
             instance.log_error(state, "|'s operands need to be integer type")
             raise CompilationError()
         register = state.get_tmp_register()
-        operation_code = "%s = or %s %s, %s" % (
-            register, left_result.type.llvm_type,
-            left_result.value, right_result.value
-        )
+        state.emit(ir.BinaryInstruction(
+            register, 'or', left_result.type.llvm_type,
+            left_result.value, right_result.value))
         state.set_result(register, left_result.type)
-        return operation_code
 
 
 class BitwiseXorExpressionNode(BinaryArithmeticExpressionNode):
-    def operation(self, left, right):
-        return left ^ right
+    operator = '^'
 
     @classmethod
     def perform_operation(cls, instance, state, left_result, right_result):
@@ -233,17 +321,14 @@ class BitwiseXorExpressionNode(BinaryArithmeticExpressionNode):
             instance.log_error(state, "^'s operands need to be integer type")
             raise CompilationError()
         register = state.get_tmp_register()
-        operation_code = "%s = xor %s %s, %s" % (
-            register, left_result.type.llvm_type,
-            left_result.value, right_result.value
-        )
+        state.emit(ir.BinaryInstruction(
+            register, 'xor', left_result.type.llvm_type,
+            left_result.value, right_result.value))
         state.set_result(register, left_result.type)
-        return operation_code
 
 
 class BitwiseAndExpressionNode(BinaryArithmeticExpressionNode):
-    def operation(self, left, right):
-        return left & right
+    operator = '&'
 
     @classmethod
     def perform_operation(cls, instance, state, left_result, right_result):
@@ -252,20 +337,13 @@ class BitwiseAndExpressionNode(BinaryArithmeticExpressionNode):
             instance.log_error(state, "&'s operands need to be integer type")
             raise CompilationError()
         register = state.get_tmp_register()
-        operation_code = "%s = and %s %s, %s" % (
-            register, left_result.type.llvm_type,
-            left_result.value, right_result.value
-        )
+        state.emit(ir.BinaryInstruction(
+            register, 'and', left_result.type.llvm_type,
+            left_result.value, right_result.value))
         state.set_result(register, left_result.type)
-        return operation_code
 
 
 class CompareExpressionNode(BinaryExpressionNode):
-    template = """
-%(left_code)s
-%(right_code)s
-%(operation_code)s
-"""
     operands = {
         '<': ('slt', 'olt'),
         '>': ('sgt', 'ogt'),
@@ -275,65 +353,71 @@ class CompareExpressionNode(BinaryExpressionNode):
         '!=': ('ne', 'one'),
     }
 
-    def operation(self, left, right):
-        operations = {
-            '<': int(left < right),
-            '>': int(left > right),
-            '<=': int(left <= right),
-            '>=': int(left >= right),
-            '==': int(left == right),
-            '!=': int(left != right),
-        }
-        return operations[str(self)]
-
-    def generate_code(self, state):
-        left_code = self.left.generate_code(state)
+    def generate_comparison(self, state):
+        """
+        Emits the comparison and returns the i1 register holding its
+        result. Returns None if the operands are constant, the result is
+        then set in the state, or if there is an error.
+        """
+        self.left.generate_code(state)
         left_result = state.pop_result()
-        right_code = self.right.generate_code(state)
+        self.right.generate_code(state)
         right_result = state.pop_result()
         if right_result is None or left_result is None:
-            return "Surely this does not happen :-)"
+            # Surely this does not happen :-)
+            return None
 
-        if right_result.is_constant and left_result.is_constant:
+        constants_pair = self.convert_constants(left_result, right_result,
+                                                state)
+        if constants_pair is not None:
+            left_const, right_const = constants_pair
             state.set_result(
-                    self.operation(left_result.value, right_result.value),
+                    constants.fold_comparison(str(self), left_const.value,
+                                              right_const.value,
+                                              left_const.type),
                     state.types.get_type('int'),
                     True)
-            return ""
+            return None
 
         if ((not left_result.type.is_scalar) or
                 (not right_result.type.is_scalar)):
-            instance.log_error(state, "operands need to be scalar type")
-            return ""
-        operation_code, left_result, right_result = self.cast_if_necessary(
+            self.log_error(state, "operands need to be scalar type")
+            return None
+        left_result, right_result = self.cast_if_necessary(
                 left_result, right_result, state)
-        if operation_code != "":
-            operation_code += "\n"
 
         if left_result.type.is_float:
-            op = "fcmp" + " " + self.operands[str(self)][1]
+            op, predicate = "fcmp", self.operands[str(self)][1]
         else:
-            op = "icmp" + " " + self.operands[str(self)][0]
+            op, predicate = "icmp", self.operands[str(self)][0]
         tmp_register = state.get_tmp_register()
-        operation_code += "%s = %s %s %s, %s\n" % (
-            tmp_register, op, left_result.type.llvm_type,
-            left_result.value, right_result.value
-        )
+        state.emit(ir.CompareInstruction(
+            tmp_register, op, predicate, left_result.type.llvm_type,
+            left_result.value, right_result.value))
+        return tmp_register
+
+    def generate_code(self, state):
+        tmp_register = self.generate_comparison(state)
+        if tmp_register is None:
+            return
         result_register = state.get_tmp_register()
-        operation_code += "%s = zext i1 %s to i64" % (
-            result_register, tmp_register
-        )
+        state.emit(ir.CastInstruction(result_register, 'zext', 'i1',
+                                      tmp_register, 'i64'))
         state.set_result(result_register, state.types.get_type('int'))
-        return self.template % {
-            'left_code': left_code,
-            'right_code': right_code,
-            'operation_code': operation_code,
-        }
+
+    def generate_condition(self, state, true_label, false_label):
+        # The result of the comparison is branched on directly instead of
+        # extending it to an int and comparing that to zero again.
+        tmp_register = self.generate_comparison(state)
+        if tmp_register is None:
+            result = state.pop_result()
+            return None if result is None else bool(result.value)
+        state.emit_branch(tmp_register, true_label, false_label)
+        return None
 
 
 class ShiftLeftExpressionNode(BinaryArithmeticExpressionNode):
-    def operation(self, left, right):
-        return left << right
+    operator = '<<'
 
     @classmethod
     def perform_operation(cls, instance, state, left_result, right_result):
@@ -342,17 +426,14 @@ class ShiftLeftExpressionNode(BinaryArithmeticExpressionNode):
             instance.log_error(state, "<<'s operands need to be integer type")
             raise CompilationError()
         register = state.get_tmp_register()
-        operation_code = "%s = shl %s %s, %s" % (
-            register, left_result.type.llvm_type,
-            left_result.value, right_result.value
-        )
+        state.emit(ir.BinaryInstruction(
+            register, 'shl', left_result.type.llvm_type,
+            left_result.value, right_result.value))
         state.set_result(register, left_result.type)
-        return operation_code
 
 
 class ShiftRightExpressionNode(BinaryArithmeticExpressionNode):
-    def operation(self, left, right):
-        return left >> right
+    operator = '>>'
 
     @classmethod
     def perform_operation(cls, instance, state, left_result, right_result):
@@ -361,17 +442,14 @@ class ShiftRightExpressionNode(BinaryArithmeticExpressionNode):
             instance.log_error(state, ">>'s operands need to be integer type")
             raise CompilationError()
         register = state.get_tmp_register()
-        operation_code = "%s = lshr %s %s, %s" % (
-            register, left_result.type.llvm_type,
-            left_result.value, right_result.value
-        )
+        state.emit(ir.BinaryInstruction(
+            register, 'lshr', left_result.type.llvm_type,
+            left_result.value, right_result.value))
         state.set_result(register, left_result.type)
-        return operation_code
 
 
 class AdditionExpressionNode(BinaryArithmeticExpressionNode):
-    def operation(self, left, right):
-        return left + right
+    operator = '+'
 
     @classmethod
     def perform_operation(cls, instance, state, left_result, right_result):
@@ -381,35 +459,29 @@ class AdditionExpressionNode(BinaryArithmeticExpressionNode):
         if (left_result.type.is_pointer and
                 right_result.type.is_integer):
             register = state.get_tmp_register()
-            add = "%s = getelementptr %s %s, %s %s" % (
+            state.emit(ir.GetElementPtrInstruction(
                 register, left_result.type.llvm_type, left_result.value,
-                right_result.type.llvm_type, right_result.value
-            )
+                [(right_result.type.llvm_type, right_result.value)]))
             state.set_result(register, left_result.type)
         elif (left_result.type.is_arithmetic and
                 right_result.type.is_arithmetic):
-            add, left_result, right_result = cls.cast_if_necessary(
+            left_result, right_result = cls.cast_if_necessary(
                     left_result, right_result, state)
-            if add != "":
-                add += "\n"
             op = "add"
             if left_result.type.is_float:
                 op = "fadd"
             register = state.get_tmp_register()
-            add += "%s = %s %s %s, %s" % (
+            state.emit(ir.BinaryInstruction(
                 register, op, left_result.type.llvm_type,
-                left_result.value, right_result.value
-            )
+                left_result.value, right_result.value))
             state.set_result(register, left_result.type)
         else:
             instance.log_error(state, "incompatible types")
             raise CompilationError()
-        return add
 
 
 class SubtractionExpressionNode(BinaryArithmeticExpressionNode):
-    def operation(self, left, right):
-        return left - right
+    operator = '-'
 
     @classmethod
     def perform_operation(cls, instance, state, left_result, right_result):
@@ -424,28 +496,23 @@ class SubtractionExpressionNode(BinaryArithmeticExpressionNode):
             raise NotImplementedError
         elif (left_result.type.is_arithmetic and
                 right_result.type.is_arithmetic):
-            subtract, left_result, right_result = cls.cast_if_necessary(
+            left_result, right_result = cls.cast_if_necessary(
                     left_result, right_result, state)
-            if subtract != "":
-                subtract += "\n"
             op = "sub"
             if left_result.type.is_float:
                 op = "fsub"
             register = state.get_tmp_register()
-            subtract += "%s = %s %s %s, %s" % (
+            state.emit(ir.BinaryInstruction(
                 register, op, left_result.type.llvm_type,
-                left_result.value, right_result.value
-            )
+                left_result.value, right_result.value))
             state.set_result(register, left_result.type)
         else:
             instance.log_error(state, "incompatible types")
             raise CompilationError()
-        return subtract
 
 
 class MultiplicationExpressionNode(BinaryArithmeticExpressionNode):
-    def operation(self, left, right):
-        return left * right
+    operator = '*'
 
     @classmethod
     def perform_operation(cls, instance, state, left_result, right_result):
@@ -453,25 +520,20 @@ class MultiplicationExpressionNode(BinaryArithmeticExpressionNode):
                 (not right_result.type.is_arithmetic)):
             instance.log_error(state, "operands need to be arithmetic type")
             raise CompilationError()
-        operation_code, left_result, right_result = cls.cast_if_necessary(
+        left_result, right_result = cls.cast_if_necessary(
                 left_result, right_result, state)
-        if operation_code != "":
-            operation_code += "\n"
         op = "mul"
         if left_result.type.is_float:
             op = "fmul"
         register = state.get_tmp_register()
-        operation_code += "%s = %s %s %s, %s" % (
+        state.emit(ir.BinaryInstruction(
             register, op, left_result.type.llvm_type,
-            left_result.value, right_result.value
-        )
+            left_result.value, right_result.value))
         state.set_result(register, left_result.type)
-        return operation_code
 
 
 class DivisionExpressionNode(BinaryArithmeticExpressionNode):
-    def operation(self, left, right):
-        return left / right
+    operator = '/'
 
     @classmethod
     def perform_operation(cls, instance, state, left_result, right_result):
@@ -479,25 +541,20 @@ class DivisionExpressionNode(BinaryArithmeticExpressionNode):
                 (not right_result.type.is_arithmetic)):
             instance.log_error(state, "operands need to be arithmetic type")
             raise CompilationError()
-        operation_code, left_result, right_result = cls.cast_if_necessary(
+        left_result, right_result = cls.cast_if_necessary(
                 left_result, right_result, state)
-        if operation_code != "":
-            operation_code += "\n"
         op = "sdiv"
         if left_result.type.is_float:
             op = "fdiv"
         register = state.get_tmp_register()
-        operation_code += "%s = %s %s %s, %s" % (
+        state.emit(ir.BinaryInstruction(
             register, op, left_result.type.llvm_type,
-            left_result.value, right_result.value
-        )
+            left_result.value, right_result.value))
         state.set_result(register, left_result.type)
-        return operation_code
 
 
 class RemainderExpressionNode(BinaryArithmeticExpressionNode):
-    def operation(self, left, right):
-        return left % right
+    operator = '%'
 
     @classmethod
     def perform_operation(cls, instance, state, left_result, right_result):
@@ -506,114 +563,78 @@ class RemainderExpressionNode(BinaryArithmeticExpressionNode):
             instance.log_error(state, "%'s operands need to be integer type")
             raise CompilationError()
         register = state.get_tmp_register()
-        operation_code = "%s = srem %s %s, %s" % (
-            register, left_result.type.llvm_type,
-            left_result.value, right_result.value
-        )
+        state.emit(ir.BinaryInstruction(
+            register, 'srem', left_result.type.llvm_type,
+            left_result.value, right_result.value))
         state.set_result(register, left_result.type)
-        return operation_code
 
 
 class CastExpressionNode(BinaryExpressionNode):
-    template = """
-%(operand_code)s
-%(cast_code)s
-"""
-
     def generate_code(self, state):
         new_type = state.types.get_type(str(self.left))
-        operand_code = self.right.generate_code(state)
+        self.right.generate_code(state)
         value = state.pop_result()
-        if value.is_constant:
-            # let's hope we know only two types of constants
-            if new_type.internal_type == 'int':
-                new_value = int(value.value)
-            else:
-                new_value = float(value.value)
-            state.set_result(new_value, new_type, True)
-            return ""
-
-        cast_code = state.types.cast_value(value, state, new_type)
-        return self.template % {
-                'operand_code': operand_code,
-                'cast_code': cast_code,
-            }
+        state.types.cast_value(value, state, new_type, self)
 
 
 class DereferenceExpressionNode(ExpressionNode):
     child_attributes = {
         'expression': 0,
     }
-    template = """
-%(expr_code)s
-%(register)s = load %(type)s %(pointer)s
-"""
-    template_array = """
-%(expr_code)s
-%(register)s = getelementptr %(type)s %(pointer)s, i64 0, i64 0
-"""
-
     def generate_code(self, state):
-        expr_code = self.expression.generate_code(state)
+        self.expression.generate_code(state)
         expr_result = state.pop_result()
         expr_type = expr_result.type
         if not expr_type.is_pointer:
             self.log_error(state, "dereferencing a non-pointer value")
-            return ""
+            return
         register = state.get_tmp_register()
 
         if expr_type.target_type.is_array:
-            template = self.template_array
             result_type = state.types.get_pointer_type(expr_type.target_type.target_type)
             state.set_result(register, result_type)
+            state.emit(ir.GetElementPtrInstruction(
+                register, expr_type.llvm_type, expr_result.value,
+                [('i64', 0), ('i64', 0)]))
         else:
-            template = self.template
             state.set_result(register, expr_result.type.target_type,
                              pointer=expr_result.value)
-
-        return template % {
-            'expr_code': expr_code,
-            'register': register,
-            'type': expr_result.type.llvm_type,
-            'pointer': expr_result.value,
-        }
+            state.emit(ir.LoadInstruction(register, expr_type.llvm_type,
+                                          expr_result.value))
 
 
 class AddressExpressionNode(ExpressionNode):
     child_attributes = {
         'expression': 0,
     }
+    scan_kind = 'address'
 
     def generate_code(self, state):
-        expr_code = self.expression.generate_code(state)
+        self.expression.generate_code(state)
         expr_result = state.pop_result()
-        if not expr_result.pointer:
+        if (not expr_result.pointer or
+                isinstance(expr_result.pointer, Variable)):
             self.log_error(state, "address of a non-lvalue requested")
-            return ""
+            return
         state.set_result(expr_result.pointer,
                          state.types.get_pointer_type(expr_result.type))
-        return expr_code
 
 
 class UnaryArithmeticExpressionNode(UnaryExpressionNode):
-    template = """
-%(operand_code)s
-%(result_register)s = %(cmp_instruction)s %(type)s %(value)s, %(cmp_value)s
-"""
-
     def generate_code(self, state):
-        operand_code = self.operand.generate_code(state)
+        self.operand.generate_code(state)
         value = state.pop_result()
         if (not value.type.is_arithmetic):
             self.log_error(state, "operand is not arithmetic")
-            return ""
+            return
         if value.is_constant:
-            state.set_result(int(str(self) + "1") * value.value,
-                    value.type, True)
-            return ""
+            state.set_result(
+                constants.fold_unary(str(self), value.value, value.type),
+                value.type, True)
+            return
         if str(self) == '+':
             state.push_result(value)
-            return "%s" % operand_code
+            return
         if value.type.is_float:
             cmp_instruction = "fmul"
             cmp_value = "-1.0"
@@ -622,72 +643,67 @@ class UnaryArithmeticExpressionNode(UnaryExpressionNode):
             cmp_value = "-1"
         result_register = state.get_tmp_register()
         state.set_result(result_register, value.type)
-        return self.template % {
-                'operand_code': operand_code,
-                'cmp_instruction': cmp_instruction,
-                'cmp_value': cmp_value,
-                'type': value.type.llvm_type,
-                'value': value.value,
-                'result_register': result_register,
-            }
+        state.emit(ir.BinaryInstruction(result_register, cmp_instruction,
+                                        value.type.llvm_type, value.value,
+                                        cmp_value))
 
 
 class BitwiseNegationExpressionNode(UnaryExpressionNode):
     def generate_code(self, state):
-        operand_code = self.operand.generate_code(state)
+        self.operand.generate_code(state)
         value = state.pop_result()
         if value is None:
             # There was a compilation error somewhere down the line.
-            return ""
+            return
 
         if (not value.type.is_integer):
             self.log_error(state, "operand is not integer")
-            return ""
+            return
         if value.is_constant:
-            state.set_result(~value.value, value.type, True)
-            return ""
+            state.set_result(constants.fold_unary('~', value.value,
+                                                  value.type),
+                             value.type, True)
+            return
         register = state.get_tmp_register()
         state.set_result(register, value.type)
-        return "%s\n%s = xor %s %s, -1" % (operand_code, register,
-                                           value.type.llvm_type,
-                                           value.value)
+        state.emit(ir.BinaryInstruction(register, 'xor', value.type.llvm_type,
+                                        value.value, -1))
 
 
 class LogicalNegationExpressionNode(UnaryExpressionNode):
-    template = """
-%(operand_code)s
-%(tmp_register)s = %(cmp_instruction)s %(type)s %(value)s, %(cmp_value)s
-%(result_register)s = zext i1 %(tmp_register)s to i64
-"""
+    def generate_condition(self, state, true_label, false_label):
+        value = self.operand.generate_condition(state, false_label,
+                                                true_label)
+        return None if value is None else not value
 
     def generate_code(self, state):
-        operand_code = self.operand.generate_code(state)
+        self.operand.generate_code(state)
         value = state.pop_result()
         if (not value.type.is_scalar):
             self.log_error(state, "operand is not scalar")
-            return ""
+            return
         if value.is_constant:
-            state.set_result(int(not value.value),
+            state.set_result(constants.fold_unary('!', value.value,
+                                                  value.type),
                     state.types.get_type('int'), True)
-            return ""
+            return
         if value.type.is_float:
-            cmp_instruction = "fcmp one"
+            cmp_instruction, predicate = "fcmp", "oeq"
             cmp_value = "0.0"
+        elif value.type.is_pointer:
+            cmp_instruction, predicate = "icmp", "eq"
+            cmp_value = "null"
         else:
-            cmp_instruction = "icmp ne"
+            cmp_instruction, predicate = "icmp", "eq"
             cmp_value = "0"
         tmp_register = state.get_tmp_register()
         result_register = state.get_tmp_register()
         state.set_result(result_register, state.types.get_type('int'))
-        return self.template % {
-                'operand_code': operand_code,
-                'tmp_register': tmp_register,
-                'cmp_instruction': cmp_instruction,
-                'cmp_value': cmp_value,
-                'type': value.type.llvm_type,
-                'value': value.value,
-                'result_register': result_register,
-            }
+        state.emit(ir.CompareInstruction(tmp_register, cmp_instruction,
+                                         predicate, value.type.llvm_type,
+                                         value.value, cmp_value))
+        state.emit(ir.CastInstruction(result_register, 'zext', 'i1',
+                                      tmp_register, 'i64'))
 
 
 class FunctionCallNode(ExpressionNode):
@@ -695,37 +711,26 @@ class FunctionCallNode(ExpressionNode):
         'function': 0,
         'arguments': 1,
     }
-    template_nonvoid = """
-%(arg_eval_codes)s
-%(arg_cast_codes)s
-%(register)s = call %(type)s* %(name)s(%(arg_values)s)
-"""
-    template_void = """
-%(arg_eval_codes)s
-%(arg_cast_codes)s
-call %(type)s* %(name)s(%(arg_values)s)
-"""
-
     def generate_code(self, state):
-        function_code = self.function.generate_code(state)
+        self.function.generate_code(state)
         function = state.pop_result()
 
         if not function.type.is_function:
             self.log_error(state, "attempting to call a non-function")
-            return ""
+            return
 
-        arg_code, arg_results = [], []
+        arg_results = []
         for argument in self.arguments.children:
-            arg_code.append(argument.generate_code(state))
+            argument.generate_code(state)
             arg_results.append(state.pop_result())
 
         if len(function.type.arg_types) > len(arg_results):
             self.log_error(state, "not enough arguments given")
-            return ""
+            return
         elif (len(function.type.arg_types) < len(arg_results) and
                 not function.type.variable_args):
             self.log_error(state, "too many arguments given")
-            return ""
+            return
 
         for expected_type, result in zip(function.type.arg_types,
                                          arg_results):
@@ -733,27 +738,13 @@ call %(type)s* %(name)s(%(arg_values)s)
             if result.type is not expected_type:
                 raise NotImplementedError
 
-        if function.type.return_type.is_void:
-            template = self.template_void
-        else:
-            template = self.template_nonvoid
-
         register = state.get_tmp_register()
         state.set_result(register, function.type.return_type)
 
-        return template % {
-            'arg_eval_codes': '\n'.join(arg_code),
-            'arg_cast_codes': '',
-            'register': register,
-            'type': function.type.llvm_type,
-            'name': function.pointer,
-            'arg_values': ', '.join(
-                '%(type)s %(val)s' % {
-                    'type': result.type.llvm_type,
-                    'val': result.value,
-                } for result in arg_results
-            ),
-        }
+        state.emit(ir.CallInstruction(
+            None if function.type.return_type.is_void else register,
+            function.type.llvm_type, function.pointer,
+            [(result.type.llvm_type, result.value) for result in arg_results]))
 
 
 class StructMemberExpressionNode(ExpressionNode):
@@ -761,47 +752,31 @@ class StructMemberExpressionNode(ExpressionNode):
         'struct': 0,
         'member': 1,
     }
-    template_lvalue = """
-%(struct_code)s
-%(result_ptr)s = getelementptr %(struct_type)s* %(struct_ptr)s, i32 0, i32 %(index)d
-%(result_reg)s = load %(result_type)s* %(result_ptr)s
-"""
-    template_non_lvalue = """
-%(struct_code)s
-%(result_reg)s = extractvalue %(struct_type)s %(struct_val)s, %(index)d
-"""
-
     def generate_code(self, state):
-        struct_code = self.struct.generate_code(state)
+        self.struct.generate_code(state)
         struct_result = state.pop_result()
         if not struct_result.type.is_struct:
             self.log_error(state, "accessing a member on a non-struct expression")
-            return ""
+            return
 
         member_name = str(self.member)
         member_index, member_type = struct_result.type.get_member(member_name)
 
+        struct_type = struct_result.type.llvm_type
         if struct_result.pointer:
             pointer_reg = state.get_tmp_register()
             result_reg = state.get_tmp_register()
             state.set_result(result_reg, member_type, pointer=pointer_reg)
-            template = self.template_lvalue
+            state.emit(ir.GetElementPtrInstruction(
+                pointer_reg, "%s*" % (struct_type,), struct_result.pointer,
+                [('i32', 0), ('i32', member_index)]))
+            state.emit(ir.LoadInstruction(
+                result_reg, "%s*" % (member_type.llvm_type,), pointer_reg))
         else:
             result_reg = state.get_tmp_register()
-            pointer_reg = ""
             state.set_result(result_reg, member_type)
-            template = self.template_non_lvalue
-
-        return template % {
-            'struct_code': struct_code,
-            'result_ptr': pointer_reg,
-            'struct_type': struct_result.type.llvm_type,
-            'struct_ptr': struct_result.pointer,
-            'index': member_index,
-            'result_reg': result_reg,
-            'result_type': member_type.llvm_type,
-            'struct_val': struct_result.value,
-        }
+            state.emit(ir.ExtractValueInstruction(
+                result_reg, struct_type, struct_result.value, member_index))
 
 
 class VariableExpressionNode(ExpressionNode):
@@ -809,14 +784,26 @@ class VariableExpressionNode(ExpressionNode):
         try:
             var = state.symbols[str(self)]
         except KeyError:
-            self.log_error(state, "unknown variable: %s" % (str(self),))
-            print(state.symbols.dicts)
-            return ""
+            # Like gcc, report each unknown name only once per function
+            # and carry on with a dummy int variable, so that every use
+            # doesn't cause more errors.
+            name = str(self)
+            if name not in state.unknown_names:
+                state.unknown_names.add(name)
+                self.log_error(state, "unknown variable: %s" % (name,))
+            state.set_result(value='undef', type=state.types.get_type('int'),
+                             pointer='undef')
+            return
 
         if var.type.is_function:
             state.set_result(value=None, type=var.type,
                              pointer=var.register)
-            return ""
+            return
+
+        if var.in_register:
+            state.set_result(value=state.ssa.read(var), type=var.type,
+                             pointer=var)
+            return
 
         register = state.get_tmp_register()
 
@@ -826,14 +813,15 @@ class VariableExpressionNode(ExpressionNode):
             # as well).
             ptr_type = state.types.get_pointer_type(var.type.target_type)
             state.set_result(value=register, type=ptr_type)
-            return "%s = getelementptr %s* %s, i64 0, i64 0" % (
-                register, var.type.llvm_type, var.register
-            )
+            state.emit(ir.GetElementPtrInstruction(
+                register, "%s*" % (var.type.llvm_type,), var.register,
+                [('i64', 0), ('i64', 0)]))
+            return
 
         state.set_result(value=register, type=var.type,
                          pointer=var.register)
-        return "%s = load %s* %s" % (register, var.type.llvm_type,
-                                     var.register)
+        state.emit(ir.LoadInstruction(register, "%s*" % (var.type.llvm_type,),
+                                      var.register))
 
 
 class IntegerConstantNode(ExpressionNode):
@@ -849,7 +837,6 @@ class IntegerConstantNode(ExpressionNode):
         state.set_result(value=value,
                          type=state.types.get_type('int'),
                          is_constant=True)
-        return ""
 
 
 class FloatConstantNode(ExpressionNode):
@@ -857,10 +844,9 @@ class FloatConstantNode(ExpressionNode):
         upper = str(self).upper()
         while upper[-1] in ('L', 'F'):
             upper = upper[:-1]
-        state.set_result(value=float(upper),
+        state.set_result(value=constants.FloatConstant(upper),
                          type=state.types.get_type('float'),
                          is_constant=True)
-        return ""
 
 
 class CharConstantNode(ExpressionNode):
@@ -879,7 +865,6 @@ class CharConstantNode(ExpressionNode):
         state.set_result(value,
                          type=state.types.get_type('char'),
                          is_constant=True)
-        return ""
 
 
 char_escape_seqs = {
@@ -906,16 +891,22 @@ def unescape_hex_char_constant(char):
 
 
 class StringLiteralNode(ExpressionNode):
-    template = """
-%(local_register)s = getelementptr %(array_type)s* %(global_register)s, i64 0, i64 0
-"""
-    declaration_template = """
-%(register)s = global %(type)s c"%(content)s"
-"""
-
-    def get_length_content(self, state):
+    # literal -> decoded bytes, shared by all nodes
+    decoded_literals = {}
+
+    def get_data(self):
+        """
+        Returns the bytes of the string, including the zero terminator.
+        """
+        literal = str(self)
+        try:
+            return self.decoded_literals[literal]
+        except KeyError:
+            if len(self.decoded_literals) >= 10000:
+                # Don't let a long running compile server grow forever.
+                self.decoded_literals.clear()
         res = []
-        it = iter(str(self)[1:]) # We keep the ending quote mark as sentinel.
+        it = iter(literal[1:]) # We keep the ending quote mark as sentinel.
         buf = next(it)
         try:
             while True:
@@ -946,29 +937,14 @@ class StringLiteralNode(ExpressionNode):
             pass
         # Replace the ending sentinel with the zero terminator.
         res[-1] = 0
-        length = len(res)
-        res = ''.join('\\%02X' % (byte,) for byte in res)
-        return length, res
+        data = self.decoded_literals[literal] = ''.join(map(chr, res))
+        return data
 
     def generate_code(self, state):
-        register = "@string.%d" % (state._get_next_number(),)
-        length, content = self.get_length_content(state)
-        char_type = state.types.get_type('char')
-        array_type = state.types.get_array_type(char_type, length)
-        ptr_type = state.types.get_pointer_type(char_type)
+        ptr_type = state.types.get_pointer_type(state.types.get_type('char'))
         result_register = state.get_tmp_register()
         state.set_result(result_register, ptr_type)
-        declaration = self.declaration_template % {
-            'register': register,
-            'type': array_type.llvm_type,
-            'content': content,
-        }
-        state.global_declarations.append(declaration)
-        return self.template % {
-            'local_register': result_register,
-            'array_type': array_type.llvm_type,
-            'global_register': register,
-        }
+        state.strings.add_reference(state, self.get_data(), result_register)
 
 
 class AssignmentExpressionNode(ExpressionNode):
@@ -977,12 +953,7 @@ class AssignmentExpressionNode(ExpressionNode):
         'lvalue': 1,
         'rvalue': 2,
     }
-    template = """
-%(lvalue_code)s
-%(rvalue_code)s
-%(operation)s
-%(assignment)s
-"""
+    scan_kind = 'assignment'
     compound_operations = {
         '*=': MultiplicationExpressionNode.perform_operation,
         '/=': DivisionExpressionNode.perform_operation,
@@ -997,98 +968,66 @@ class AssignmentExpressionNode(ExpressionNode):
     }
 
     def generate_code(self, state):
-        lvalue_code = self.lvalue.generate_code(state)
+        self.lvalue.generate_code(state)
         lvalue_result = state.pop_result()
-        rvalue_code = self.rvalue.generate_code(state)
+        self.rvalue.generate_code(state)
         rvalue_result = state.pop_result()
         if not lvalue_result.pointer:
             self.log_error(state, "not an lvalue")
-            return ""
+            return
         if str(self.op) in self.compound_operations:
             func = self.compound_operations[str(self.op)]
             try:
-                operation_code = func(self, state, lvalue_result,
-                                      rvalue_result)
+                func(self, state, lvalue_result, rvalue_result)
             except CompilationError:
-                return ""
+                return
             rvalue_result = state.pop_result()
-        else:
-            operation_code = ""
 
         # TODO: check types and cast for pointers
-        assignment = ""
         if not lvalue_result.type.is_pointer:
-            assignment = state.types.cast_value(rvalue_result, state, lvalue_result.type)
-            rvalue_result = state.pop_result()
+            rvalue_result = state.types.cast(rvalue_result, state,
+                                             lvalue_result.type, self)
 
-        if assignment != "":
-            assignment += "\n"
-
-        assignment += "store %s %s, %s* %s" % (
-            rvalue_result.type.llvm_type, rvalue_result.value,
-            lvalue_result.type.llvm_type, lvalue_result.pointer,
-        )
+        state.emit_store(lvalue_result, rvalue_result)
         state.set_result(rvalue_result.value, rvalue_result.type,
                          rvalue_result.is_constant)
-        return self.template % {
-            'lvalue_code': lvalue_code,
-            'rvalue_code': rvalue_code,
-            'operation': operation_code,
-            'assignment': assignment,
-        }
 
     def toString(self):
         return ""
 
 
 class PostfixExpressionNode(UnaryExpressionNode):
-    template = """
-%(operand_code)s
-%(operation_code)s
-%(assignment_code)s
-"""
+    scan_kind = 'increment'
+
     compound_operations = {
         '++': AdditionExpressionNode.perform_operation,
         '--': SubtractionExpressionNode.perform_operation,
     }
 
     def generate_code(self, state):
-        operand_code = self.operand.generate_code(state)
+        self.operand.generate_code(state)
         value = state.pop_result()
         lvalue_result = value
         state.set_result(1, state.types.get_type('int'), True)
         rvalue_result = state.pop_result()
         if not lvalue_result.pointer:
             self.log_error(state, "not an lvalue")
-            return ""
+            return
         func = self.compound_operations[str(self)]
         try:
-            operation_code = func(self, state, lvalue_result,
-                                  rvalue_result)
+            func(self, state, lvalue_result, rvalue_result)
             rvalue_result = state.pop_result()
         except CompilationError:
-            return ""
+            return
 
         # TODO: check types and cast for pointers
-        assignment = ""
         if not lvalue_result.type.is_pointer:
-            assignment = state.types.cast_value(rvalue_result, state, lvalue_result.type)
-            rvalue_result = state.pop_result()
-
-        if assignment != "":
-            assignment += "\n"
+            rvalue_result = state.types.cast(rvalue_result, state,
+                                             lvalue_result.type, self)
 
-        assignment += "store %s %s, %s* %s" % (
-            rvalue_result.type.llvm_type, rvalue_result.value,
-            lvalue_result.type.llvm_type, lvalue_result.pointer,
-        )
+        state.emit_store(lvalue_result, rvalue_result)
         # push the value back and then increment
         state.push_result(value)
-        return self.template % {
-                'operand_code': operand_code,
-                'operation_code': operation_code,
-                'assignment_code': assignment,
-            }
 
 
 class ConstantOneNode(ExpressionNode):
@@ -1096,7 +1035,6 @@ class ConstantOneNode(ExpressionNode):
         state.set_result(value=int(1),
                          type=state.types.get_type('int'),
                          is_constant=True)
-        return ""
 
     def toString(self):
         return "1"
@@ -1,12 +1,82 @@
+from c_llvm import ir
 from c_llvm.ast.base import AstNode
+from c_llvm.ast.expressions import (PostfixExpressionNode,
+        VariableExpressionNode)
+
+
+def scan_function_body(body):
+    """
+    Finds the variables of a function which can be kept in registers.
+    Returns the set of names of the variables whose address is taken and
+    a dictionary mapping each loop to the set of names of the variables
+    assigned in it. If a loop contains a case or default label of an
+    enclosing switch, it can be entered in its middle and it is mapped to
+    None instead.
+    """
+    address_taken = set()
+    assigned_in_loops = {}
+    # the loops and switches around the current node, innermost last
+    enclosing = []
+    # nodes to visit, (node,) marks the start of a loop or switch and
+    # None its end
+    stack = [body]
+    while stack:
+        node = stack.pop()
+        if node is None:
+            enclosing.pop()
+            continue
+        if type(node) is tuple:
+            enclosing.append(node[0])
+            continue
+        kind = node.scan_kind
+        if kind is None:
+            stack.extend(node.children)
+        elif kind == 'loop' or kind == 'switch':
+            stack.append(None)
+            if isinstance(node, ForNode):
+                # The initialization is not a part of the loop.
+                stack.extend(node.children[1:])
+                stack.append((node,))
+                stack.append(node.exp1)
+            else:
+                stack.extend(node.children)
+                stack.append((node,))
+            if kind == 'loop':
+                assigned_in_loops[node] = set()
+        elif kind == 'case':
+            stack.extend(node.children)
+            for loop in reversed(enclosing):
+                if loop.scan_kind == 'switch':
+                    break
+                assigned_in_loops[loop] = None
+        elif kind == 'address':
+            stack.extend(node.children)
+            # x++ yields the old value of x along with its address
+            target = node.expression
+            while isinstance(target, PostfixExpressionNode):
+                target = target.operand
+            if isinstance(target, VariableExpressionNode):
+                address_taken.add(str(target))
+        else:
+            stack.extend(node.children)
+            if kind == 'assignment':
+                target = node.lvalue
+            else:
+                target = node.operand
+            if isinstance(target, VariableExpressionNode):
+                name = str(target)
+                for loop in enclosing:
+                    names = assigned_in_loops.get(loop)
+                    if names is not None:
+                        names.add(name)
+    return address_taken, assigned_in_loops
 
 
 class CompoundStatementNode(AstNode):
     def generate_code(self, state):
         state.enter_block()
-        children = self.process_children(state)
+        self.process_children(state)
         state.leave_block()
-        return "\n".join(children)
 
     def toString(self):
         return ""
@@ -23,29 +93,16 @@ class IfNode(AstNode):
         'statement': 1
     }
 
-    template = """
-%(exp_code)s
-%(exp_cast_code)s
-br i1 %(exp_cast_value)s, label %%If%(num)d.True, label %%If%(num)d.False
-If%(num)d.True:
-%(statement_code)s
-br label %%If%(num)d.False
-If%(num)d.False:
-"""
-
     def generate_code(self, state):
-        exp_code = self.exp.generate_code(state)
-        exp_result = state.pop_result()
-        exp_cast_code = exp_result.type.cast_to_bool(exp_result, state)
-        exp_cast_result = state.pop_result()
+        num = state.get_label_number()
+        true_label = state.make_label('If', num, 'True')
+        false_label = state.make_label('If', num, 'False')
 
-        return self.template % {
-            'exp_code': exp_code,
-            'exp_cast_code': exp_cast_code,
-            'exp_cast_value': exp_cast_result.value,
-            'num': state._get_next_number(),
-            'statement_code': self.statement.generate_code(state),
-        }
+        self.exp.generate_branch(state, true_label, false_label)
+        state.emit_label(true_label)
+        self.statement.generate_code(state)
+        state.emit_jump(false_label)
+        state.emit_label(false_label)
 
 
 class IfElseNode(AstNode):
@@ -55,33 +112,20 @@ class IfElseNode(AstNode):
         'statement2': 2,
     }
 
-    template = """
-%(exp_code)s
-%(exp_cast_code)s
-br i1 %(exp_cast_value)s, label %%If%(num)d.True, label %%If%(num)d.False
-If%(num)d.True:
-%(statement1_code)s
-br label %%If%(num)d.End
-If%(num)d.False:
-%(statement2_code)s
-br label %%If%(num)d.End
-If%(num)d.End:
-"""
-
     def generate_code(self, state):
-        exp_code = self.exp.generate_code(state)
-        exp_result = state.pop_result()
-        exp_cast_code = exp_result.type.cast_to_bool(exp_result, state)
-        exp_cast_result = state.pop_result()
+        num = state.get_label_number()
+        true_label = state.make_label('If', num, 'True')
+        false_label = state.make_label('If', num, 'False')
+        end_label = state.make_label('If', num, 'End')
 
-        return self.template % {
-            'exp_code': exp_code,
-            'exp_cast_code': exp_cast_code,
-            'exp_cast_value': exp_cast_result.value,
-            'num': state._get_next_number(),
-            'statement1_code': self.statement1.generate_code(state),
-            'statement2_code': self.statement2.generate_code(state),
-        }
+        self.exp.generate_branch(state, true_label, false_label)
+        state.emit_label(true_label)
+        self.statement1.generate_code(state)
+        state.emit_jump(end_label)
+        state.emit_label(false_label)
+        self.statement2.generate_code(state)
+        state.emit_jump(end_label)
+        state.emit_label(end_label)
 
 
 class WhileStatement(AstNode):
@@ -89,55 +133,58 @@ class WhileStatement(AstNode):
         'exp': 0,
         'statement': 1
     }
-
-    def generate_code(self, state):
-        num = state._get_next_number()
-        state.break_labels.append("While%d.End" % num)
-        state.continue_labels.append("While%d.Body" % num)
-        exp_code = self.exp.generate_code(state)
-        exp_result = state.pop_result()
-        exp_cast_code = exp_result.type.cast_to_bool(exp_result, state)
-        exp_cast_value = state.pop_result().value
-        statement_code = self.statement.generate_code(state)
+    scan_kind = 'loop'
+
+    def get_labels(self, state):
+        """
+        Returns the test, body and end labels of the loop.
+        """
+        num = state.get_label_number()
+        return (state.make_label('While', num, 'Test'),
+                state.make_label('While', num, 'Body'),
+                state.make_label('While', num, 'End'))
+
+    def generate_test(self, state, labels):
+        test_label, body_label, end_label = labels
+        self.exp.generate_branch(state, body_label, end_label)
+
+    def generate_body(self, state, labels):
+        test_label, body_label, end_label = labels
+        state.break_labels.append(end_label)
+        state.continue_labels.append(test_label)
+        self.statement.generate_code(state)
         state.break_labels.pop()
         state.continue_labels.pop()
-        return self.template % {
-            'exp_code': exp_code,
-            'exp_cast_code': exp_cast_code,
-            'exp_cast_value': exp_cast_value,
-            'num': num,
-            'statement_code': statement_code,
-        }
 
 
 class WhileNode(WhileStatement):
-    # end previous basic block with br
-    template = """
-br label %%While%(num)d.Test
-While%(num)d.Test:
-%(exp_code)s
-%(exp_cast_code)s
-br i1 %(exp_cast_value)s, label %%While%(num)d.Body, label %%While%(num)d.End
-While%(num)d.Body:
-%(statement_code)s
-br label %%While%(num)d.Test
-While%(num)d.End:
-"""
+    def generate_code(self, state):
+        labels = self.get_labels(state)
+        test_label, body_label, end_label = labels
+        # end previous basic block with br
+        state.emit_jump(test_label)
+        state.emit_loop_header(test_label, self)
+        self.generate_test(state, labels)
+        state.emit_label(body_label)
+        self.generate_body(state, labels)
+        state.emit_jump(test_label)
+        state.close_loop_header(test_label)
+        state.emit_label(end_label)
 
 
 class DoWhileNode(WhileStatement):
-    # end previous basic block with br
-    template = """
-br label %%While%(num)d.Body
-While%(num)d.Body:
-%(statement_code)s
-br label %%While%(num)d.Test
-While%(num)d.Test:
-%(exp_code)s
-%(exp_cast_code)s
-br i1 %(exp_cast_value)s, label %%While%(num)d.Body, label %%While%(num)d.End
-While%(num)d.End:
-"""
+    def generate_code(self, state):
+        labels = self.get_labels(state)
+        test_label, body_label, end_label = labels
+        # end previous basic block with br
+        state.emit_jump(body_label)
+        state.emit_loop_header(body_label, self)
+        self.generate_body(state, labels)
+        state.emit_jump(test_label)
+        state.emit_label(test_label)
+        self.generate_test(state, labels)
+        state.close_loop_header(body_label)
+        state.emit_label(end_label)
 
 
 class ForNode(AstNode):
@@ -147,84 +194,66 @@ class ForNode(AstNode):
         'exp3': 2,
         'statement': 3
     }
-
-    template = """
-%(e1_code)s
-br label %%For%(num)d.Test
-For%(num)d.Test:
-%(e2_code)s
-%(e2_cast_code)s
-br i1 %(e2_cast_value)s, label %%For%(num)d.Body, label %%For%(num)d.End
-For%(num)d.Body:
-%(statement_code)s
-br label %%For%(num)d.Inc
-For%(num)d.Inc:
-%(e3_code)s
-br label %%For%(num)d.Test
-For%(num)d.End:
-"""
+    scan_kind = 'loop'
 
     def generate_code(self, state):
         state.enter_block()
-        num = state._get_next_number()
-        state.break_labels.append("For%d.End" % num)
-        state.continue_labels.append("For%d.Inc" % num)
-        e1_code = self.exp1.generate_code(state)
+        num = state.get_label_number()
+        test_label = state.make_label('For', num, 'Test')
+        body_label = state.make_label('For', num, 'Body')
+        inc_label = state.make_label('For', num, 'Inc')
+        end_label = state.make_label('For', num, 'End')
+        self.exp1.generate_code(state)
 
         # Pop the result explicitly to ensure we won't process a discarded
         # result from a previous expression if e2 was omitted.
         state.pop_result()
 
-        e2_code = self.exp2.generate_code(state)
-        e2_result = state.pop_result()
-        if not e2_result:
-            e2_cast_code = ""
-            e2_cast_value = 1
+        state.emit_jump(test_label)
+        state.emit_loop_header(test_label, self)
+        if self.exp2.children:
+            self.exp2.children[0].generate_branch(state, body_label,
+                                                  end_label)
         else:
-            e2_cast_code = e2_result.type.cast_to_bool(e2_result, state)
-            e2_cast_value = state.pop_result().value
+            # An omitted condition is always true.
+            state.emit_jump(body_label)
 
-        e3_code = self.exp3.generate_code(state)
-        statement_code = self.statement.generate_code(state)
+        state.emit_label(body_label)
+        state.break_labels.append(end_label)
+        state.continue_labels.append(inc_label)
+        self.statement.generate_code(state)
         state.break_labels.pop()
         state.continue_labels.pop()
+        state.emit_jump(inc_label)
+
+        state.emit_label(inc_label)
+        self.exp3.generate_code(state)
+        state.emit_jump(test_label)
+        state.close_loop_header(test_label)
+        state.emit_label(end_label)
         state.leave_block()
-        return self.template % {
-            'e1_code': e1_code,
-            'e2_code': e2_code,
-            'e3_code': e3_code,
-            'e2_cast_code': e2_cast_code,
-            'e2_cast_value': e2_cast_value,
-            'num': num,
-            'statement_code': statement_code,
-        }
 
 
 class BreakStatementNode(AstNode):
     def generate_code(self, state):
         if not state.break_labels:
             self.log_error(state, "'break' used outside of loop and switch")
-            return ""
-        return "br label %%%s" % (state.break_labels[-1])
+            return
+        state.emit_jump(state.break_labels[-1])
 
 
 class ContinueStatementNode(AstNode):
     def generate_code(self, state):
         if not state.continue_labels:
             self.log_error(state, "'continue' used outside of loop")
-            return ""
-        return "br label %%%s" % (state.continue_labels[-1])
+            return
+        state.emit_jump(state.continue_labels[-1])
 
 
 class ReturnStatementNode(AstNode):
     child_attributes = {
         'expression': 0,
     }
-    template = """
-%(expression_code)s
-%(cast_code)s
-ret %(type)s %(value)s
-"""
 
     def generate_code(self, state):
         return_type = state.return_type
@@ -232,19 +261,15 @@ ret %(type)s %(value)s
             if self.getChildCount():
                 self.log_error(state, "a void function can't return a "
                                "value")
-            return "ret void"
-        expression_code = self.expression.generate_code(state)
-        expression_result = state.pop_result()
-        cast_code = state.types.cast_value(expression_result,
-                                           state, return_type)
+            state.emit_terminator(ir.ReturnInstruction())
+            return
+        self.expression.generate_code(state)
         expression_result = state.pop_result()
+        expression_result = state.types.cast(expression_result, state,
+                                             return_type, self)
         state.return_found = True
-        return self.template % {
-            'expression_code': expression_code,
-            'cast_code': cast_code,
-            'type': return_type.llvm_type,
-            'value': expression_result.value,
-        }
+        state.emit_terminator(ir.ReturnInstruction(return_type.llvm_type,
+                                                   expression_result.value))
 
 
 class SwitchStatementNode(AstNode):
@@ -252,39 +277,36 @@ class SwitchStatementNode(AstNode):
         'exp': 0,
         'statement': 1
     }
-
-    template = """
-%(exp_code)s
-switch i64 %(exp_value)s, label %%%(default_label)s [ %(labels_list)s ]
-%(statement_code)s
-br label %%Switch%(num)d.End
-Switch%(num)d.End:
-"""
+    scan_kind = 'switch'
 
     def generate_code(self, state):
-        num = state._get_next_number()
-        state.break_labels.append("Switch%d.End" % num)
-        state.enter_switch(num)
-        exp_code = self.exp.generate_code(state)
-        exp_value = state.pop_result().value
-        default_label = "Switch%d.Default" % num
-        labels_list = ""
-        statement_code = self.statement.generate_code(state)
+        num = state.get_label_number()
+        end_label = state.make_label('Switch', num, 'End')
+        state.break_labels.append(end_label)
+        self.exp.generate_code(state)
+        exp_result = state.pop_result()
+        exp_type = exp_result.type
+        if not exp_type.is_integer:
+            self.exp.log_error(state, "switch quantity is not an integer")
+            exp_type = state.types.get_type('int')
+        # The list of cases is only known once the body has been
+        # generated.
+        switch_slot = state.reserve_code()
+        switch = state.enter_switch(num, exp_type)
+        self.statement.generate_code(state)
+        state.emit_jump(end_label)
         # if default-label was not found, use end-label, llvm needs something
-        if not state.switches[-1][1]:
-            default_label = "Switch%d.End" % num
-        for label in state.switches[-1][2]:
-            labels_list += label
+        default_label = switch.default_label
+        if default_label is None:
+            default_label = end_label
+            state.add_switch_edge(end_label)
+        state.emit_label(end_label)
         state.leave_switch()
         state.break_labels.pop()
-        return self.template % {
-            'exp_code': exp_code,
-            'exp_value': exp_value,
-            'default_label': default_label,
-            'labels_list': labels_list,
-            'num': num,
-            'statement_code': statement_code,
-        }
+        state.fill_code(switch_slot, [
+            ir.SwitchInstruction(exp_type.llvm_type, exp_result.value,
+                                 default_label, switch.cases),
+        ])
 
 
 class CaseStatementNode(AstNode):
@@ -292,54 +314,59 @@ class CaseStatementNode(AstNode):
         'exp': 0,
         'statement': 1
     }
-
-    template = """
-br label %%%(case_label)s
-%(case_label)s:
-%(statement_code)s
-"""
+    scan_kind = 'case'
 
     def generate_code(self, state):
         if not state.switches:
             self.log_error(state, "'case' used outside of 'switch' statement")
-            return ""
-        current_switch = state.switches[-1]
-        exp_code = self.exp.generate_code(state)
+            return
+        switch = state.switches[-1]
+        self.exp.generate_code(state)
         exp_result = state.pop_result()
         if not exp_result.is_constant:
             self.log_error(state, "'case' expression must be constant")
-            return ""
-        case_num = exp_result.value
-        num = current_switch[0]
-        case_label = "Switch%d.Case%d" % (num, case_num)
-        current_switch[2].append("i64 %d, label %%%s\n" % (case_num, case_label))
-        statement_code = self.statement.generate_code(state)
-        return self.template % {
-            'case_label': case_label,
-            'statement_code': statement_code,
-        }
+            return
+        if not exp_result.type.is_integer:
+            self.log_error(state, "'case' expression must be an integer")
+            return
+        case_num = state.types.cast(exp_result, state,
+                                    state.types.get_type('int')).value
+        if case_num in switch:
+            self.log_error(state, "duplicate case value %d" % (case_num,))
+            self.statement.generate_code(state)
+            return
+        case_label = state.make_label('Switch', switch.number, 'Case',
+                                      case_num)
+        state.emit_jump(case_label)
+        if switch.can_match(case_num):
+            switch.add_case(case_num, case_label)
+            state.add_switch_edge(case_label)
+        else:
+            switch.add_unmatchable_case(case_num)
+            self.log_warning(state, "case value %d is out of range of "
+                             "the switch expression" % (case_num,))
+        state.emit_label(case_label)
+        self.statement.generate_code(state)
 
 
 class DefaultStatementNode(AstNode):
     child_attributes = {
         'statement': 0
     }
-
-    template = """
-br label %%%(default_label)s
-%(default_label)s:
-%(statement_code)s
-"""
+    scan_kind = 'case'
 
     def generate_code(self, state):
         if not state.switches:
             self.log_error(state, "'default' used outside of 'switch' statement")
-            return ""
-        current_switch = state.switches[-1]
-        current_switch[1] = True
-        default_label = "Switch%d.Default" % current_switch[0]
-        statement_code = self.statement.generate_code(state)
-        return self.template % {
-            'default_label': default_label,
-            'statement_code': statement_code,
-        }
+            return
+        switch = state.switches[-1]
+        if switch.default_label is not None:
+            self.log_error(state, "multiple default labels in one switch")
+            self.statement.generate_code(state)
+            return
+        default_label = state.make_label('Switch', switch.number, 'Default')
+        switch.default_label = default_label
+        state.emit_jump(default_label)
+        state.add_switch_edge(default_label)
+        state.emit_label(default_label)
+        self.statement.generate_code(state)
@@ -0,0 +1,240 @@
+"""
+On-disk cache of compiled .ll outputs.
+
+Entries are addressed by a digest of the source code, the compiler
+version and all options that influence the output. Each entry holds the
+generated code together with the warnings reported while compiling it.
+The cache is shared by concurrent builds: entries are written atomically
+and a missing or half-evicted entry is simply treated as a miss.
+"""
+import errno
+import fcntl
+import hashlib
+import json
+import os
+import tempfile
+from multiprocessing import util
+
+import c_llvm
+from c_llvm.diagnostics import Diagnostic
+
+
+_fingerprint = None
+
+# Number of hits, misses and stores counted in memory before they are
+# added to the shared statistics file.
+STATS_FLUSH_INTERVAL = 64
+
+# Once the cache is over its size limit, entries are evicted until it is
+# down to this fraction of the limit, so that the directory isn't scanned
+# again on each of the following stores.
+EVICTION_LOW_WATER = 0.9
+
+
+def compiler_fingerprint():
+    """
+    Returns a digest of the compiler's own source code, so that cache
+    entries produced by a different version of the compiler (including
+    a regenerated parser) are never reused.
+    """
+    global _fingerprint
+    if _fingerprint is None:
+        digest = hashlib.sha1(c_llvm.__version__)
+        package_dir = os.path.dirname(os.path.abspath(c_llvm.__file__))
+        for dirpath, dirnames, filenames in sorted(os.walk(package_dir)):
+            dirnames.sort()
+            for filename in sorted(filenames):
+                if not filename.endswith('.py'):
+                    continue
+                path = os.path.join(dirpath, filename)
+                digest.update(os.path.relpath(path, package_dir))
+                with open(path, 'rb') as f:
+                    digest.update(f.read())
+        _fingerprint = digest.hexdigest()
+    return _fingerprint
+
+
+class CompilationCache(object):
+    """
+    A directory of cached outputs with a size limit. Every hit refreshes
+    the modification time of the entry which is then used to evict the
+    least recently used entries once the limit is exceeded.
+
+    The size of the cache is scanned once and afterwards only the sizes
+    of this instance's stores are added to it; the directory is scanned
+    again only when that estimate exceeds the limit. Counters are kept in
+    memory and written to the statistics file every STATS_FLUSH_INTERVAL
+    operations and when the process exits.
+    """
+    suffix = '.ll'
+    counters = ('hits', 'misses', 'stores', 'evictions')
+
+    def __init__(self, directory, max_size):
+        self.directory = directory
+        self.max_size = max_size
+        self.stats_file = os.path.join(directory, 'stats.json')
+        self.pending_stats = {}
+        self.pending_count = 0
+        self.estimated_size = None
+        try:
+            os.makedirs(directory)
+        except OSError as e:
+            if e.errno != errno.EEXIST:
+                raise
+        # Runs at exit in pool workers as well, unlike atexit handlers.
+        util.Finalize(self, self.flush_stats, exitpriority=10)
+
+    def make_key(self, source, options=()):
+        """
+        options is a sequence of (name, value) pairs of all settings that
+        change the generated code.
+        """
+        digest = hashlib.sha256(compiler_fingerprint())
+        digest.update(repr(sorted(options)))
+        digest.update('\0')
+        digest.update(source)
+        return digest.hexdigest()
+
+    def _entry_path(self, key):
+        return os.path.join(self.directory, key[:2], key + self.suffix)
+
+    def get(self, key):
+        """
+        Returns a tuple (code, list of diagnostics) or None.
+        """
+        path = self._entry_path(key)
+        try:
+            with open(path, 'rb') as f:
+                header = f.readline()
+                code = f.read()
+            os.utime(path, None)
+            diagnostics = [Diagnostic.from_dict(diagnostic)
+                           for diagnostic in json.loads(header)]
+        except (IOError, OSError, ValueError, KeyError, TypeError):
+            self._count('misses')
+            return None
+        self._count('hits')
+        return code, diagnostics
+
+    def put(self, key, code, diagnostics=()):
+        """
+        Stores code along with the diagnostics (warnings) reported while
+        compiling it.
+        """
+        # The diagnostics are stored as a single line of JSON in front of
+        # the code.
+        data = json.dumps([diagnostic.to_dict()
+                           for diagnostic in diagnostics]) + '\n' + code
+        path = self._entry_path(key)
+        entry_dir = os.path.dirname(path)
+        try:
+            os.mkdir(entry_dir)
+        except OSError as e:
+            if e.errno != errno.EEXIST:
+                raise
+        fd, tmp_path = tempfile.mkstemp(dir=entry_dir, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(data)
+            # rename is atomic, readers see either the whole entry or
+            # nothing.
+            os.rename(tmp_path, path)
+        except:
+            os.unlink(tmp_path)
+            raise
+        self._count('stores')
+        if self.estimated_size is None:
+            self.estimated_size = sum(size for mtime, size, path
+                                      in self._entries())
+        else:
+            self.estimated_size += len(data)
+        if self.estimated_size > self.max_size:
+            self.evict()
+
+    def _entries(self):
+        """
+        Yields (mtime, size, path) for every entry in the cache.
+        """
+        for dirpath, dirnames, filenames in os.walk(self.directory):
+            for filename in filenames:
+                if not filename.endswith(self.suffix):
+                    continue
+                path = os.path.join(dirpath, filename)
+                try:
+                    st = os.stat(path)
+                except OSError:
+                    continue
+                yield st.st_mtime, st.st_size, path
+
+    def evict(self):
+        """
+        Removes the least recently used entries if the total size exceeds
+        max_size, until it fits into EVICTION_LOW_WATER of it.
+        """
+        entries = sorted(self._entries())
+        total = sum(size for mtime, size, path in entries)
+        self.estimated_size = total
+        if total <= self.max_size:
+            return
+        target = int(self.max_size * EVICTION_LOW_WATER)
+        evicted = 0
+        for mtime, size, path in entries:
+            if total <= target:
+                break
+            try:
+                os.unlink(path)
+            except OSError:
+                # Another process got there first.
+                pass
+            total -= size
+            evicted += 1
+        self.estimated_size = total
+        if evicted:
+            self._count('evictions', evicted)
+
+    def _update_stats(self, update):
+        with open(self.stats_file, 'a+') as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            f.seek(0)
+            try:
+                stats = json.loads(f.read())
+            except ValueError:
+                stats = {}
+            update(stats)
+            f.seek(0)
+            f.truncate()
+            f.write(json.dumps(stats))
+        return stats
+
+    def _count(self, counter, amount=1):
+        self.pending_stats[counter] = (self.pending_stats.get(counter, 0) +
+                                       amount)
+        self.pending_count += 1
+        if self.pending_count >= STATS_FLUSH_INTERVAL:
+            self.flush_stats()
+
+    def flush_stats(self):
+        """
+        Adds the counters collected in memory to the statistics file.
+        """
+        if not self.pending_stats:
+            return
+        pending = self.pending_stats
+        self.pending_stats = {}
+        self.pending_count = 0
+
+        def update(stats):
+            for counter, amount in pending.items():
+                stats[counter] = stats.get(counter, 0) + amount
+        self._update_stats(update)
+
+    def get_stats(self):
+        self.flush_stats()
+        stats = self._update_stats(lambda stats: None)
+        result = dict((counter, stats.get(counter, 0))
+                      for counter in self.counters)
+        entries = list(self._entries())
+        result['entries'] = len(entries)
+        result['size'] = sum(size for mtime, size, path in entries)
+        result['max_size'] = self.max_size
+        return result
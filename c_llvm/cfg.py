@@ -0,0 +1,189 @@
+"""
+Clean up of the control flow graph of generated functions.
+
+The code generator emits the code of every statement in isolation, so
+it leaves behind code following return, break and continue, the
+fallback return at the end of every function and blocks which only
+jump to the next label. None of it changes what the program does, but
+all of it has to be parsed by llc or lli.
+"""
+from c_llvm.ir import JumpInstruction
+from c_llvm.switches import build_lookup_tables
+
+
+def simplify_module(module):
+    for item in module.items:
+        if not isinstance(item, str):
+            simplify_function(item, module.declarations)
+
+
+def simplify_function(function, declarations):
+    """
+    Removes unreachable code and blocks which only jump to another one,
+    and merges blocks into their only predecessor when it jumps straight
+    to them. Switches selecting constants are replaced by lookup tables,
+    which are appended to declarations.
+    """
+    function.resolve()
+    for block in function.blocks:
+        truncate_after_terminator(block)
+    remove_unreachable_blocks(function)
+    if build_lookup_tables(function, declarations):
+        remove_unreachable_blocks(function)
+    changed = True
+    while changed:
+        changed = False
+        for block in function.blocks[1:]:
+            if block.function is not function:
+                continue
+            if forward_jump_block(block) or merge_into_predecessor(block):
+                changed = True
+        if changed:
+            function.blocks = [block for block in function.blocks
+                               if block.function is function]
+
+
+def truncate_after_terminator(block):
+    """
+    Drops the instructions following the first terminator of block.
+    """
+    for index, instruction in enumerate(block.instructions):
+        if instruction.is_terminator:
+            for dead in block.instructions[index + 1:]:
+                dead.drop_operands()
+                dead.block = None
+            del block.instructions[index + 1:]
+            return
+
+
+def remove_unreachable_blocks(function):
+    reachable = set()
+    pending = [function.blocks[0]]
+    while pending:
+        block = pending.pop()
+        if block not in reachable:
+            reachable.add(block)
+            pending.extend(block.successors)
+
+    dead_blocks = [block for block in function.blocks
+                   if block not in reachable]
+    if not dead_blocks:
+        return
+    for block in dead_blocks:
+        for instruction in block.instructions:
+            instruction.drop_operands()
+    for block in dead_blocks:
+        # Only phis can still refer to a dead block, as the predecessor
+        # of an edge which is never taken. A value defined in a dead
+        # block can't be used anywhere else in valid code, but better
+        # safe than sorry.
+        for phi in list(block.uses):
+            remove_incoming(phi, block)
+        for instruction in block.instructions:
+            if instruction.uses:
+                instruction.replace_all_uses_with('undef')
+        detach_block(block)
+    function.blocks = [block for block in function.blocks
+                       if block in reachable]
+
+
+def remove_incoming(phi, block):
+    """
+    Drops the value of phi coming from block. A phi left with a single
+    value is replaced by it.
+    """
+    if phi.block is None:
+        return
+    incoming = [(value, label) for value, label in phi.incoming
+                if label is not block]
+    phi.set_incoming(incoming)
+    if len(incoming) == 1:
+        replace_phi(phi, incoming[0][0])
+
+
+def replace_phi(phi, value):
+    if value is phi:
+        value = 'undef'
+    phi.replace_all_uses_with(value)
+    phi.erase()
+
+
+def detach_block(block):
+    """
+    Removes a block without any uses left from its function.
+    """
+    function = block.function
+    if function.labels.get(block.name) is block:
+        del function.labels[block.name]
+    block.function = None
+
+
+def forward_jump_block(block):
+    """
+    Makes the predecessors of a block consisting of a single jump go
+    straight to its target. The phis of the target get the value coming
+    from the block for each of them instead, so this isn't possible if
+    some of them already are predecessors of the target or if one of
+    them is the entry block without a label. Neither is it if one of
+    them jumps to the block along several edges, a phi needs a value for
+    each of them.
+    """
+    if len(block.instructions) != 1:
+        return False
+    jump = block.instructions[0]
+    if not isinstance(jump, JumpInstruction):
+        return False
+    target = jump.operands[0]
+    if target is block:
+        return False
+    predecessors = block.predecessors
+    phis = target.phis
+    if phis and (set(predecessors) & set(target.predecessors) or
+                 any(pred.name is None or pred.successors.count(block) > 1
+                     for pred in predecessors)):
+        return False
+
+    for phi in phis:
+        incoming = []
+        for value, label in phi.incoming:
+            if label is block:
+                incoming.extend((value, pred) for pred in predecessors)
+            else:
+                incoming.append((value, label))
+        phi.set_incoming(incoming)
+    for user in list(block.uses):
+        user.replace_operand(block, target)
+    jump.drop_operands()
+    detach_block(block)
+    return True
+
+
+def merge_into_predecessor(block):
+    """
+    Appends block to its only predecessor if that ends with a jump to
+    it.
+    """
+    predecessor = block.single_predecessor
+    if predecessor is None or predecessor is block:
+        return False
+    jump = predecessor.terminator
+    if not isinstance(jump, JumpInstruction):
+        return False
+
+    for phi in block.phis:
+        replace_phi(phi, phi.incoming[0][0])
+    jump.erase()
+    for instruction in block.instructions:
+        instruction.block = predecessor
+    predecessor.instructions.extend(block.instructions)
+    block.instructions = []
+    # The successors' phis now get their values from the predecessor,
+    # which needs a label for that. Only the entry block may not have
+    # one, it takes over the label of the merged block.
+    if predecessor.name is None:
+        predecessor.name = block.name
+        predecessor.function.labels[block.name] = predecessor
+    for user in list(block.uses):
+        user.replace_operand(block, predecessor)
+    detach_block(block)
+    return True
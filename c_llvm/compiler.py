@@ -0,0 +1,203 @@
+"""
+In-process compilation API.
+
+    >>> from c_llvm.compiler import compile_string
+    >>> result = compile_string("int main() { return 0; }")
+    >>> result.code          # LLVM assembly, None if compilation failed
+    >>> result.diagnostics   # list of Diagnostic instances
+
+Nothing is printed unless explicitly requested.
+"""
+import threading
+from collections import namedtuple
+
+import antlr3
+
+from c_llvm.ast.base import AstTreeAdaptor
+from c_llvm.diagnostics import (DEFAULT_ERROR_LIMIT, Diagnostic,
+                                 DiagnosticEngine)
+from c_llvm.exceptions import CompilationError, ErrorLimitReached
+from c_llvm.lexer import FastLexer
+from c_llvm.parser.c_grammarLexer import c_grammarLexer
+from c_llvm.parser.c_grammarParser import c_grammarParser
+from c_llvm.timing import NullTimer, TimingTreeAdaptor
+
+
+class CompileResult(namedtuple('CompileResult', ['code', 'diagnostics'])):
+    """
+    The output of a single compilation. code is None if there were any
+    errors, diagnostics contains both errors and warnings.
+    """
+    __slots__ = ()
+
+    @property
+    def ok(self):
+        return self.code is not None
+
+    @property
+    def errors(self):
+        return [diagnostic for diagnostic in self.diagnostics
+                if diagnostic.severity == 'error']
+
+
+class DiagnosticsRecognizerMixin(object):
+    """
+    Reports syntax errors to the DiagnosticEngine in self.diagnostics
+    instead of printing them to stderr.
+    """
+    def displayRecognitionError(self, tokenNames, e):
+        self.diagnostics.report(Diagnostic(
+            'error',
+            e.line,
+            e.charPositionInLine,
+            self.getErrorMessage(e, tokenNames),
+        ))
+
+
+class Lexer(DiagnosticsRecognizerMixin, c_grammarLexer):
+    pass
+
+
+class Parser(DiagnosticsRecognizerMixin, c_grammarParser):
+    pass
+
+
+class Compiler(object):
+    """
+    Compiles C source code into LLVM assembly.
+
+    Setting up the lexer and parser is expensive, so they are created
+    once and reused by every call. This also means an instance must not
+    be used from several threads at once.
+
+    With fast_lexer the source is tokenized by c_llvm.lexer.FastLexer
+    instead of the lexer generated by antlr.
+
+    The remaining keyword arguments are code generation options passed
+    on to CompilerState, e.g. compact_names. They are part of the cache
+    key since they change the output. The error_limit option applies to
+    syntax errors as well.
+    """
+    def __init__(self, cache=None, time_report=False, fast_lexer=False,
+                 **codegen_options):
+        self.cache = cache
+        self.codegen_options = codegen_options
+        self.time_report = time_report
+        self.fast_lexer = fast_lexer
+        if fast_lexer:
+            self.lexer = FastLexer(c_grammarParser.tokenNames)
+        else:
+            self.lexer = Lexer(antlr3.ANTLRStringStream(""))
+        self.parser = Parser(antlr3.CommonTokenStream(self.lexer))
+        if time_report:
+            self.parser.setTreeAdaptor(TimingTreeAdaptor())
+        else:
+            self.parser.setTreeAdaptor(AstTreeAdaptor())
+        self.reset_diagnostics()
+
+    def reset_diagnostics(self):
+        self.diagnostics = DiagnosticEngine(self.codegen_options.get(
+            'error_limit', DEFAULT_ERROR_LIMIT))
+        self.lexer.diagnostics = self.parser.diagnostics = self.diagnostics
+        return self.diagnostics
+
+    def parse(self, source, timer=None):
+        """
+        Returns the AST of source. Syntax errors are collected in
+        self.diagnostics. ErrorLimitReached is raised if there are too
+        many of them.
+        """
+        if timer is None:
+            timer = NullTimer()
+        if self.fast_lexer:
+            self.lexer.set_source(source)
+        else:
+            self.lexer.setCharStream(antlr3.ANTLRStringStream(source))
+        tokens = antlr3.CommonTokenStream(self.lexer)
+        with timer.phase('lex'):
+            # The token stream lexes lazily, force it to do all the work
+            # now so that it doesn't count towards the parser.
+            tokens.fillBuffer()
+        self.parser.setTokenStream(tokens)
+        adaptor = self.parser.getTreeAdaptor()
+        if self.time_report:
+            adaptor.reset()
+        with timer.phase('parse'):
+            root = self.parser.translation_unit().tree
+        if self.time_report:
+            timer.split('parse', 'tree', adaptor.wall)
+        return root
+
+    def compile_string(self, source, timer=None, print_tree=False):
+        """
+        Compiles source code, or fetches it from the cache if there is
+        one. Returns a CompileResult.
+        """
+        if timer is None:
+            timer = NullTimer()
+        key = None
+        if self.cache is not None:
+            with timer.phase('cache'):
+                key = self.cache.make_key(source,
+                                          self.codegen_options.items())
+                cached = self.cache.get(key)
+            if cached is not None:
+                code, warnings = cached
+                return CompileResult(code, warnings)
+
+        diagnostics = self.reset_diagnostics()
+        try:
+            root = self.parse(source, timer)
+        except ErrorLimitReached:
+            return CompileResult(None, list(diagnostics))
+        if diagnostics.errors:
+            return CompileResult(None, list(diagnostics))
+        if print_tree:
+            print "tree = " + root.toStringTree()
+        warnings = list(diagnostics)
+        try:
+            with timer.phase('codegen'):
+                code = root.generate_code(warnings, **self.codegen_options)
+        except CompilationError as e:
+            return CompileResult(None, warnings + e.diagnostics)
+
+        if key is not None:
+            with timer.phase('cache'):
+                self.cache.put(key, code, warnings)
+        return CompileResult(code, warnings)
+
+    def compile_stream(self, stream, **kwargs):
+        return self.compile_string(stream.read(), **kwargs)
+
+    def compile_file(self, filename, **kwargs):
+        """
+        Compiles the file called filename. Unlike compilation errors, an
+        IOError while reading the file is raised.
+        """
+        with open(filename) as f:
+            return self.compile_stream(f, **kwargs)
+
+
+_local = threading.local()
+
+
+def get_compiler():
+    """
+    Returns the Compiler instance of the current thread.
+    """
+    compiler = getattr(_local, 'compiler', None)
+    if compiler is None:
+        compiler = _local.compiler = Compiler()
+    return compiler
+
+
+def compile_string(source, **kwargs):
+    return get_compiler().compile_string(source, **kwargs)
+
+
+def compile_stream(stream, **kwargs):
+    return get_compiler().compile_stream(stream, **kwargs)
+
+
+def compile_file(filename, **kwargs):
+    return get_compiler().compile_file(filename, **kwargs)
@@ -0,0 +1,145 @@
+"""
+Compile time evaluation of constant expressions.
+
+The results are exactly those of the code which would be generated
+otherwise: integers wrap around in two's complement at the width of
+their type, division truncates towards zero, the remainder has the sign
+of the dividend, >> is a logical shift (as emitted for all integers) and
+doubles follow IEEE 754. Operations whose result is undefined, like
+division by zero or shifting by more than the width, aren't folded.
+"""
+from fractions import Fraction
+import math
+import operator
+import struct
+
+
+class FloatConstant(float):
+    """
+    A double which formats itself as LLVM expects: LLVM only accepts
+    decimal constants which are exactly representable, everything else
+    has to be written as the hexadecimal bit pattern.
+    """
+    __slots__ = ()
+
+    def __str__(self):
+        value = float(self)
+        if not (math.isinf(value) or math.isnan(value)):
+            text = repr(value)
+            if 'e' in text and '.' not in text:
+                text = text.replace('e', '.0e')
+            if Fraction(text) == Fraction(value):
+                return text
+        return "0x%016X" % struct.unpack('>Q', struct.pack('>d', value))
+
+    __repr__ = __str__
+
+
+def to_signed(value, bits):
+    """
+    Wraps an integer around to a signed value of the given width.
+    """
+    value &= (1 << bits) - 1
+    if value >> (bits - 1):
+        value -= 1 << bits
+    return value
+
+
+def divide(left, right):
+    quotient = abs(left) // abs(right)
+    if (left < 0) != (right < 0):
+        return -quotient
+    return quotient
+
+
+def remainder(left, right):
+    return left - right * divide(left, right)
+
+
+INTEGER_OPERATIONS = {
+    '+': operator.add,
+    '-': operator.sub,
+    '*': operator.mul,
+    '/': divide,
+    '%': remainder,
+    '&': operator.and_,
+    '|': operator.or_,
+    '^': operator.xor,
+    '<<': operator.lshift,
+}
+
+FLOAT_OPERATIONS = {
+    '+': operator.add,
+    '-': operator.sub,
+    '*': operator.mul,
+    '/': operator.truediv,
+    # Only reachable for constants, like the remainder instruction of
+    # LLVM it has the sign of the dividend.
+    '%': math.fmod,
+}
+
+COMPARISONS = {
+    '<': operator.lt,
+    '>': operator.gt,
+    '<=': operator.le,
+    '>=': operator.ge,
+    '==': operator.eq,
+    '!=': operator.ne,
+}
+
+
+def fold_binary(op, left, right, type):
+    """
+    Returns the value of left op right, both of them constants of type,
+    or None if it can't be computed at compile time.
+    """
+    if type.is_float:
+        if op not in FLOAT_OPERATIONS or (op in ('/', '%') and right == 0):
+            return None
+        return FloatConstant(FLOAT_OPERATIONS[op](float(left), float(right)))
+
+    bits = type.bits
+    left, right = to_signed(int(left), bits), to_signed(int(right), bits)
+    if op in ('/', '%') and right == 0:
+        return None
+    if op in ('<<', '>>') and not 0 <= right < bits:
+        return None
+    if op == '>>':
+        return to_signed((left & ((1 << bits) - 1)) >> right, bits)
+    return to_signed(INTEGER_OPERATIONS[op](left, right), bits)
+
+
+def fold_comparison(op, left, right, type):
+    """
+    Returns the int value of the comparison of two constants of type.
+    """
+    if type.is_float:
+        # All floating point comparisons are ordered, so they're false
+        # if either side is NaN.
+        if math.isnan(left) or math.isnan(right):
+            return 0
+    else:
+        left, right = to_signed(int(left), type.bits), to_signed(int(right),
+                                                                 type.bits)
+    return int(COMPARISONS[op](left, right))
+
+
+def fold_unary(op, value, type):
+    """
+    Returns the value of the unary operator op (one of + - ~ !) applied
+    to a constant of type, or None if the operator doesn't apply.
+    """
+    if op == '!':
+        return int(not value)
+    if type.is_float:
+        if op == '+':
+            return FloatConstant(value)
+        if op == '-':
+            return FloatConstant(-value)
+        return None
+    value = to_signed(int(value), type.bits)
+    if op == '+':
+        return value
+    if op == '-':
+        return to_signed(-value, type.bits)
+    return to_signed(~value, type.bits)
@@ -0,0 +1,93 @@
+"""
+Structured compiler diagnostics.
+"""
+from collections import namedtuple
+
+from c_llvm.exceptions import ErrorLimitReached
+
+
+# The default number of errors after which a compilation is stopped.
+DEFAULT_ERROR_LIMIT = 20
+
+
+class Diagnostic(namedtuple('Diagnostic', ['severity', 'line', 'column',
+                                           'message'])):
+    """
+    A single error or warning. line and column are None for diagnostics
+    which aren't tied to a location in the source, like I/O errors.
+    """
+    __slots__ = ()
+
+    def __str__(self):
+        return self.format()
+
+    def format(self, filename=None):
+        location = []
+        if filename is not None:
+            location.append(filename)
+        if self.line is not None:
+            location.extend([str(self.line), str(self.column)])
+        message = self.message
+        if self.severity != 'error':
+            message = "%s: %s" % (self.severity, message)
+        if not location:
+            return message
+        return "%s: %s" % (":".join(location), message)
+
+    def to_dict(self):
+        return dict(self._asdict())
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(data['severity'], data.get('line'), data.get('column'),
+                   data['message'])
+
+
+class DiagnosticEngine(object):
+    """
+    Collects the errors and warnings of a single compilation.
+
+    Only the first error at each location in the source is kept, others
+    at the same place are nearly always caused by it. Once error_limit
+    errors have been reported, ErrorLimitReached is raised to stop the
+    compilation; an error_limit of 0 means no limit.
+    """
+    def __init__(self, error_limit=DEFAULT_ERROR_LIMIT):
+        self.error_limit = error_limit
+        self.errors = []
+        self.warnings = []
+        self.suppressed = 0
+        self._seen = set()
+
+    def __len__(self):
+        return len(self.errors) + len(self.warnings)
+
+    def __iter__(self):
+        return iter(self.errors + self.warnings)
+
+    def report(self, diagnostic):
+        """
+        Records diagnostic unless it duplicates an earlier one. Returns
+        whether it was recorded.
+        """
+        if diagnostic.severity == 'error' and diagnostic.line is not None:
+            key = ('error', diagnostic.line, diagnostic.column)
+        else:
+            key = diagnostic
+        if key in self._seen:
+            self.suppressed += 1
+            return False
+        self._seen.add(key)
+
+        if diagnostic.severity != 'error':
+            self.warnings.append(diagnostic)
+            return True
+        self.errors.append(diagnostic)
+        if self.error_limit and len(self.errors) >= self.error_limit:
+            self.errors.append(Diagnostic(
+                'error', None, None,
+                "too many errors emitted, stopping now "
+                "(-ferror-limit=%d)" % (self.error_limit,),
+            ))
+            raise ErrorLimitReached
+        return True
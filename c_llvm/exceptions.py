@@ -1,5 +1,11 @@
 class CompilationError(Exception):
-    pass
+    """
+    Raised when a translation unit fails to compile. diagnostics holds
+    the list of all collected Diagnostic instances.
+    """
+    def __init__(self, message="", diagnostics=()):
+        super(CompilationError, self).__init__(message)
+        self.diagnostics = list(diagnostics)
 
 
 class ScopePopException(CompilationError):
@@ -7,3 +13,12 @@ class ScopePopException(CompilationError):
     Raised in case it is impossible to pop() another scope.
     """
     pass
+
+
+class ErrorLimitReached(Exception):
+    """
+    Raised by DiagnosticEngine to abort a compilation once too many
+    errors have been reported. It deliberately isn't a CompilationError,
+    which is used by the code generator to recover from single errors.
+    """
+    pass
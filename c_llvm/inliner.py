@@ -0,0 +1,249 @@
+"""
+Inlining of calls to the functions defined in a module.
+
+Every call, even to a function consisting of a single expression, costs
+passing the arguments, a jump there and back and keeps the caller's
+values from being optimized together with the callee's code.
+inline_module replaces calls to small functions with a copy of their
+body, as long as the module doesn't grow too much.
+"""
+from c_llvm.ir import (AllocaInstruction, BasicBlock, Function,
+                       JumpInstruction, PhiInstruction, ReturnInstruction)
+
+
+# The largest cost of a function which is still inlined, see get_cost.
+DEFAULT_INLINE_LIMIT = 40
+# The module may grow by at most this fraction of its size.
+MAX_UNIT_GROWTH = 1.0
+
+
+def inline_module(module, limit=DEFAULT_INLINE_LIMIT):
+    """
+    Inlines the calls to functions defined in module whose cost is at
+    most limit. Callees are handled before their callers, so a function
+    is copied with everything inlined into it already. Functions calling
+    themselves, directly or through other ones, are never inlined.
+
+    A function is either inlined at all its call sites or at none, and
+    only if the growth this causes still fits into the size budget of
+    the module, MAX_UNIT_GROWTH times its original size.
+    """
+    defined = [item for item in module.items if isinstance(item, Function)]
+    names = [function.name for function in defined]
+    functions = dict(zip(names, defined))
+    calls = {}
+    call_sites = dict.fromkeys(names, 0)
+    sizes = {}
+    for name in names:
+        function = functions[name]
+        function.resolve()
+        calls[name] = get_calls(function, functions)
+        for call in calls[name]:
+            call_sites[get_callee(call)] += 1
+        sizes[name] = get_size(function)
+    budget = int(sum(sizes.itervalues()) * MAX_UNIT_GROWTH)
+
+    inlined = set()
+    for component in get_call_graph_components(names, calls):
+        for name in component:
+            function = functions[name]
+            number = 0
+            for call in calls[name]:
+                callee = get_callee(call)
+                if callee in inlined:
+                    inline_call(function, call, functions[callee], number)
+                    number += 1
+            sizes[name] = get_size(function)
+        name = component[0]
+        if len(component) > 1 or name in map(get_callee, calls[name]):
+            continue
+        cost = get_cost(functions[name], sizes[name])
+        growth = cost * call_sites[name]
+        if cost <= limit and growth <= budget:
+            budget -= growth
+            inlined.add(name)
+
+
+def get_callee(call):
+    return call.operands[0][1:]
+
+
+def get_calls(function, functions):
+    """
+    Returns the calls in function to functions defined in the module
+    which pass them all their arguments.
+    """
+    result = []
+    for block in function.blocks:
+        for instruction in block.instructions:
+            if instruction.opcode != 'call':
+                continue
+            callee = instruction.operands[0]
+            if callee.__class__ is not str or callee[:1] != '@':
+                continue
+            callee = functions.get(callee[1:])
+            if (callee is not None and
+                    len(callee.arguments) == len(instruction.operands) - 1):
+                result.append(instruction)
+    return result
+
+
+def get_size(function):
+    return sum(1 for block in function.blocks
+               for instruction in block.instructions
+               if instruction.opcode is not None)
+
+
+def get_cost(function, size):
+    """
+    The number of instructions inlining function adds to its caller:
+    all of them, except for the call and passing of the arguments it
+    replaces.
+    """
+    return size - 1 - len(function.arguments)
+
+
+def get_call_graph_components(names, calls):
+    """
+    Returns the strongly connected components of the call graph, each of
+    them before the ones calling into it.
+    """
+    index = {}
+    lowlink = {}
+    stack = []
+    on_stack = set()
+    components = []
+    for root in names:
+        if root in index:
+            continue
+        index[root] = lowlink[root] = len(index)
+        stack.append(root)
+        on_stack.add(root)
+        pending = [(root, iter([get_callee(call) for call in calls[root]]))]
+        while pending:
+            name, callees = pending[-1]
+            for callee in callees:
+                if callee not in index:
+                    index[callee] = lowlink[callee] = len(index)
+                    stack.append(callee)
+                    on_stack.add(callee)
+                    pending.append((callee, iter(
+                        [get_callee(call) for call in calls[callee]])))
+                    break
+                if callee in on_stack:
+                    lowlink[name] = min(lowlink[name], index[callee])
+            else:
+                pending.pop()
+                if pending:
+                    caller = pending[-1][0]
+                    lowlink[caller] = min(lowlink[caller], lowlink[name])
+                if lowlink[name] == index[name]:
+                    component = []
+                    while True:
+                        member = stack.pop()
+                        on_stack.remove(member)
+                        component.append(member)
+                        if member == name:
+                            break
+                    components.append(component)
+    return components
+
+
+def inline_call(function, call, callee, number):
+    """
+    Replaces call in function with a copy of the body of callee. Its
+    registers and labels are prefixed with inline<number>. and its
+    returns jump to the rest of the block of call, labelled
+    inline<number>.Return, which gets the returned value in a phi if
+    there are several of them. The allocas of callee go to the entry
+    block of function so they aren't executed again in a loop.
+    """
+    prefix = "inline%d." % (number,)
+    block = call.block
+
+    # the arguments are replaced with the values passed by call
+    copies = dict(zip(callee.arguments, call.operands[1:]))
+    blocks = []
+    for original in callee.blocks:
+        # The copied returns jump to the same block, which may need to
+        # tell them apart in a phi, so every copy gets a label.
+        if original.name is not None:
+            name = prefix + original.name
+        elif not blocks:
+            name = prefix + "Entry"
+        else:
+            name = "%sBlock%d" % (prefix, len(blocks))
+        copy = BasicBlock(name, function)
+        copy.uses = []
+        function.labels[name] = copy
+        copies[original] = copy
+        blocks.append(copy)
+        for instruction in original.instructions:
+            if instruction.opcode is None:
+                continue
+            name = instruction.name
+            if name is not None:
+                name = "%%%s%s" % (prefix, name[1:])
+            clone = instruction.clone(name, instruction.operands)
+            clone.block = copy
+            if name is not None:
+                clone.uses = []
+                function.values[name] = clone
+            copies[instruction] = clone
+            copy.instructions.append(clone)
+            if instruction.is_terminator:
+                break
+    for copy in blocks:
+        for clone in copy.instructions:
+            clone.operands = [copies.get(operand, operand)
+                              for operand in clone.operands]
+            clone.resolve_operands(function)
+
+    # The rest of the block, including its terminator, moves to the
+    # block the copied returns jump to.
+    end = BasicBlock(prefix + "Return", function)
+    end.uses = []
+    function.labels[end.name] = end
+    position = block.instructions.index(call)
+    end.instructions = block.instructions[position + 1:]
+    del block.instructions[position + 1:]
+    for instruction in end.instructions:
+        instruction.block = end
+    for successor in set(end.successors):
+        for phi in successor.phis:
+            phi.replace_operand(block, end)
+    block.replace(call, [JumpInstruction(blocks[0])])
+
+    returned = []
+    entry = function.blocks[0]
+    allocas = []
+    for copy in blocks:
+        terminator = copy.terminator
+        if isinstance(terminator, ReturnInstruction):
+            if terminator.type is not None:
+                returned.append((terminator.operands[0], copy))
+            copy.replace(terminator, [JumpInstruction(end)])
+        allocas.extend(instruction for instruction in copy.instructions
+                       if isinstance(instruction, AllocaInstruction))
+        copy.instructions = [instruction
+                             for instruction in copy.instructions
+                             if not isinstance(instruction,
+                                               AllocaInstruction)]
+    for alloca in allocas:
+        alloca.block = entry
+    entry.instructions[0:0] = allocas
+
+    if call.name is not None:
+        del function.values[call.name]
+        if not returned:
+            value = 'undef'
+        elif len(returned) == 1:
+            value = returned[0][0]
+        else:
+            value = PhiInstruction("%%%sresult" % (prefix,),
+                                   callee.return_type, returned)
+            end.insert_before(end.instructions[0], value)
+        call.replace_all_uses_with(value)
+
+    position = function.blocks.index(block) + 1
+    function.blocks[position:position] = blocks + [end]
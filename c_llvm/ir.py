@@ -0,0 +1,594 @@
+"""
+In-memory representation of the generated LLVM assembly.
+
+The code generator builds a Module out of Functions made of BasicBlocks
+holding Instructions, which gives later passes something to work on.
+The whole module is turned into text only once, by Module.serialize.
+
+While code is being generated, operands referring to registers and
+labels are simply their names. Function.resolve replaces them with the
+Values they refer to and builds the use lists, which are kept up to
+date by all changes made afterwards. Code which is only serialized
+never pays for that.
+"""
+import copy
+
+
+class Value(object):
+    """
+    Anything which can be an operand of an instruction and has a name:
+    an instruction with a result, a function argument or a basic block,
+    which is an operand of branches and phis.
+
+    uses lists the instructions using the value, once for each operand
+    referring to it, it is None until the function is resolved.
+    Constants and global names are not Values, operands keep them as
+    they are, e.g. 0, 'undef' or '@printf'.
+    """
+    __slots__ = ('name', 'uses')
+
+    def __init__(self, name):
+        self.name = name
+        self.uses = None
+
+    def __str__(self):
+        return self.name
+
+    def replace_all_uses_with(self, value):
+        for user in list(self.uses):
+            user.replace_operand(self, value)
+
+
+class Argument(Value):
+    __slots__ = ('type',)
+
+    def __init__(self, name, type):
+        self.name = name
+        self.uses = None
+        self.type = type
+
+
+class Instruction(Value):
+    """
+    Base class of all instructions. name is the register holding the
+    result, None if there isn't any. block is only set once the function
+    is resolved, except for Placeholders.
+
+    Operands at the indices selected by the labels slice are labels, all
+    other ones are values.
+    """
+    __slots__ = ('opcode', 'operands', 'block')
+    labels = None
+    is_terminator = False
+
+    def __init__(self, name, opcode, operands):
+        self.name = name
+        self.uses = None
+        self.opcode = opcode
+        self.operands = operands
+        self.block = None
+
+    def format(self):
+        """
+        Returns the text of the instruction.
+        """
+        raise NotImplementedError
+
+    def resolve_operands(self, function):
+        operands = self.operands
+        if self.labels is not None:
+            for index in range(len(operands))[self.labels]:
+                operands[index] = function.get_block(operands[index])
+        values = function.values
+        for index, operand in enumerate(operands):
+            if operand.__class__ is str:
+                if operand[:1] != '%':
+                    continue
+                operand = operands[index] = values.get(operand, operand)
+            if isinstance(operand, Value):
+                operand.uses.append(self)
+
+    def drop_operands(self):
+        for operand in self.operands:
+            if isinstance(operand, Value):
+                operand.uses.remove(self)
+
+    def set_operands(self, operands):
+        if self.block is None or not self.block.function.is_resolved:
+            self.operands = operands
+            return
+        self.drop_operands()
+        self.operands = operands
+        self.resolve_operands(self.block.function)
+
+    def replace_operand(self, old, new):
+        for index, operand in enumerate(self.operands):
+            if operand is old:
+                self.operands[index] = new
+                old.uses.remove(self)
+                if isinstance(new, Value):
+                    new.uses.append(self)
+
+    def erase(self):
+        """
+        Removes the instruction from its basic block.
+        """
+        self.block.remove(self)
+
+    def clone(self, name, operands):
+        """
+        Returns a copy of the instruction with another name and operands,
+        which doesn't belong to any block.
+        """
+        instruction = copy.copy(self)
+        instruction.name = name
+        instruction.uses = None
+        instruction.operands = operands
+        instruction.block = None
+        return instruction
+
+
+class Placeholder(Instruction):
+    """
+    Reserves the position of instructions which are only known later,
+    see CompilerState.reserve_code. It doesn't produce any code.
+    """
+    __slots__ = ()
+
+    def __init__(self):
+        Instruction.__init__(self, None, None, [])
+
+    def format(self):
+        return None
+
+
+class BinaryInstruction(Instruction):
+    __slots__ = ('type',)
+
+    def __init__(self, name, opcode, type, left, right):
+        Instruction.__init__(self, name, opcode, [left, right])
+        self.type = type
+
+    def format(self):
+        return "%s = %s %s %s, %s" % (self.name, self.opcode, self.type,
+                                      self.operands[0], self.operands[1])
+
+
+class CompareInstruction(Instruction):
+    """
+    opcode is either icmp or fcmp.
+    """
+    __slots__ = ('predicate', 'type')
+
+    def __init__(self, name, opcode, predicate, type, left, right):
+        Instruction.__init__(self, name, opcode, [left, right])
+        self.predicate = predicate
+        self.type = type
+
+    def format(self):
+        return "%s = %s %s %s %s, %s" % (
+            self.name, self.opcode, self.predicate, self.type,
+            self.operands[0], self.operands[1],
+        )
+
+
+class CastInstruction(Instruction):
+    __slots__ = ('type', 'target_type')
+
+    def __init__(self, name, opcode, type, value, target_type):
+        Instruction.__init__(self, name, opcode, [value])
+        self.type = type
+        self.target_type = target_type
+
+    def format(self):
+        return "%s = %s %s %s to %s" % (self.name, self.opcode, self.type,
+                                        self.operands[0], self.target_type)
+
+
+class LoadInstruction(Instruction):
+    __slots__ = ('pointer_type',)
+
+    def __init__(self, name, pointer_type, pointer):
+        Instruction.__init__(self, name, 'load', [pointer])
+        self.pointer_type = pointer_type
+
+    def format(self):
+        return "%s = load %s %s" % (self.name, self.pointer_type,
+                                    self.operands[0])
+
+
+class StoreInstruction(Instruction):
+    __slots__ = ('type',)
+
+    def __init__(self, type, value, pointer):
+        Instruction.__init__(self, None, 'store', [value, pointer])
+        self.type = type
+
+    def format(self):
+        return "store %s %s, %s* %s" % (self.type, self.operands[0],
+                                        self.type, self.operands[1])
+
+
+class AllocaInstruction(Instruction):
+    __slots__ = ('type',)
+
+    def __init__(self, name, type):
+        Instruction.__init__(self, name, 'alloca', [])
+        self.type = type
+
+    def format(self):
+        return "%s = alloca %s" % (self.name, self.type)
+
+
+class GetElementPtrInstruction(Instruction):
+    """
+    The operands are the pointer followed by the indices, whose types
+    are in index_types.
+    """
+    __slots__ = ('pointer_type', 'index_types')
+
+    def __init__(self, name, pointer_type, pointer, indices):
+        Instruction.__init__(self, name, 'getelementptr',
+                             [pointer] + [i[1] for i in indices])
+        self.pointer_type = pointer_type
+        self.index_types = [i[0] for i in indices]
+
+    def format(self):
+        return "%s = getelementptr %s %s%s" % (
+            self.name, self.pointer_type, self.operands[0],
+            "".join(", %s %s" % index
+                    for index in zip(self.index_types, self.operands[1:])),
+        )
+
+
+class ExtractValueInstruction(Instruction):
+    __slots__ = ('type', 'index')
+
+    def __init__(self, name, type, aggregate, index):
+        Instruction.__init__(self, name, 'extractvalue', [aggregate])
+        self.type = type
+        self.index = index
+
+    def format(self):
+        return "%s = extractvalue %s %s, %d" % (self.name, self.type,
+                                                self.operands[0], self.index)
+
+
+class CallInstruction(Instruction):
+    """
+    The operands are the called function followed by the arguments,
+    whose types are in arg_types. name is None for void functions.
+    is_tail marks calls the caller returns from right away, which don't
+    access its allocas.
+    """
+    __slots__ = ('function_type', 'arg_types', 'is_tail')
+
+    def __init__(self, name, function_type, function, arguments):
+        Instruction.__init__(self, name, 'call',
+                             [function] + [a[1] for a in arguments])
+        self.function_type = function_type
+        self.arg_types = [a[0] for a in arguments]
+        self.is_tail = False
+
+    def format(self):
+        call = "%scall %s* %s(%s)" % (
+            "tail " if self.is_tail else "",
+            self.function_type, self.operands[0],
+            ", ".join("%s %s" % argument
+                      for argument in zip(self.arg_types, self.operands[1:])),
+        )
+        if self.name is None:
+            return call
+        return "%s = %s" % (self.name, call)
+
+
+class PhiInstruction(Instruction):
+    """
+    The operands are pairs of an incoming value and the label it comes
+    from.
+    """
+    __slots__ = ('type',)
+    labels = slice(1, None, 2)
+
+    def __init__(self, name, type, incoming):
+        Instruction.__init__(self, name, 'phi', [])
+        self.type = type
+        self.operands = [operand for pair in incoming for operand in pair]
+
+    @property
+    def incoming(self):
+        """
+        The list of (value, label) pairs.
+        """
+        operands = self.operands
+        return [(operands[i], operands[i + 1])
+                for i in range(0, len(operands), 2)]
+
+    def set_incoming(self, incoming):
+        self.set_operands([operand for pair in incoming for operand in pair])
+
+    def format(self):
+        operands = self.operands
+        return "%s = phi %s %s" % (self.name, self.type, ", ".join(
+            "[%s, %%%s]" % (operands[i], operands[i + 1])
+            for i in range(0, len(operands), 2)
+        ))
+
+
+class JumpInstruction(Instruction):
+    __slots__ = ()
+    labels = slice(0, None)
+    is_terminator = True
+
+    def __init__(self, label):
+        Instruction.__init__(self, None, 'br', [label])
+
+    def format(self):
+        return "br label %%%s" % (self.operands[0],)
+
+
+class BranchInstruction(Instruction):
+    __slots__ = ()
+    labels = slice(1, None)
+    is_terminator = True
+
+    def __init__(self, condition, true_label, false_label):
+        Instruction.__init__(self, None, 'br',
+                             [condition, true_label, false_label])
+
+    def format(self):
+        return "br i1 %s, label %%%s, label %%%s" % tuple(self.operands)
+
+
+class SwitchInstruction(Instruction):
+    """
+    The operands are the value, the default label and the label of each
+    case, the values of the cases are in case_values.
+    """
+    __slots__ = ('type', 'case_values')
+    labels = slice(1, None)
+    is_terminator = True
+
+    def __init__(self, type, value, default_label, cases):
+        Instruction.__init__(self, None, 'switch',
+                             [value, default_label] + [c[1] for c in cases])
+        self.type = type
+        self.case_values = [c[0] for c in cases]
+
+    def format(self):
+        return "switch %s %s, label %%%s [ %s ]" % (
+            self.type, self.operands[0], self.operands[1],
+            "".join("%s %d, label %%%s\n" % (self.type, value, label)
+                    for value, label in zip(self.case_values,
+                                            self.operands[2:])),
+        )
+
+
+class ReturnInstruction(Instruction):
+    """
+    type is None when returning from a void function.
+    """
+    __slots__ = ('type',)
+    is_terminator = True
+
+    def __init__(self, type=None, value=None):
+        operands = [] if type is None else [value]
+        Instruction.__init__(self, None, 'ret', operands)
+        self.type = type
+
+    def format(self):
+        if self.type is None:
+            return "ret void"
+        return "ret %s %s" % (self.type, self.operands[0])
+
+
+class BasicBlock(Value):
+    """
+    A labelled sequence of instructions. The entry block of a function
+    and code following a terminator without a label of its own are in
+    blocks whose name is None.
+    """
+    __slots__ = ('function', 'instructions')
+
+    def __init__(self, name, function):
+        Value.__init__(self, name)
+        self.function = function
+        self.instructions = []
+
+    @property
+    def terminator(self):
+        if self.instructions and self.instructions[-1].is_terminator:
+            return self.instructions[-1]
+        return None
+
+    @property
+    def successors(self):
+        """
+        The blocks the terminator can transfer control to, with
+        duplicates. Only valid once the function is resolved.
+        """
+        terminator = self.terminator
+        if terminator is None or terminator.labels is None:
+            return []
+        return terminator.operands[terminator.labels]
+
+    @property
+    def predecessors(self):
+        """
+        The blocks whose terminators refer to this one, each of them
+        once. Only valid once the function is resolved.
+        """
+        result = []
+        seen = set()
+        for user in self.uses:
+            if user.is_terminator and user.block not in seen:
+                seen.add(user.block)
+                result.append(user.block)
+        return result
+
+    @property
+    def single_predecessor(self):
+        """
+        The only predecessor of the block, None if it has more or none.
+        """
+        result = None
+        for user in self.uses:
+            if user.is_terminator:
+                if result is not None and user.block is not result:
+                    return None
+                result = user.block
+        return result
+
+    @property
+    def phis(self):
+        result = []
+        for instruction in self.instructions:
+            if instruction.opcode != 'phi':
+                break
+            result.append(instruction)
+        return result
+
+    def _attach(self, instruction):
+        instruction.block = self
+        function = self.function
+        if function.is_resolved:
+            if instruction.name is not None:
+                instruction.uses = []
+                function.values[instruction.name] = instruction
+            instruction.resolve_operands(function)
+
+    def append(self, instruction):
+        self._attach(instruction)
+        self.instructions.append(instruction)
+
+    def insert_before(self, position, instruction):
+        self._attach(instruction)
+        self.instructions.insert(self.instructions.index(position),
+                                 instruction)
+
+    def replace(self, old, instructions):
+        """
+        Replaces the instruction old with a list of instructions.
+        """
+        for instruction in instructions:
+            self._attach(instruction)
+        index = self.instructions.index(old)
+        self.instructions[index:index + 1] = instructions
+        if self.function.is_resolved:
+            old.drop_operands()
+        old.block = None
+
+    def remove(self, instruction):
+        self.replace(instruction, [])
+
+
+class Function(object):
+    """
+    A function definition. arguments is a list of (type, name) pairs.
+    Once the function is resolved, values maps the names of registers to
+    the arguments and instructions defining them.
+    """
+    header_template = "define %(type)s @%(name)s(%(args)s)"
+
+    def __init__(self, name, return_type, arguments):
+        self.name = name
+        self.return_type = return_type
+        self.arguments = [Argument("%%%s" % (name,), type)
+                          for type, name in arguments]
+        self.values = {}
+        self.is_resolved = False
+        self.blocks = []
+        # label -> BasicBlock, including blocks which have only been
+        # referenced so far
+        self.labels = {}
+
+    def get_block(self, label):
+        """
+        Returns the block labelled label, which doesn't have to be a
+        part of the function yet.
+        """
+        if isinstance(label, BasicBlock):
+            return label
+        try:
+            return self.labels[label]
+        except KeyError:
+            block = self.labels[label] = BasicBlock(label, self)
+            if self.is_resolved:
+                block.uses = []
+            return block
+
+    def add_block(self, label=None):
+        """
+        Appends the block labelled label to the function.
+        """
+        if label is None:
+            block = BasicBlock(None, self)
+        else:
+            block = self.get_block(label)
+        self.blocks.append(block)
+        return block
+
+    def resolve(self):
+        """
+        Replaces the names of registers and labels in operands with the
+        Values they refer to and builds the use lists.
+        """
+        if self.is_resolved:
+            return
+        self.is_resolved = True
+        values = self.values
+        for arg in self.arguments:
+            arg.uses = []
+            values[arg.name] = arg
+        for block in self.labels.itervalues():
+            block.uses = []
+        for block in self.blocks:
+            block.uses = block.uses or []
+            for instruction in block.instructions:
+                instruction.block = block
+                if instruction.name is not None:
+                    instruction.uses = []
+                    values[instruction.name] = instruction
+        for block in self.blocks:
+            for instruction in block.instructions:
+                instruction.resolve_operands(self)
+
+    def serialize(self):
+        lines = ["", self.header_template % {
+            'type': self.return_type,
+            'name': self.name,
+            'args': ', '.join("%s %s" % (arg.type, arg.name)
+                              for arg in self.arguments),
+        }, "{"]
+        for block in self.blocks:
+            if block.name is not None:
+                lines.append("%s:" % (block.name,))
+            lines.extend([instruction.format()
+                          for instruction in block.instructions
+                          if instruction.opcode is not None])
+        lines.append("}")
+        return lines
+
+
+class Module(object):
+    """
+    A whole translation unit. Global variables and function declarations
+    are kept as text in items, in the order they appear in, along with
+    the definitions of functions. Type and string constant definitions
+    are in declarations and precede everything else.
+    """
+    def __init__(self):
+        self.declarations = []
+        self.items = []
+
+    def serialize(self):
+        """
+        Returns the list of lines of the module's LLVM assembly.
+        """
+        lines = self.declarations + [""]
+        for item in self.items:
+            if isinstance(item, Function):
+                lines.extend(item.serialize())
+            else:
+                lines.append(item)
+        return lines
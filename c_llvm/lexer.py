@@ -0,0 +1,172 @@
+"""
+A fast replacement for the lexer generated from grammar/c_grammar.g.
+
+The generated lexer runs its DFA one character at a time in Python and
+creates a token for every piece of whitespace and every comment. This
+one matches whole tokens with a single compiled regular expression and
+skips whitespace and comments without creating any tokens for them.
+
+Literal tokens like 'while' or '+=' get their token types assigned by
+antlr when the parser is generated, so they are looked up in the
+parser's tokenNames at runtime.
+"""
+import re
+
+from antlr3 import EOF, TokenSource
+
+from c_llvm.diagnostics import Diagnostic, DiagnosticEngine
+from c_llvm.tokens import CompactToken
+
+
+_ESCAPE = r'''\\(?:[abfnrtv"'\\?]|[0-7]{1,3}|x[0-9a-fA-F]+)'''
+
+# Alternatives are tried in order, so FLOAT has to come before INTEGER
+# and both of them before the punctuators because of the leading '.'.
+_TOKEN_PATTERNS = [
+    ('HIDDEN', r'[ \t\r\n]+|//[^\n]*|/\*.*?\*/'),
+    ('FLOAT', r'(?:[0-9]*\.[0-9]+|[0-9]+\.)(?:[eE][+-]?[0-9]+)?[flFL]?'
+              r'|[0-9]+[eE][+-]?[0-9]+[flFL]?'),
+    ('INTEGER', r'(?:0[xX][0-9a-fA-F]+|[1-9][0-9]*|0[0-7]*)'
+                r'(?:[uU](?:ll|LL|[lL])?|(?:ll|LL|[lL])[uU]?)?'),
+    ('ID', r'[a-zA-Z_][a-zA-Z0-9_]*'),
+    # The body of a string is matched inside a lookahead and then taken
+    # with a backreference, which emulates an atomic group. Escapes can
+    # be split in several ways ("\\123" is also "\\1" "2" "3"), so
+    # without it an unterminated string would backtrack exponentially.
+    ('STRING', r'"(?=(?P<STRING_BODY>(?:%s|[^\\"])*))(?P=STRING_BODY)"'
+               % (_ESCAPE,)),
+    ('CHAR', r"'(?:%s|[^'\\])'" % (_ESCAPE,)),
+    # Only reached if the patterns above don't match.
+    ('UNTERMINATED_COMMENT', r'/\*.*'),
+    ('UNTERMINATED_STRING', r'"[^\n]*'),
+    ('INVALID_CHAR', r"'(?:\\.|[^\\'\n])*'?"),
+]
+
+# Patterns which only match erroneous input, mapped to their error
+# messages. The matched text is skipped.
+_LEXICAL_ERRORS = {
+    'UNTERMINATED_COMMENT': "unterminated comment",
+    'UNTERMINATED_STRING': "missing terminating \" character",
+    'INVALID_CHAR': "invalid character constant",
+}
+
+# Token types of lexer rules which only match a fixed set of strings.
+_FIXED_TOKENS = {
+    '==': 'EQUALITY_OPERATOR',
+    '!=': 'EQUALITY_OPERATOR',
+    '<': 'RELATIONAL_OPERATOR',
+    '>': 'RELATIONAL_OPERATOR',
+    '<=': 'RELATIONAL_OPERATOR',
+    '>=': 'RELATIONAL_OPERATOR',
+    'const': 'TYPE_QUALIFIER',
+    'volatile': 'TYPE_QUALIFIER',
+    'restrict': 'TYPE_QUALIFIER',
+}
+
+_IDENTIFIER = re.compile(r'[a-zA-Z_][a-zA-Z0-9_]*$')
+
+
+class FastLexer(TokenSource):
+    """
+    Token source producing the same tokens on the default channel as
+    the generated lexer, given the token names of the generated parser.
+    Lexical errors are reported to the DiagnosticEngine in diagnostics.
+    """
+    def __init__(self, token_names, source=""):
+        types = dict((name, index) for index, name in enumerate(token_names))
+        self.keywords = {}
+        punctuators = {}
+        for name, token_type in types.items():
+            if not name.startswith("'"):
+                continue
+            text = name[1:-1]
+            if _IDENTIFIER.match(text):
+                self.keywords[text] = token_type
+            else:
+                punctuators[text] = token_type
+        for text, name in _FIXED_TOKENS.items():
+            if _IDENTIFIER.match(text):
+                self.keywords[text] = types[name]
+            else:
+                punctuators[text] = types[name]
+        self.punctuators = punctuators
+        self.types = dict((name, types[name]) for name, pattern
+                          in _TOKEN_PATTERNS if name in types)
+
+        # Longer punctuators first, so that '<<=' wins over '<<' and '<'.
+        punctuator_pattern = "|".join(
+            re.escape(text)
+            for text in sorted(punctuators, key=len, reverse=True)
+        )
+        self.pattern = re.compile("|".join(
+            "(?P<%s>%s)" % (name, pattern) for name, pattern in
+            _TOKEN_PATTERNS + [('PUNCTUATOR', punctuator_pattern)]
+        ), re.DOTALL)
+        self.diagnostics = DiagnosticEngine()
+        self.set_source(source)
+
+    def set_source(self, source):
+        self.source = source
+        self.position = 0
+        self.line = 1
+        self.line_start = 0
+
+    def getSourceName(self):
+        return "<string>"
+
+    def nextToken(self):
+        source, position = self.source, self.position
+        match_token = self.pattern.match
+        while True:
+            match = match_token(source, position)
+            if match is None:
+                if position >= len(source):
+                    self.position = position
+                    return CompactToken(EOF, "<EOF>", self.line,
+                                        position - self.line_start)
+                self.diagnostics.report(Diagnostic(
+                    'error',
+                    self.line,
+                    position - self.line_start,
+                    "token recognition error at: %r" % (source[position],),
+                ))
+                position += 1
+                continue
+
+            kind = match.lastgroup
+            text = match.group()
+            end = match.end()
+            if kind == 'HIDDEN':
+                self.skip_lines(text, position)
+                position = end
+                continue
+            if kind in _LEXICAL_ERRORS:
+                self.diagnostics.report(Diagnostic(
+                    'error',
+                    self.line,
+                    position - self.line_start,
+                    _LEXICAL_ERRORS[kind],
+                ))
+                self.skip_lines(text, position)
+                position = end
+                continue
+
+            if kind == 'ID':
+                token_type = self.keywords.get(text, self.types['ID'])
+            elif kind == 'PUNCTUATOR':
+                token_type = self.punctuators[text]
+            else:
+                token_type = self.types[kind]
+            token = CompactToken(token_type, text, self.line,
+                                 position - self.line_start)
+            if kind == 'STRING':
+                # String literals may span several lines.
+                self.skip_lines(text, position)
+            self.position = end
+            return token
+
+    def skip_lines(self, text, position):
+        newlines = text.count('\n')
+        if newlines:
+            self.line += newlines
+            self.line_start = position + text.rindex('\n') + 1
@@ -0,0 +1,480 @@
+"""
+Optimization of the loops of generated functions.
+
+Every expression is generated on its own, so a loop recomputes all it
+uses on each iteration: the address of the first element of an array,
+which is needed every time the array is indexed, or the value of a
+variable the loop doesn't change at all. optimize_function finds the
+natural loops of a function, moves the instructions whose results are
+the same on each iteration in front of the loop and replaces indexing
+by an induction variable with a pointer advanced on each iteration.
+"""
+from c_llvm.ir import (AllocaInstruction, BasicBlock, BinaryInstruction,
+                       CallInstruction, CastInstruction, CompareInstruction,
+                       ExtractValueInstruction, GetElementPtrInstruction,
+                       Instruction, JumpInstruction, LoadInstruction,
+                       PhiInstruction, StoreInstruction)
+
+
+# Instructions which can't have any side effects, so they can be moved
+# to a place where they are executed even if the loop wouldn't execute
+# them at all, except for divisions, which may trap.
+PURE_INSTRUCTIONS = frozenset([BinaryInstruction, CastInstruction,
+                               CompareInstruction, ExtractValueInstruction,
+                               GetElementPtrInstruction])
+TRAPPING_OPCODES = frozenset(['sdiv', 'udiv', 'srem', 'urem'])
+
+
+def optimize_module(module):
+    for item in module.items:
+        if not isinstance(item, str):
+            optimize_function(item)
+
+
+def optimize_function(function):
+    """
+    Hoists loop invariant code and reduces the strength of array
+    indexing by induction variables in all loops of function, innermost
+    loops first. Each loop gets a preheader, a block outside of the loop
+    which is the only one jumping to its header.
+    """
+    function.resolve()
+    blocks = reverse_postorder(function)
+    loops = find_loops(blocks)
+    order = dict((block, index) for index, block in enumerate(blocks))
+    escaped = get_escaped_allocas(function)
+    stores = dict((block, get_stores(block)) for block in blocks)
+    for number, loop in enumerate(loops):
+        preheader = loop.make_preheader(function, number)
+        # The preheader of a loop nested in another one is a part of it.
+        for outer in loops:
+            if outer.header is not loop.header and loop.header in outer.body:
+                outer.body.add(preheader)
+        order.setdefault(preheader, order[loop.header] - 0.5)
+        loop.blocks = sorted(loop.body, key=order.get)
+        hoist_invariants(loop, escaped, stores)
+        reduce_strength(loop, number)
+
+
+class Loop(object):
+    """
+    A natural loop: its header and the set of blocks making up its body,
+    including the header.
+    """
+    def __init__(self, header, body):
+        self.header = header
+        self.body = body
+        self.preheader = None
+        # the blocks of body in reverse postorder
+        self.blocks = []
+
+    def contains(self, value):
+        """
+        Is value an instruction in the loop's body?
+        """
+        return isinstance(value, Instruction) and value.block in self.body
+
+    def is_invariant(self, instruction):
+        """
+        Are all operands of instruction defined outside of the loop?
+        """
+        body = self.body
+        for operand in instruction.operands:
+            if isinstance(operand, Instruction) and operand.block in body:
+                return False
+        return True
+
+    def make_preheader(self, function, number):
+        """
+        Returns the preheader of the loop, which is either the only block
+        outside of the loop jumping to its header or a new one inserted
+        between them.
+        """
+        header = self.header
+        outside = [pred for pred in header.predecessors
+                   if pred not in self.body]
+        if (len(outside) == 1 and
+                isinstance(outside[0].terminator, JumpInstruction)):
+            self.preheader = outside[0]
+            return self.preheader
+
+        preheader = BasicBlock("loop%d.Preheader" % (number,), function)
+        preheader.uses = []
+        function.labels[preheader.name] = preheader
+        function.blocks.insert(function.blocks.index(header), preheader)
+        # The values the phis of the header get from outside of the loop
+        # now come from the preheader, merged by phis if they differ.
+        for index, phi in enumerate(header.phis):
+            incoming = phi.incoming
+            entering = [pair for pair in incoming if pair[1] not in self.body]
+            entry_value = entering[0][0]
+            if any(pair[0] is not entry_value for pair in entering):
+                entry_value = PhiInstruction(
+                    "%%loop%d.phi%d" % (number, index), phi.type, entering)
+                preheader.append(entry_value)
+            phi.set_incoming([(entry_value, preheader)] +
+                             [pair for pair in incoming
+                              if pair[1] in self.body])
+        for pred in outside:
+            pred.terminator.replace_operand(header, preheader)
+        preheader.append(JumpInstruction(header))
+        self.preheader = preheader
+        return preheader
+
+
+def reverse_postorder(function):
+    """
+    Returns the blocks of function which can be reached from its entry,
+    each of them before its successors except along back edges.
+    """
+    entry = function.blocks[0]
+    order = []
+    seen = set([entry])
+    stack = [(entry, iter(entry.successors))]
+    while stack:
+        block, successors = stack[-1]
+        for successor in successors:
+            if successor not in seen:
+                seen.add(successor)
+                stack.append((successor, iter(successor.successors)))
+                break
+        else:
+            stack.pop()
+            order.append(block)
+    order.reverse()
+    return order
+
+
+def get_dominators(blocks):
+    """
+    Returns a dictionary mapping each of blocks, given in reverse
+    postorder, to its immediate dominator; the entry block dominates
+    itself.
+    """
+    index = dict((block, i) for i, block in enumerate(blocks))
+    predecessors = dict(
+        (block, [pred for pred in block.predecessors if pred in index])
+        for block in blocks)
+    dominators = {blocks[0]: blocks[0]}
+
+    def intersect(a, b):
+        while a is not b:
+            while index[a] > index[b]:
+                a = dominators[a]
+            while index[b] > index[a]:
+                b = dominators[b]
+        return a
+
+    changed = True
+    while changed:
+        changed = False
+        for block in blocks[1:]:
+            dominator = None
+            for pred in predecessors[block]:
+                if pred in dominators:
+                    dominator = (pred if dominator is None else
+                                 intersect(pred, dominator))
+            if dominators.get(block) is not dominator:
+                dominators[block] = dominator
+                changed = True
+    return dominators
+
+
+def dominates(dominators, a, b):
+    while b is not a:
+        dominator = dominators[b]
+        if dominator is b:
+            return False
+        b = dominator
+    return True
+
+
+def find_loops(blocks):
+    """
+    Returns the natural loops formed by the back edges between blocks,
+    given in reverse postorder, innermost loops first. Loops sharing
+    their header are merged into one.
+    """
+    dominators = get_dominators(blocks)
+    reachable = set(blocks)
+    bodies = {}
+    for block in blocks:
+        for header in block.successors:
+            if (header is blocks[0] or
+                    not dominates(dominators, header, block)):
+                continue
+            body = bodies.setdefault(header, set([header]))
+            pending = [block]
+            while pending:
+                member = pending.pop()
+                if member not in body:
+                    body.add(member)
+                    pending.extend(pred for pred in member.predecessors
+                                   if pred in reachable)
+    loops = [Loop(header, body) for header, body in bodies.iteritems()]
+    loops.sort(key=lambda loop: (len(loop.body), blocks.index(loop.header)))
+    return loops
+
+
+def get_base(pointer):
+    """
+    Returns the alloca or the name of the global variable pointer points
+    into, or None if it isn't known.
+    """
+    while (isinstance(pointer, GetElementPtrInstruction) or
+           isinstance(pointer, CastInstruction) and
+           pointer.opcode == 'bitcast'):
+        pointer = pointer.operands[0]
+    if isinstance(pointer, AllocaInstruction):
+        return pointer
+    if isinstance(pointer, str) and pointer[:1] == '@':
+        return pointer
+    return None
+
+
+def get_escaped_allocas(function):
+    """
+    Returns the set of allocas of function whose address is used by
+    anything else than loads and stores, which may then access them
+    through pointers of unknown origin or in called functions.
+    """
+    escaped = set()
+    for block in function.blocks:
+        for instruction in block.instructions:
+            if not isinstance(instruction, AllocaInstruction):
+                continue
+            pending = [instruction]
+            while pending and instruction not in escaped:
+                pointer = pending.pop()
+                for user in pointer.uses:
+                    if (isinstance(user, GetElementPtrInstruction) and
+                            user.operands[0] is pointer or
+                            isinstance(user, CastInstruction) and
+                            user.opcode == 'bitcast'):
+                        pending.append(user)
+                    elif not (isinstance(user, LoadInstruction) or
+                              isinstance(user, CompareInstruction) or
+                              isinstance(user, StoreInstruction) and
+                              user.operands[0] is not pointer):
+                        escaped.add(instruction)
+                        break
+    return escaped
+
+
+def get_constant(value):
+    """
+    Returns the integer value of an integer constant operand, None for
+    anything else.
+    """
+    if isinstance(value, (int, long)):
+        return value
+    if isinstance(value, str) and value[:1] not in ('%', '@'):
+        try:
+            return int(value)
+        except ValueError:
+            pass
+    return None
+
+
+def is_dereferenceable(pointer):
+    """
+    Does pointer certainly point to memory which can be loaded from, so
+    that a load from it can't trap wherever it is executed?
+    """
+    if isinstance(pointer, GetElementPtrInstruction):
+        indices = [get_constant(index) for index in pointer.operands[1:]]
+        if indices[0] != 0 or len(indices) > 2:
+            return False
+        if len(indices) == 2:
+            pointee = pointer.pointer_type.rstrip(' *')
+            if pointee[:1] == '[':
+                size = int(pointee[1:].split(' x ', 1)[0])
+                if indices[1] is None or not 0 <= indices[1] < size:
+                    return False
+            elif pointee[:1] != '%' or indices[1] is None:
+                return False
+        return is_dereferenceable(pointer.operands[0])
+    return get_base(pointer) is not None
+
+
+def get_stores(block):
+    """
+    Returns the set of the allocas and global variables block stores
+    to. It contains None if the block stores through a pointer of
+    unknown origin or calls a function, which may store to any global
+    variable or alloca whose address has escaped.
+    """
+    stored = set()
+    for instruction in block.instructions:
+        if isinstance(instruction, StoreInstruction):
+            stored.add(get_base(instruction.operands[1]))
+        elif isinstance(instruction, CallInstruction):
+            stored.add(None)
+    return stored
+
+
+def is_hoistable(instruction, loop, stored, escaped):
+    """
+    Can instruction be moved out of loop, which stores to the memory in
+    stored, as returned by get_stores?
+    """
+    kind = instruction.__class__
+    if kind is LoadInstruction:
+        pointer = instruction.operands[0]
+        base = get_base(pointer)
+        if (base in stored or not is_dereferenceable(pointer) or
+                None in stored and (isinstance(base, str) or
+                                    base in escaped)):
+            return False
+    elif (kind not in PURE_INSTRUCTIONS or
+            instruction.opcode in TRAPPING_OPCODES):
+        return False
+    return loop.is_invariant(instruction)
+
+
+def hoist_invariants(loop, escaped, stores):
+    """
+    Moves the instructions of loop whose operands are all defined
+    outside of it to its preheader. Identical ones are only kept once.
+    Loads are only moved if nothing in the loop can store to the memory
+    they read and it can't trap. stores maps blocks to what get_stores
+    returns for them, it may lack preheaders, which don't store.
+    """
+    stored = set()
+    for block in loop.blocks:
+        stored.update(stores.get(block, ()))
+
+    preheader = loop.preheader
+    hoisted = {}
+    moved = []
+    for block in loop.blocks:
+        kept = []
+        for instruction in block.instructions:
+            if not is_hoistable(instruction, loop, stored, escaped):
+                kept.append(instruction)
+                continue
+            key = instruction.format().split(' = ', 1)[1]
+            if key in hoisted:
+                instruction.replace_all_uses_with(hoisted[key])
+                instruction.drop_operands()
+                instruction.block = None
+                continue
+            hoisted[key] = instruction
+            instruction.block = preheader
+            moved.append(instruction)
+        block.instructions = kept
+    preheader.instructions[-1:-1] = moved
+
+
+def get_induction_variables(loop):
+    """
+    Returns a list of (phi, initial value, increment instruction, latch,
+    step) for the i64 phis of the loop's header which are incremented by
+    a constant step on every iteration, coming back from latch.
+    """
+    header = loop.header
+    if len(header.predecessors) != 2:
+        return []
+    result = []
+    for phi in header.phis:
+        incoming = phi.incoming
+        if phi.type != 'i64' or len(incoming) != 2:
+            continue
+        if incoming[0][1] is not loop.preheader:
+            incoming.reverse()
+        (initial, preheader), (increment, latch) = incoming
+        step = get_offset(increment, phi)
+        if (preheader is loop.preheader and latch in loop.body and
+                loop.contains(increment) and step):
+            result.append((phi, initial, increment, latch, step))
+    return result
+
+
+def get_offset(value, phi):
+    """
+    Returns the constant c if value is phi + c or phi - c, where c may
+    be 0, or None if it isn't.
+    """
+    if value is phi:
+        return 0
+    if not (isinstance(value, BinaryInstruction) and value.type == 'i64'):
+        return None
+    left, right = value.operands
+    if value.opcode == 'add':
+        if right is phi:
+            left, right = right, left
+        if left is phi:
+            return get_constant(right)
+    elif value.opcode == 'sub' and left is phi:
+        offset = get_constant(right)
+        if offset is not None:
+            return -offset
+    return None
+
+
+def reduce_strength(loop, number):
+    """
+    Replaces the pointers computed by indexing a pointer defined outside
+    of loop by an induction variable, possibly plus a constant, with a
+    pointer which starts where the first iteration indexes and advances
+    along with the induction variable. Indexing by the same induction
+    variable shares the pointer, adding the constant to it.
+    """
+    pointers = {}
+    induction_variables = get_induction_variables(loop)
+    for phi, initial, increment, latch, step in induction_variables:
+        for block in loop.blocks:
+            for instruction in list(block.instructions):
+                if not (isinstance(instruction, GetElementPtrInstruction) and
+                        len(instruction.operands) == 2 and
+                        instruction.index_types[0] == 'i64' and
+                        not loop.contains(instruction.operands[0])):
+                    continue
+                index = instruction.operands[1]
+                offset = get_offset(index, phi)
+                if offset is None:
+                    continue
+                key = (phi, instruction.pointer_type, instruction.operands[0])
+                if key not in pointers:
+                    pointers[key] = make_pointer_variable(
+                        loop, "%%loop%d.ptr%d" % (number, len(pointers)),
+                        instruction, initial, increment, latch, step)
+                pointer = pointers[key]
+                if offset == 0 and all(user.block in loop.body
+                                       for user in instruction.uses):
+                    instruction.replace_all_uses_with(pointer)
+                    instruction.erase()
+                else:
+                    replacement = GetElementPtrInstruction(
+                        instruction.name, instruction.pointer_type, pointer,
+                        [('i64', offset)])
+                    block.replace(instruction, [replacement])
+                    instruction.replace_all_uses_with(replacement)
+                if index is not phi and not index.uses:
+                    index.erase()
+
+
+def make_pointer_variable(loop, name, gep, initial, increment, latch,
+                          step):
+    """
+    Creates the phi called name in the header of loop holding the
+    pointer gep computes for the induction variable which starts from
+    initial and is incremented by step by increment, coming from latch.
+    """
+    type = gep.pointer_type
+    preheader = loop.preheader
+    start = GetElementPtrInstruction(name + ".start", type, gep.operands[0],
+                                     [('i64', initial)])
+    preheader.insert_before(preheader.terminator, start)
+
+    header = loop.header
+    phi = PhiInstruction(name, type, [])
+    header.insert_before(header.instructions[len(header.phis)], phi)
+    block = increment.block
+    advanced = GetElementPtrInstruction(name + ".next", type, phi,
+                                        [('i64', step)])
+    block.insert_before(
+        block.instructions[block.instructions.index(increment) + 1],
+        advanced)
+    phi.set_incoming([(start, preheader), (advanced, latch)])
+    return phi
@@ -0,0 +1,224 @@
+"""
+A long-running compile server and its client.
+
+The server keeps the parser loaded and accepts requests over a Unix
+domain socket. Each connection carries a single request and a single
+response, both encoded as one line of JSON:
+
+    {"command": "compile", "source": "..."}
+        -> {"status": "ok", "code": "...", "diagnostics": [...]}
+        -> {"status": "error", "diagnostics": [...]}
+    {"command": "stats"}
+        -> {"status": "ok", "requests": ..., "latency": {...}, ...}
+    {"command": "shutdown"}
+        -> {"status": "ok"}
+
+Diagnostics are encoded as objects with the keys severity, line, column
+and message, see Diagnostic.to_dict.
+
+This module intentionally doesn't import the parser so that the client
+side starts up as fast as possible.
+"""
+import json
+import os
+import socket
+import SocketServer
+import threading
+import time
+from collections import deque
+
+from c_llvm.diagnostics import Diagnostic
+
+# Number of most recent request latencies kept for the percentiles.
+LATENCY_WINDOW = 10000
+
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return None
+    index = int(round(fraction * (len(sorted_values) - 1)))
+    return sorted_values[index]
+
+
+class RequestHandler(SocketServer.StreamRequestHandler):
+    def handle(self):
+        server = self.server
+        server.request_started()
+        start = time.time()
+        is_compile = False
+        try:
+            try:
+                message = json.loads(self.rfile.readline())
+                command = message.get('command')
+            except ValueError:
+                response = error_response("malformed request")
+            else:
+                is_compile = command == 'compile'
+                handler = getattr(server, 'command_%s' % (command,), None)
+                if handler is None:
+                    response = error_response("unknown command: %s" %
+                                              (command,))
+                else:
+                    response = self.run_handler(handler, message)
+            self.wfile.write(json.dumps(response) + '\n')
+        finally:
+            server.request_finished(time.time() - start, is_compile)
+
+    def run_handler(self, handler, message):
+        """
+        Returns the response of handler. Any exception is turned into an
+        error response, otherwise the connection would be closed without
+        a reply.
+        """
+        try:
+            return handler(message)
+        except Exception as e:
+            with self.server.lock:
+                self.server.error_count += 1
+            return error_response("internal compiler error: %s: %s" %
+                                  (type(e).__name__, e))
+
+
+class CompileServer(SocketServer.ThreadingMixIn,
+                    SocketServer.UnixStreamServer):
+    """
+    Accepts each connection in a separate thread. The actual compilation
+    is delegated to compile_function which takes the source code and
+    returns a CompileResult.
+    """
+    daemon_threads = True
+    # How often the idle timeout is checked, in seconds.
+    timeout = 1.0
+
+    def __init__(self, socket_path, compile_function, idle_timeout=None):
+        self.socket_path = socket_path
+        self.compile_function = compile_function
+        self.idle_timeout = idle_timeout
+        self.started = self.last_activity = time.time()
+        self.active_requests = 0
+        self.request_count = 0
+        self.compile_count = 0
+        self.error_count = 0
+        self.latencies = deque(maxlen=LATENCY_WINDOW)
+        self.lock = threading.Lock()
+        self.shutdown_requested = False
+        if os.path.exists(socket_path):
+            remove_stale_socket(socket_path)
+        SocketServer.UnixStreamServer.__init__(self, socket_path,
+                                               RequestHandler)
+
+    def request_started(self):
+        with self.lock:
+            self.active_requests += 1
+            self.last_activity = time.time()
+
+    def request_finished(self, latency, is_compile):
+        with self.lock:
+            self.active_requests -= 1
+            self.request_count += 1
+            self.last_activity = time.time()
+            if is_compile:
+                self.compile_count += 1
+                self.latencies.append(latency)
+
+    def is_idle(self):
+        if self.idle_timeout is None:
+            return False
+        with self.lock:
+            return (self.active_requests == 0 and
+                    time.time() - self.last_activity > self.idle_timeout)
+
+    def serve(self):
+        """
+        Handles requests until a shutdown is requested or the server has
+        been idle for longer than idle_timeout.
+        """
+        try:
+            while not self.shutdown_requested and not self.is_idle():
+                self.handle_request()
+        finally:
+            self.server_close()
+            if os.path.exists(self.socket_path):
+                os.unlink(self.socket_path)
+
+    def command_compile(self, message):
+        result = self.compile_function(message.get('source', ''))
+        diagnostics = [diagnostic.to_dict()
+                       for diagnostic in result.diagnostics]
+        if not result.ok:
+            with self.lock:
+                self.error_count += 1
+            return {'status': 'error', 'diagnostics': diagnostics}
+        return {'status': 'ok', 'code': result.code,
+                'diagnostics': diagnostics}
+
+    def command_stats(self, message):
+        with self.lock:
+            latencies = sorted(self.latencies)
+            stats = {
+                'status': 'ok',
+                'uptime': time.time() - self.started,
+                'requests': self.request_count,
+                'compiles': self.compile_count,
+                'errors': self.error_count,
+                'active': self.active_requests - 1,
+            }
+        stats['latency'] = dict(
+            ('p%d' % (p,), percentile(latencies, p / 100.0))
+            for p in (50, 90, 99)
+        )
+        stats['latency']['max'] = latencies[-1] if latencies else None
+        return stats
+
+    def command_shutdown(self, message):
+        self.shutdown_requested = True
+        return {'status': 'ok'}
+
+
+def error_response(message):
+    return {'status': 'error',
+            'diagnostics': [Diagnostic('error', None, None,
+                                       message).to_dict()]}
+
+
+def remove_stale_socket(socket_path):
+    """
+    Removes a socket file left behind by a server that is no longer
+    running. Raises socket.error if there is a live server on the other
+    end.
+    """
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.connect(socket_path)
+    except socket.error:
+        os.unlink(socket_path)
+    else:
+        raise socket.error("a server is already listening on %s" %
+                           (socket_path,))
+    finally:
+        sock.close()
+
+
+def send_request(socket_path, message):
+    """
+    Sends a single request to the server listening on socket_path and
+    returns the decoded response. Raises socket.error if the server
+    closes the connection without a valid response.
+    """
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.connect(socket_path)
+        stream = sock.makefile('rwb')
+        stream.write(json.dumps(message) + '\n')
+        stream.flush()
+        reply = stream.readline()
+        try:
+            response = json.loads(reply)
+        except ValueError:
+            response = None
+        if not isinstance(response, dict) or 'status' not in response:
+            raise socket.error("no valid response from the server on %s" %
+                               (socket_path,))
+        return response
+    finally:
+        sock.close()
@@ -0,0 +1,160 @@
+"""
+Construction of SSA form for local variables kept in registers.
+"""
+from c_llvm.ir import PhiInstruction
+
+
+class SSABuilder(object):
+    """
+    Keeps scalar local variables whose address is never taken in
+    registers instead of stack slots.
+
+    The current value of each such variable is tracked while the code of
+    a basic block is generated, and the values flowing along each edge of
+    the control flow graph are recorded with the branch. Code is
+    generated in a single pass, so when a label is emitted, all edges
+    into it are already known, except for the back edges of loops. A
+    label reached only by jumping forward gets a phi for each variable
+    whose values differ between its predecessors. A loop header gets a
+    phi for each variable assigned anywhere in the loop, its incoming
+    values are set once the loop has been generated.
+
+    Code following a terminator up to the next label which has an edge
+    into it can't be reached; CompilerState doesn't emit it at all, so
+    every block and edge the builder sees is reachable from the entry.
+    """
+    def __init__(self):
+        self.enter_function(())
+
+    def enter_function(self, address_taken):
+        """
+        Starts a new function, address_taken holds the names of the
+        variables which have to stay in memory.
+        """
+        self.address_taken = address_taken
+        # the variables in scope, in the order of their declarations
+        self.variables = []
+        # Variable -> current value, None in unreachable code
+        self.values = {}
+        # label -> list of (predecessor label, values at its end)
+        self.incoming = {}
+        # loop header label -> list of (Variable, PhiInstruction)
+        self.headers = {}
+
+    def can_promote(self, name, type):
+        return type.is_scalar and name not in self.address_taken
+
+    def declare(self, variable, value='undef'):
+        self.variables.append(variable)
+        if self.values is not None:
+            self.values[variable] = value
+
+    def forget(self, variables):
+        """
+        Drops the variables of a scope which has been left.
+        """
+        variables = set(variables)
+        self.variables = [var for var in self.variables
+                          if var not in variables]
+        if self.values is not None:
+            for var in variables:
+                self.values.pop(var, None)
+
+    def read(self, variable):
+        if self.values is None:
+            return 'undef'
+        return self.values.get(variable, 'undef')
+
+    def write(self, variable, value):
+        if self.values is not None:
+            self.values[variable] = str(value)
+
+    def get_edge(self, label):
+        """
+        Returns the edge leaving the current block, which is label, or
+        None if the current code can't be reached. The block has to end
+        right after this, the values are not copied.
+        """
+        if self.values is None:
+            return None
+        return (label, self.values)
+
+    def add_edge(self, target, edge):
+        if edge is not None:
+            self.incoming.setdefault(target, []).append(edge)
+
+    def end_block(self):
+        self.values = None
+
+    def get_incoming(self, variable, edges):
+        return [(values.get(variable, 'undef'), label)
+                for label, values in edges]
+
+    def merge(self, state, edges, assigned=()):
+        """
+        Sets the current values to those flowing in along edges. Returns
+        the list of (Variable, register) which need a phi, that is those
+        whose values differ and those in assigned.
+        """
+        self.values = {}
+        phis = []
+        for var in self.variables:
+            incoming = [values.get(var) for label, values in edges]
+            if None in incoming:
+                # declared after some of the branches
+                continue
+            if var in assigned or incoming.count(incoming[0]) != len(incoming):
+                register = state.get_var_register(var.name)
+                self.values[var] = register
+                phis.append((var, register))
+            else:
+                self.values[var] = incoming[0]
+        return phis
+
+    def join(self, state, label):
+        """
+        Enters the block starting with label, which can only be reached
+        by jumping forward. Returns the list of its phis, or None if it
+        can't be reached at all.
+        """
+        edges = self.incoming.pop(label, None)
+        if not edges:
+            self.values = None
+            return None
+        return [PhiInstruction(register, var.type.llvm_type,
+                               self.get_incoming(var, edges))
+                for var, register in self.merge(state, edges)]
+
+    def has_edges(self, label):
+        return label in self.incoming
+
+    def open_loop(self, state, label, assigned_names):
+        """
+        Enters the header of a loop in which the variables called
+        assigned_names are assigned and emits its phis.
+        If assigned_names is None, the loop can be entered in the middle
+        through a case label and every variable gets a phi.
+        """
+        if assigned_names is None:
+            # Only the variables in scope matter, the values flowing in
+            # through the case labels aren't known yet.
+            assigned = set(self.variables)
+            edges = [(None, dict.fromkeys(self.variables, 'undef'))]
+        else:
+            assigned = set(var for var in self.variables
+                           if var.name in assigned_names)
+            edges = self.incoming.get(label, [])
+        phis = []
+        for var, register in self.merge(state, edges, assigned):
+            phis.append((var, state.emit(
+                PhiInstruction(register, var.type.llvm_type, []))))
+        self.headers[label] = phis
+
+    def close_loop(self, state, label):
+        """
+        Completes the phis of a loop header once all edges into it are
+        known.
+        """
+        edges = self.incoming.pop(label, [])
+        for var, phi in self.headers.pop(label, ()):
+            phi.set_incoming(self.get_incoming(var, edges))
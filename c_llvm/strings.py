@@ -0,0 +1,87 @@
+"""
+Pool of the string constants of a translation unit.
+"""
+from c_llvm.ir import GetElementPtrInstruction
+
+
+class StringPool(object):
+    """
+    Stores every distinct string constant only once.
+
+    References to strings are emitted as getelementptr instructions whose
+    operands are set by finish(), once all strings of the unit are known.
+    With share_suffixes, a string which is the suffix of another one
+    doesn't get its own storage and points into the longer one instead.
+    """
+    declaration_template = '%(register)s = private unnamed_addr constant %(type)s c"%(content)s"'
+
+    def __init__(self, share_suffixes=False):
+        self.share_suffixes = share_suffixes
+        # data -> list of GetElementPtrInstructions of all references
+        self.references = {}
+        # distinct strings in the order of their first reference
+        self.strings = []
+
+    def __len__(self):
+        return len(self.strings)
+
+    def add_reference(self, state, data, register):
+        """
+        Emits the instruction setting register to a pointer to the first
+        character of data, which has to include the terminating zero.
+        """
+        try:
+            references = self.references[data]
+        except KeyError:
+            references = self.references[data] = []
+            self.strings.append(data)
+        references.append(state.emit(
+            GetElementPtrInstruction(register, None, None, [])))
+
+    def get_layout(self):
+        """
+        Returns a dictionary mapping each string to a pair (string
+        holding its storage, offset in it).
+        """
+        layout = dict((data, (data, 0)) for data in self.strings)
+        if not self.share_suffixes:
+            return layout
+        # A string is a suffix of another one if its reverse is a prefix
+        # of the other's reverse. Sorted by their reverses, such strings
+        # directly precede the strings containing them, so it is enough
+        # to compare each one with its successor.
+        by_reverse = sorted(self.strings, key=lambda data: data[::-1])
+        for data, longer in reversed(zip(by_reverse, by_reverse[1:])):
+            if longer.endswith(data):
+                holder, offset = layout[longer]
+                layout[data] = holder, offset + len(longer) - len(data)
+        return layout
+
+    def finish(self, state):
+        """
+        Emits the declarations of all strings and completes their
+        references.
+        """
+        char_type = state.types.get_type('char')
+        layout = self.get_layout()
+        registers = {}
+        for data in self.strings:
+            holder = layout[data][0]
+            if holder in registers:
+                continue
+            register = "@%s" % (state.get_global_name('string'),)
+            registers[holder] = register
+            state.global_declarations.append(self.declaration_template % {
+                'register': register,
+                'type': state.types.get_array_type(char_type,
+                                                   len(holder)).llvm_type,
+                'content': ''.join('\\%02X' % (ord(c),) for c in holder),
+            })
+
+        for data in self.strings:
+            holder, offset = layout[data]
+            array_type = state.types.get_array_type(char_type, len(holder))
+            for reference in self.references[data]:
+                reference.pointer_type = "%s*" % (array_type.llvm_type,)
+                reference.index_types = ['i64', 'i64']
+                reference.set_operands([registers[holder], 0, offset])
@@ -0,0 +1,238 @@
+"""
+Collection of the cases of switch statements and their lowering.
+
+The code generator always emits an LLVM switch instruction. The backend
+already lowers dense ones to jump tables and sparse ones to balanced
+trees of comparisons, so that's left to it. What it doesn't do without
+running opt is to replace a switch which only selects one of several
+constants by a load from a table of them, build_lookup_tables does that
+when the function is cleaned up by c_llvm.cfg.
+"""
+from c_llvm.ir import (BasicBlock, BinaryInstruction, BranchInstruction,
+                       CastInstruction, CompareInstruction,
+                       GetElementPtrInstruction, JumpInstruction,
+                       LoadInstruction, ReturnInstruction, SwitchInstruction,
+                       Value)
+
+
+# A switch is only turned into a lookup table if it has at least this
+# many cases, they make up at least this part of the range between the
+# smallest and the largest one and that range isn't larger than this.
+MIN_TABLE_CASES = 4
+MIN_TABLE_DENSITY = 0.4
+MAX_TABLE_SIZE = 4096
+
+table_template = ("%(name)s = private unnamed_addr constant "
+                  "[%(size)d x %(type)s] [%(values)s]")
+
+
+class SwitchCases(object):
+    """
+    The cases of a switch statement being generated.
+
+    The values of the cases are those of the controlling expression
+    after the integer promotions: a char is zero extended, so only cases
+    between 0 and 255 can match it, and a _Bool is either 0 or 1. The
+    switch itself compares the unpromoted value of type to them.
+
+    edge is the edge from the dispatch to the cases with ssa_locals.
+    """
+    def __init__(self, number, type, edge=None):
+        self.number = number
+        self.type = type
+        self.edge = edge
+        # (value, label) in the order they appear in
+        self.cases = []
+        # value -> label
+        self.labels = {}
+        # the values of all cases, including those which can't match
+        self.values = set()
+        self.default_label = None
+
+    def __contains__(self, value):
+        return value in self.values
+
+    def add_case(self, value, label):
+        self.values.add(value)
+        self.labels[value] = label
+        self.cases.append((value, label))
+
+    def add_unmatchable_case(self, value):
+        """
+        Records a case which is left out of the switch because the
+        controlling expression can never be equal to it. Another case
+        with the same value is still a duplicate.
+        """
+        self.values.add(value)
+
+    def can_match(self, value):
+        """
+        Can the controlling expression be equal to value?
+        """
+        bits = self.type.bits
+        return bits >= 64 or 0 <= value < 1 << bits
+
+
+def is_dense(values):
+    """
+    Is a table indexed by the given integers worth it?
+    """
+    if len(values) < MIN_TABLE_CASES:
+        return False
+    size = max(values) - min(values) + 1
+    return (size <= MAX_TABLE_SIZE and
+            len(values) >= size * MIN_TABLE_DENSITY)
+
+
+def build_lookup_tables(function, declarations):
+    """
+    Replaces the dense switches of a resolved function whose every
+    destination returns a constant, or jumps to a common block whose
+    phis get a constant from each of them, by a range check and a load
+    from a table of those constants, one for each phi. The tables are
+    appended to declarations.
+
+    Returns True if anything has been changed. The blocks of the
+    replaced cases may become unreachable.
+    """
+    number = 0
+    for block in list(function.blocks):
+        switch = block.terminator
+        if (isinstance(switch, SwitchInstruction) and
+                switch.type != 'i1' and is_dense(switch.case_values) and
+                _build_lookup_table(function, block, switch, number,
+                                    declarations)):
+            number += 1
+    return number > 0
+
+
+def _is_constant(value):
+    """
+    Operands which aren't Values are constants, unless they are the name
+    of a register which couldn't be resolved.
+    """
+    return not (isinstance(value, Value) or
+                isinstance(value, str) and value[:1] == '%')
+
+
+def _get_results(switch_block, target):
+    """
+    Returns what is selected by jumping from switch_block to target: a
+    tuple (the block control ends up in, list of constants), or None if
+    they aren't constants. The block is None if target returns, the
+    constants are then the returned value, otherwise the values of the
+    block's phis.
+    """
+    instructions = target.instructions
+    if len(instructions) == 1:
+        instruction = instructions[0]
+        if isinstance(instruction, ReturnInstruction):
+            if (instruction.type is None or
+                    not _is_constant(instruction.operands[0])):
+                return None
+            return None, [instruction.operands[0]]
+        if isinstance(instruction, JumpInstruction):
+            switch_block, target = target, instruction.operands[0]
+    phis = target.phis
+    if not phis:
+        return None
+    results = []
+    for phi in phis:
+        for value, label in phi.incoming:
+            if label is switch_block:
+                break
+        else:
+            return None
+        if not _is_constant(value):
+            return None
+        results.append(value)
+    return target, results
+
+
+def _build_lookup_table(function, block, switch, number, declarations):
+    value, default = switch.operands[:2]
+    case_values = switch.case_values
+    selected = [_get_results(block, target)
+                for target in switch.operands[2:]]
+    if None in selected:
+        return False
+    destination = selected[0][0]
+    if any(target is not destination for target, constants in selected):
+        return False
+    results = dict(zip(case_values,
+                       [constants for target, constants in selected]))
+    default_results = _get_results(block, default)
+    if default_results is not None and default_results[0] is destination:
+        default_results = default_results[1]
+    else:
+        default_results = None
+    low = min(case_values)
+    size = max(case_values) - low + 1
+    if default_results is None and len(results) < size:
+        # the holes would need the default's values
+        return False
+    if destination is None:
+        types = [function.return_type]
+    else:
+        types = [phi.type for phi in destination.phis]
+
+    prefix = "%%switch%d" % (number,)
+    table_block = BasicBlock("switch%d.Table" % (number,), function)
+    table_block.uses = []
+    function.labels[table_block.name] = table_block
+    function.blocks.insert(function.blocks.index(block) + 1, table_block)
+
+    # The switch is replaced by a check whether the value is in the range
+    # of the table, unless the table covers all values of its type.
+    index = value
+    range_check = []
+    if low != 0:
+        index = prefix + ".index"
+        range_check.append(BinaryInstruction(index, 'sub', switch.type,
+                                             value, low))
+    if size < 1 << int(switch.type[1:]):
+        in_range = prefix + ".in_range"
+        range_check.append(CompareInstruction(in_range, 'icmp', 'ult',
+                                              switch.type, index, size))
+        range_check.append(BranchInstruction(in_range, table_block,
+                                             default))
+    else:
+        range_check.append(JumpInstruction(table_block))
+    block.replace(switch, range_check)
+
+    if switch.type != 'i64':
+        table_block.append(CastInstruction(prefix + ".index64", 'zext',
+                                           switch.type, index, 'i64'))
+        index = prefix + ".index64"
+    loaded = []
+    for position, type in enumerate(types):
+        table = "@%s.switch%d.%d" % (function.name, number, position)
+        declarations.append(table_template % {
+            'name': table,
+            'size': size,
+            'type': type,
+            'values': ", ".join(
+                "%s %s" % (type, results.get(low + i,
+                                             default_results)[position])
+                for i in range(size)),
+        })
+        pointer = "%s.pointer%d" % (prefix, position)
+        loaded.append("%s.value%d" % (prefix, position))
+        table_block.append(GetElementPtrInstruction(
+            pointer, "[%d x %s]*" % (size, type), table,
+            [('i64', 0), ('i64', index)]))
+        table_block.append(LoadInstruction(loaded[-1], "%s*" % (type,),
+                                           pointer))
+
+    if destination is None:
+        table_block.append(ReturnInstruction(types[0], loaded[0]))
+        return True
+    table_block.append(JumpInstruction(destination))
+    # The switch's own value for a phi is only needed if the range check
+    # can still jump to the destination.
+    keep_own = block in destination.predecessors
+    for phi, result in zip(destination.phis, loaded):
+        phi.set_incoming([(v, label) for v, label in phi.incoming
+                          if keep_own or label is not block] +
+                         [(result, table_block)])
+    return True
@@ -0,0 +1,221 @@
+"""
+Optimization of calls the caller returns from right away.
+
+A function calling itself keeps a stack frame for each level of the
+recursion, even if all it does with the result of the call is return
+it. eliminate_tail_recursion turns such calls into jumps back to the
+start of the function, which makes the recursion a loop running in
+constant stack space. Calls which can't be turned into jumps are marked
+as tail calls by mark_tail_calls, so LLVM can reuse the caller's frame
+for them.
+"""
+from c_llvm.ir import (AllocaInstruction, BasicBlock, BinaryInstruction,
+                       CastInstruction, GetElementPtrInstruction,
+                       JumpInstruction, LoadInstruction, PhiInstruction,
+                       ReturnInstruction)
+from c_llvm.loops import TRAPPING_OPCODES, get_base, get_escaped_allocas
+
+
+# Operations whose result doesn't depend on the order their operands are
+# combined in, with their identity. A function returning such an
+# operation on the result of calling itself accumulates the other
+# operands instead.
+ACCUMULATORS = {
+    'add': 0,
+    'mul': 1,
+    'and': -1,
+    'or': 0,
+    'xor': 0,
+}
+
+
+def eliminate_module(module):
+    for item in module.items:
+        if not isinstance(item, str):
+            eliminate_tail_recursion(item)
+
+
+def mark_module(module):
+    for item in module.items:
+        if not isinstance(item, str):
+            mark_tail_calls(item)
+
+
+def get_tail_call(block):
+    """
+    Returns the call whose result block returns, or which is right
+    before a return from a void function, None if there isn't any.
+    """
+    instructions = block.instructions
+    ret = block.terminator
+    if not isinstance(ret, ReturnInstruction) or len(instructions) < 2:
+        return None
+    call = instructions[-2]
+    if call.opcode != 'call':
+        return None
+    if call.name is None:
+        return call if ret.type is None else None
+    return call if ret.type is not None and ret.operands[0] is call else None
+
+
+def mark_tail_calls(function):
+    """
+    Marks the calls function returns the result of right away as tail
+    calls. The callee of a tail call may not access the allocas of the
+    caller, so none of them can be marked if the address of any alloca
+    is passed around.
+    """
+    function.resolve()
+    if get_escaped_allocas(function):
+        return
+    for block in function.blocks:
+        call = get_tail_call(block)
+        if call is not None:
+            call.is_tail = True
+
+
+def get_recursive_call(block, function):
+    """
+    Returns the call of function to itself whose result block returns,
+    directly or combined with another value by one of ACCUMULATORS, and
+    the instruction combining them, if any. Between the call and the
+    combination there may only be instructions the call can't affect.
+    Returns (None, None) if there isn't any.
+    """
+    instructions = block.instructions
+    ret = block.terminator
+    if not isinstance(ret, ReturnInstruction) or len(instructions) < 2:
+        return None, None
+    call, operation = instructions[-2], None
+    if ret.type is not None and call.opcode != 'call':
+        operation = call
+        if (not isinstance(operation, BinaryInstruction) or
+                ret.operands[0] is not operation or
+                operation.opcode not in ACCUMULATORS or
+                operation.type != function.return_type or
+                operation.operands[0] is operation.operands[1]):
+            return None, None
+        for call in reversed(instructions[:-2]):
+            if call.opcode == 'call' or not is_unaffected(call):
+                break
+        if call not in operation.operands:
+            return None, None
+    if (call.opcode != 'call' or call.operands[0] != '@' + function.name or
+            ret.type is not None and operation is None and
+            ret.operands[0] is not call or
+            len(call.uses or ()) > 1 or
+            len(call.operands) != len(function.arguments) + 1):
+        return None, None
+    return call, operation
+
+
+def is_unaffected(instruction):
+    """
+    Is the result of instruction the same whether it follows a call or
+    not? The allocas of a function eliminate_tail_recursion works on
+    can't be accessed by any call.
+    """
+    if isinstance(instruction, LoadInstruction):
+        return isinstance(get_base(instruction.operands[0]),
+                          AllocaInstruction)
+    if isinstance(instruction, BinaryInstruction):
+        return instruction.opcode not in TRAPPING_OPCODES
+    return isinstance(instruction, (CastInstruction,
+                                    GetElementPtrInstruction))
+
+
+def eliminate_tail_recursion(function):
+    """
+    Turns the calls of function to itself whose result is returned,
+    possibly combined with another value by an accumulator, into jumps
+    back to its first block. The arguments become phis getting the
+    values passed by each of these calls, an accumulator becomes a phi
+    combining the values from all of them, which is combined with the
+    value of each remaining return.
+
+    All allocas move to a new entry block, as each iteration reuses the
+    stack slots of the previous one. That's only possible if no alloca
+    is accessed through a pointer passed around.
+    """
+    function.resolve()
+    sites = []
+    for block in function.blocks:
+        # a jump back needs a label to come from, only dead code
+        # doesn't have one
+        if block.name is None and block is not function.blocks[0]:
+            continue
+        call, operation = get_recursive_call(block, function)
+        if call is not None:
+            sites.append((block, call, operation))
+    if not sites or get_escaped_allocas(function):
+        return False
+    accumulator = None
+    for block, call, operation in sites:
+        if operation is not None:
+            accumulator = accumulator or operation.opcode
+    sites = [site for site in sites
+             if site[2] is None or site[2].opcode == accumulator]
+
+    header = function.blocks[0]
+    if header.name is None:
+        header.name = 'tailrec.Header'
+        function.labels[header.name] = header
+    entry = BasicBlock('tailrec.Entry', function)
+    entry.uses = []
+    function.labels[entry.name] = entry
+    allocas = []
+    for block in function.blocks:
+        allocas.extend(instruction for instruction in block.instructions
+                       if instruction.opcode == 'alloca')
+        block.instructions = [instruction
+                              for instruction in block.instructions
+                              if instruction.opcode != 'alloca']
+    for alloca in allocas:
+        alloca.block = entry
+    entry.instructions = allocas
+    entry.append(JumpInstruction(header))
+    function.blocks.insert(0, entry)
+
+    phis = []
+    for argument in function.arguments:
+        phi = PhiInstruction('%%tailrec.arg.%s' % (argument.name[1:],),
+                             argument.type, [])
+        header.insert_before(header.instructions[0], phi)
+        argument.replace_all_uses_with(phi)
+        phis.append((phi, [(argument, entry)]))
+    if accumulator is not None:
+        phi = PhiInstruction('%tailrec.acc', function.return_type, [])
+        header.insert_before(header.instructions[0], phi)
+        phis.append((phi, [(ACCUMULATORS[accumulator], entry)]))
+
+    for number, (block, call, operation) in enumerate(sites):
+        block.remove(block.terminator)
+        values = call.operands[1:]
+        if accumulator is not None:
+            if operation is None:
+                values.append(phis[-1][0])
+            else:
+                value, = [operand for operand in operation.operands
+                          if operand is not call]
+                combined = BinaryInstruction(
+                    '%%tailrec.acc%d' % (number,), accumulator,
+                    function.return_type, phis[-1][0], value)
+                block.replace(operation, [combined])
+                values.append(combined)
+        block.remove(call)
+        block.append(JumpInstruction(header))
+        for (phi, incoming), value in zip(phis, values):
+            incoming.append((value, block))
+    for phi, incoming in phis:
+        phi.set_incoming(incoming)
+
+    if accumulator is not None:
+        for number, block in enumerate(function.blocks):
+            ret = block.terminator
+            if isinstance(ret, ReturnInstruction):
+                combined = BinaryInstruction(
+                    '%%tailrec.result%d' % (number,), accumulator,
+                    function.return_type, phis[-1][0], ret.operands[0])
+                block.insert_before(ret, combined)
+                ret.set_operands([combined])
+    return True
@@ -0,0 +1,150 @@
+"""
+Per-phase timing of the compiler pipeline.
+"""
+import resource
+import time
+from contextlib import contextmanager
+
+from c_llvm.ast.base import AstTreeAdaptor
+
+
+def cpu_time():
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    return usage.ru_utime + usage.ru_stime
+
+
+def peak_memory():
+    """
+    Peak resident set size of this process in kilobytes, over its whole
+    lifetime.
+    """
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+class PhaseTimer(object):
+    """
+    Collects the wall time, CPU time and memory of each phase, in the
+    order in which the phases were run.
+
+    peak_memory is the peak of the whole process after the phase, so in
+    a worker or server process that compiles many files it only grows.
+    memory_growth is how much the phase raised that peak, which is what
+    the phase itself needed beyond the earlier work.
+    """
+    def __init__(self):
+        self.phases = []
+
+    @contextmanager
+    def phase(self, name):
+        wall, cpu, memory = time.time(), cpu_time(), peak_memory()
+        try:
+            yield
+        finally:
+            self.add(name, time.time() - wall, cpu_time() - cpu, memory)
+
+    def add(self, name, wall, cpu, memory_before=None):
+        memory = peak_memory()
+        if memory_before is None:
+            memory_before = memory
+        self.phases.append({
+            'phase': name,
+            'wall': wall,
+            'cpu': cpu,
+            'peak_memory': memory,
+            'memory_growth': memory - memory_before,
+        })
+
+    def split(self, name, part_name, wall):
+        """
+        Moves the given amount of wall time out of the phase called name
+        into a new phase called part_name right after it. Used for work
+        that is interleaved with another phase, like tree construction
+        during parsing. Measuring the CPU time of such fine-grained work
+        would cost more than the work itself, so the CPU time of the new
+        phase is None and stays counted in the original one.
+        """
+        for index, phase in enumerate(self.phases):
+            if phase['phase'] == name:
+                phase['wall'] -= wall
+                self.phases.insert(index + 1, {
+                    'phase': part_name,
+                    'wall': wall,
+                    'cpu': None,
+                    'peak_memory': phase['peak_memory'],
+                    'memory_growth': 0,
+                })
+                return
+
+    def format_report(self):
+        lines = ["%-10s %10s %10s %14s %10s" % (
+            "phase", "wall s", "cpu s", "proc peak KiB", "+KiB")]
+        for phase in self.phases:
+            cpu = phase['cpu']
+            lines.append("%-10s %10.4f %10s %14d %10d" % (
+                phase['phase'], phase['wall'],
+                "-" if cpu is None else "%.4f" % (cpu,),
+                phase['peak_memory'], phase['memory_growth']))
+        lines.append("%-10s %10.4f %10.4f" % (
+            "total",
+            sum(phase['wall'] for phase in self.phases),
+            sum(phase['cpu'] for phase in self.phases
+                if phase['cpu'] is not None),
+        ))
+        return "\n".join(lines)
+
+
+class NullTimer(object):
+    """
+    Drop-in replacement for PhaseTimer that doesn't measure anything.
+    """
+    phases = ()
+
+    @contextmanager
+    def phase(self, name):
+        yield
+
+    def add(self, name, wall, cpu, memory_before=None):
+        pass
+
+    def split(self, name, part_name, wall):
+        pass
+
+
+class TimingTreeAdaptor(AstTreeAdaptor):
+    """
+    Tree adaptor which measures the wall time spent constructing the
+    AST. Tree construction is interleaved with parsing, so this is the
+    only way to tell the two apart. The adaptor is called several times
+    per token, so only time.time() is used; getrusage is a system call
+    and would slow down parsing noticeably and end up in the result.
+    """
+    timed_methods = ('nil', 'createWithPayload', 'createFromToken',
+                     'createFromType', 'dupNode', 'addChild', 'becomeRoot',
+                     'rulePostProcessing', 'setTokenBoundaries')
+
+    def __init__(self, *args, **kwargs):
+        super(TimingTreeAdaptor, self).__init__(*args, **kwargs)
+        self.reset()
+        for name in self.timed_methods:
+            method = getattr(self, name, None)
+            if method is not None:
+                setattr(self, name, self._timed(method))
+
+    def reset(self):
+        self.wall = 0.0
+        self.depth = 0
+
+    def _timed(self, method):
+        def timed(*args, **kwargs):
+            # Adaptor methods call each other, only the outermost call is
+            # measured.
+            if self.depth:
+                return method(*args, **kwargs)
+            self.depth += 1
+            start = time.time()
+            try:
+                return method(*args, **kwargs)
+            finally:
+                self.wall += time.time() - start
+                self.depth -= 1
+        return timed
@@ -0,0 +1,71 @@
+"""
+A lightweight token for the AST.
+
+antlr's CommonToken keeps a reference to the input stream, the start and
+stop offsets and a per-instance dictionary. The AST holds on to one token
+per node for the whole code generation, so it stores only the fields
+which are actually used afterwards.
+"""
+from antlr3.constants import DEFAULT_CHANNEL
+from antlr3.tokens import Token
+
+
+class CompactToken(Token):
+    __slots__ = ('type', 'text', 'line', 'charPositionInLine', 'index',
+                 'channel')
+
+    def __init__(self, type=None, text=None, line=0, charPositionInLine=-1,
+                 index=-1, channel=DEFAULT_CHANNEL):
+        self.type = type
+        self.text = text
+        self.line = line
+        self.charPositionInLine = charPositionInLine
+        self.index = index
+        self.channel = channel
+
+    @classmethod
+    def from_token(cls, token):
+        return cls(token.type, token.text, token.line,
+                   token.charPositionInLine, token.index, token.channel)
+
+    def getType(self):
+        return self.type
+
+    def setType(self, ttype):
+        self.type = ttype
+
+    def getText(self):
+        return self.text
+
+    def setText(self, text):
+        self.text = text
+
+    def getLine(self):
+        return self.line
+
+    def setLine(self, line):
+        self.line = line
+
+    def getCharPositionInLine(self):
+        return self.charPositionInLine
+
+    def setCharPositionInLine(self, pos):
+        self.charPositionInLine = pos
+
+    def getChannel(self):
+        return self.channel
+
+    def setChannel(self, channel):
+        self.channel = channel
+
+    def getTokenIndex(self):
+        return self.index
+
+    def setTokenIndex(self, index):
+        self.index = index
+
+    def getInputStream(self):
+        return None
+
+    def setInputStream(self, input):
+        pass
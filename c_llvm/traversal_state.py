@@ -1,113 +1,432 @@
 from collections import deque, namedtuple
 
-from c_llvm.exceptions import CompilationError
+from c_llvm.diagnostics import DEFAULT_ERROR_LIMIT, DiagnosticEngine
+from c_llvm.exceptions import CompilationError, ScopePopException
+from c_llvm import ir
+from c_llvm.ssa import SSABuilder
+from c_llvm.strings import StringPool
+from c_llvm.switches import SwitchCases
 from c_llvm.types import TypeLibrary
+from c_llvm.variables import Variable
 
 
 class ScopedSymbolTable(object):
     """
     A dictionary-like class for a scoped symbol table.
 
-    Shamelessly stolen from django.template.context.BaseContext which is
-    used as a scoped context for template rendering and removed some
-    unnecessary methods.
+    Every name maps to a stack of its definitions, the innermost one on
+    top, so a lookup takes the same time regardless of how deeply the
+    scopes are nested. Each scope keeps the list of names defined in it,
+    which is all that has to be undone when it is popped.
     """
     def __init__(self, dict_=None):
-        self._reset_dicts(dict_)
-
-    def _reset_dicts(self, value=None):
-        if value is None:
-            self.dicts = [{}]
-        else:
-            self.dicts = [value]
+        # name -> list of (scope depth, value), innermost last
+        self.symbols = {}
+        # one list of defined names for each scope, innermost last
+        self.scopes = [[]]
+        if dict_:
+            for key, value in dict_.items():
+                self[key] = value
+
+    @property
+    def depth(self):
+        return len(self.scopes)
 
     def __repr__(self):
-        return repr(self.dicts)
+        return repr(list(reversed(list(self))))
 
     def __iter__(self):
-        for d in reversed(self.dicts):
-            yield d
+        """
+        Yields the contents of each scope as a dict, innermost first.
+        """
+        for depth in range(len(self.scopes), 0, -1):
+            scope = {}
+            for name in self.scopes[depth - 1]:
+                for defining_depth, value in self.symbols[name]:
+                    if defining_depth == depth:
+                        scope[name] = value
+            yield scope
 
     def push(self, scope=None):
-        if scope is None:
-            scope = {}
-        self.dicts.append(scope)
-        return scope
+        self.scopes.append([])
+        if scope:
+            for key, value in scope.items():
+                self[key] = value
 
     def pop(self):
-        if len(self.dicts) == 1:
+        if len(self.scopes) == 1:
             raise ScopePopException
-        return self.dicts.pop()
+        scope = {}
+        for name in self.scopes.pop():
+            stack = self.symbols[name]
+            scope[name] = stack.pop()[1]
+            if not stack:
+                del self.symbols[name]
+        return scope
 
     def __setitem__(self, key, value):
         "Set a variable in the current scope"
-        self.dicts[-1][key] = value
+        depth = len(self.scopes)
+        stack = self.symbols.get(key)
+        if stack is None:
+            self.symbols[key] = [(depth, value)]
+        elif stack[-1][0] == depth:
+            stack[-1] = (depth, value)
+            return
+        else:
+            stack.append((depth, value))
+        self.scopes[-1].append(key)
 
     def __getitem__(self, key):
-        "Get a variable's value, starting at the current scope and going upward"
-        for d in reversed(self.dicts):
-            if key in d:
-                return d[key]
-        raise KeyError(key)
+        "Get the innermost visible definition of a variable"
+        return self.symbols[key][-1][1]
 
     def __delitem__(self, key):
         "Delete a variable from the current scope"
-        del self.dicts[-1][key]
+        stack = self.symbols.get(key)
+        if stack is None or stack[-1][0] != len(self.scopes):
+            raise KeyError(key)
+        stack.pop()
+        if not stack:
+            del self.symbols[key]
+        self.scopes[-1].remove(key)
 
     def has_key(self, key):
-        for d in self.dicts:
-            if key in d:
-                return True
-        return False
+        return key in self.symbols
 
     def __contains__(self, key):
-        return self.has_key(key)
+        return key in self.symbols
 
     def get(self, key, otherwise=None):
-        for d in reversed(self.dicts):
-            if key in d:
-                return d[key]
-        return otherwise
+        stack = self.symbols.get(key)
+        if stack is None:
+            return otherwise
+        return stack[-1][1]
 
     def get_current_scope(self, name, otherwise=None):
-        return self.dicts[-1].get(name, otherwise)
+        stack = self.symbols.get(name)
+        if stack is None or stack[-1][0] != len(self.scopes):
+            return otherwise
+        return stack[-1][1]
 
 
 ResultType = namedtuple('ResultType', ['value', 'type', 'is_constant', 'pointer'])
 
 
+class DiscardedCode(list):
+    """
+    Stands in for the module or the basic block code is emitted into
+    once it is known that the code won't be used, so that nothing gets
+    collected anymore.
+    """
+    def append(self, fragment):
+        pass
+
+
 class CompilerState(object):
-    def __init__(self):
+    """
+    Holds everything the code generator needs to know while walking the
+    tree.
+
+    Local registers and labels are numbered from zero in each function,
+    global names share one counter for the whole translation unit. With
+    compact_names, local names are as short as possible instead of
+    describing what they are for. They all start with a dot, so they
+    can't clash with function arguments, which are named after the C
+    identifiers.
+
+    The code is built as an ir.Module. Instructions are emitted into the
+    current basic block, declarations at the top level directly into the
+    module.
+
+    Errors and warnings are collected by a DiagnosticEngine stopping the
+    walk after error_limit errors. After the first error no more code
+    is collected, it would be thrown away anyway.
+
+    String constants are collected in a StringPool, share_string_suffixes
+    enables storing strings in the tails of longer ones.
+
+    With ssa_locals, scalar local variables whose address is never taken
+    are kept in registers by an SSABuilder instead of going through
+    memory. Every basic block then has a label, all allocas are moved to
+    the entry block and code which can't be reached isn't emitted.
+    """
+    def __init__(self, compact_names=False, error_limit=DEFAULT_ERROR_LIMIT,
+                 share_string_suffixes=False, ssa_locals=False):
+        self.compact_names = compact_names
+        self.diagnostics = DiagnosticEngine(error_limit)
+        self.strings = StringPool(share_string_suffixes)
+        self.ssa = SSABuilder() if ssa_locals else None
         self.symbols = ScopedSymbolTable()
         self.types = TypeLibrary()
         # declaration_scope is used in declarators where it contains
         # declaration specifiers.
         self.declaration_stack = deque()
-        self.errors = []
-        self.warnings = []
+        self.errors = self.diagnostics.errors
+        self.warnings = self.diagnostics.warnings
         self.next_free_id = 0
+        self.next_global_id = 0
+        # names already reported as unknown in the current function
+        self.unknown_names = set()
+        self.assigned_in_loops = {}
         self.last_result = None
         self.return_type = None
         self.break_labels = []
         self.continue_labels = []
         self.switches = []
-        self.global_declarations = []
+        self.module = ir.Module()
+        self.global_declarations = self.module.declarations
         self.pending_scope = {}
+        # Top level declarations go to output, which is a DiscardedCode
+        # after an error. Code is emitted into whatever code is, the
+        # instructions of the current basic block inside a function
+        # definition. Unreachable code is emitted into a DiscardedCode
+        # instead.
+        self.code = self.output = self.module.items
+        # the function being defined, the basic block code is currently
+        # emitted into and its label
+        self.function = None
+        self.block = None
+        self.current_label = None
+        # with ssa_locals, the placeholder in the entry block of the
+        # current function the allocas go in front of
+        self.alloca_slot = None
 
     def _get_next_number(self):
         result = self.next_free_id
         self.next_free_id += 1
         return result
 
+    def _get_next_global_number(self):
+        result = self.next_global_id
+        self.next_global_id += 1
+        return result
+
+    def enter_function(self, address_taken=(), assigned_in_loops=None):
+        """
+        Restarts the numbering of local registers and labels. The
+        arguments are only needed with ssa_locals and come from
+        scan_function_body.
+        """
+        self.next_free_id = 0
+        self.unknown_names = set()
+        self.assigned_in_loops = assigned_in_loops or {}
+        if self.ssa is not None:
+            self.ssa.enter_function(address_taken)
+
     def get_tmp_register(self):
+        if self.compact_names:
+            return "%%.%d" % (self._get_next_number(),)
         return "%%tmp.%d" % (self._get_next_number(),)
 
     def get_var_register(self, name):
+        if self.compact_names:
+            return "%%.v%d" % (self._get_next_number(),)
         return "%%var.%s.%d" % (name, self._get_next_number())
 
+    def get_global_name(self, prefix):
+        return "%s.%d" % (prefix, self._get_next_global_number())
+
     def get_label(self):
+        if self.compact_names:
+            return ".L%d" % (self._get_next_number(),)
         return "label%d" % (self._get_next_number(),)
 
+    def get_label_number(self):
+        """
+        Returns the number shared by all labels of a single statement,
+        see make_label.
+        """
+        return self._get_next_number()
+
+    def make_label(self, kind, number, name, index=''):
+        """
+        Returns the label called name of the statement of the given kind
+        which got number from get_label_number, e.g. If3.True. Labels of
+        a single statement must differ in the first letter of their name
+        or in their index.
+        """
+        if self.compact_names:
+            return ".L%d%s%s" % (number, name[0], index)
+        return "%s%d.%s%s" % (kind, number, name, index)
+
+    def report(self, diagnostic):
+        """
+        Records an error or a warning.
+        """
+        self.diagnostics.report(diagnostic)
+        if self.errors and not isinstance(self.output, DiscardedCode):
+            self.code = self.output = DiscardedCode()
+            self.global_declarations = DiscardedCode()
+
+    def emit(self, code):
+        """
+        Appends an ir.Instruction to the current basic block, or a
+        declaration to the module at the top level. Returns code.
+        """
+        self.code.append(code)
+        return code
+
+    def start_block(self, label):
+        self.current_label = label
+        if isinstance(self.output, DiscardedCode):
+            self.code = self.output
+            return
+        self.block = self.function.add_block(label)
+        self.code = self.block.instructions
+
+    def emit_label(self, label):
+        if self.ssa is None:
+            self.start_block(label)
+            return
+        self.fall_through(label)
+        phis = self.ssa.join(self, label)
+        if phis is None:
+            return
+        self.start_block(label)
+        for phi in phis:
+            self.emit(phi)
+
+    def emit_loop_header(self, label, loop):
+        """
+        Emits the label targeted by the back edges of loop. See
+        SSABuilder.open_loop.
+        """
+        if self.ssa is None:
+            self.start_block(label)
+            return
+        assigned_names = self.assigned_in_loops[loop]
+        self.fall_through(label)
+        if assigned_names is not None and not self.ssa.has_edges(label):
+            return
+        self.start_block(label)
+        self.ssa.open_loop(self, label, assigned_names)
+
+    def close_loop_header(self, label):
+        """
+        Completes the loop header label once all back edges into it have
+        been emitted.
+        """
+        if self.ssa is not None:
+            self.ssa.close_loop(self, label)
+
+    def fall_through(self, label):
+        """
+        Ends the current basic block with a jump to label unless it has
+        already been terminated.
+        """
+        if self.ssa.values is not None:
+            self.emit_jump(label)
+
+    def is_reachable(self):
+        """
+        Can the current code be reached? Only known with ssa_locals,
+        otherwise all code is assumed to be.
+        """
+        return self.ssa is None or self.ssa.values is not None
+
+    def emit_terminator(self, instruction, *targets):
+        """
+        Ends the current basic block with instruction, which transfers
+        control to the given labels.
+        """
+        self.code.append(instruction)
+        if self.ssa is not None:
+            edge = self.ssa.get_edge(self.current_label)
+            for label in targets:
+                self.ssa.add_edge(label, edge)
+        self.end_block()
+
+    def end_block(self):
+        """
+        Marks the end of the current basic block when its terminator has
+        been emitted some other way. Code up to the next label goes to a
+        block without a label, only with ssa_locals it is dropped.
+        """
+        if self.ssa is not None:
+            self.ssa.end_block()
+            self.code = DiscardedCode()
+        elif not isinstance(self.output, DiscardedCode):
+            self.block = self.function.add_block()
+            self.code = self.block.instructions
+
+    def emit_jump(self, label):
+        self.emit_terminator(ir.JumpInstruction(label), label)
+
+    def emit_branch(self, condition, true_label, false_label):
+        self.emit_terminator(
+            ir.BranchInstruction(condition, true_label, false_label),
+            true_label, false_label)
+
+    def emit_alloca(self, instruction):
+        if self.ssa is None:
+            self.emit(instruction)
+        elif self.alloca_slot.block is not None:
+            self.alloca_slot.block.insert_before(self.alloca_slot,
+                                                 instruction)
+
+    def emit_store(self, lvalue, value):
+        """
+        Stores the value into lvalue, whose pointer is either an address
+        or a Variable kept in a register.
+        """
+        if isinstance(lvalue.pointer, Variable):
+            self.ssa.write(lvalue.pointer, value.value)
+            return
+        self.emit(ir.StoreInstruction(lvalue.type.llvm_type, value.value,
+                                      lvalue.pointer))
+
+    def keeps_in_register(self, name, type):
+        """
+        Should the local variable name of type be kept in a register?
+        """
+        return self.ssa is not None and self.ssa.can_promote(name, type)
+
+    def start_function_body(self, function):
+        """
+        Starts emitting the code of an ir.Function into its entry block.
+        """
+        self.output.append(function)
+        self.function = function
+        if self.ssa is None:
+            self.start_block(None)
+            return
+        self.start_block(self.get_label())
+        self.alloca_slot = self.reserve_code()
+
+    def finish_function_body(self):
+        """
+        Called once the whole function has been emitted.
+        """
+        if self.ssa is not None:
+            if self.alloca_slot.block is not None:
+                self.alloca_slot.erase()
+            self.ssa.enter_function(())
+        function = self.function
+        # drop the empty blocks following the last terminators
+        function.blocks = [block for block in function.blocks
+                           if block.instructions or block.name is not None]
+        self.function = self.block = None
+        self.code = self.output
+
+    def reserve_code(self):
+        """
+        Appends a placeholder to be replaced later using fill_code.
+        Useful when the code depends on things that are only known after
+        the following code has been generated.
+        """
+        slot = ir.Placeholder()
+        if not isinstance(self.code, DiscardedCode):
+            slot.block = self.block
+        return self.emit(slot)
+
+    def fill_code(self, slot, instructions):
+        """
+        Replaces the placeholder slot with a list of instructions.
+        """
+        if slot.block is not None:
+            slot.block.replace(slot, instructions)
+
     def set_pending_scope(self, scope):
         """
         Sets the initial state of the next scope that's going to be
@@ -120,14 +439,16 @@ class CompilerState(object):
         self.pending_scope = {}
 
     def leave_block(self):
-        self.symbols.pop()
+        scope = self.symbols.pop()
+        if self.ssa is not None:
+            self.ssa.forget(scope.values())
         self.pending_scope = {}
 
     def is_global(self):
         """
         Are we in the global scope or inside a function definition?
         """
-        return len(self.symbols.dicts) == 1
+        return self.symbols.depth == 1
 
     def push_result(self, value):
         self.last_result = value;
@@ -140,9 +461,26 @@ class CompilerState(object):
         self.last_result = None
         return result
 
-    def enter_switch(self, number):
-        # number of the current switch, 'default' found, list of 'case' labels
-        self.switches.append([number, False, []])
+    def enter_switch(self, number, type):
+        """
+        Called right after the code dispatching to the cases has been
+        reserved, which ends the current basic block. Returns the
+        SwitchCases the cases are collected in.
+        """
+        edge = None
+        if self.ssa is not None:
+            edge = self.ssa.get_edge(self.current_label)
+        self.end_block()
+        switch = SwitchCases(number, type, edge)
+        self.switches.append(switch)
+        return switch
+
+    def add_switch_edge(self, label):
+        """
+        Records that the innermost switch can jump to label.
+        """
+        if self.ssa is not None:
+            self.ssa.add_edge(label, self.switches[-1].edge)
 
     def leave_switch(self):
         self.switches.pop()
@@ -1,6 +1,17 @@
+from c_llvm.constants import FloatConstant
+from c_llvm.diagnostics import Diagnostic
+from c_llvm.ir import CastInstruction, CompareInstruction
+
+
 class BaseType(object):
     """
     Base class for all type definitions.
+
+    Types are interned by the TypeLibrary, so two types are equal if and
+    only if they are the same object. Everything that depends only on the
+    structure of a type (its name, LLVM type and size) is computed once,
+    and the classification flags below are plain attributes set by each
+    subclass.
     """
     llvm_type = None
     sizeof = None
@@ -10,64 +21,20 @@ class BaseType(object):
     priority = 0
     is_complete = True
 
+    is_integer = False
+    is_float = False
+    is_arithmetic = False
+    is_pointer = False
+    is_void = False
+    is_scalar = False
+    is_array = False
+    is_function = False
+    is_typedef = False
+    is_struct = False
+
     def __init__(self, name):
         self.name = name
 
-    @property
-    def is_integer(self):
-        return self.internal_type in {'char', 'int', 'bool'}
-
-    @property
-    def is_float(self):
-        return self.internal_type in {'float', 'double', 'extended'}
-
-    @property
-    def is_arithmetic(self):
-        return self.is_integer or self.is_float
-
-    @property
-    def is_pointer(self):
-        return self.internal_type == 'pointer'
-
-    @property
-    def is_void(self):
-        return self.internal_type == 'void'
-
-    @property
-    def is_scalar(self):
-        return self.is_arithmetic or self.is_pointer
-
-    @property
-    def is_array(self):
-        return self.internal_type == 'array'
-
-    @property
-    def is_function(self):
-        return self.internal_type == 'function'
-
-    @property
-    def is_typedef(self):
-        return self.internal_type == 'typedef'
-
-    @property
-    def is_struct(self):
-        return self.internal_type == 'struct'
-
-    def cast_to_void(self, *args, **kwargs):
-        raise NotImplementedError
-
-    def cast_to_int(self, *args, **kwargs):
-        raise NotImplementedError
-
-    def cast_to_bool(self, *args, **kwargs):
-        raise NotImplementedError
-
-    def cast_to_pointer(self, *args, **kwargs):
-        raise NotImplementedError
-
-    def cast_to_function(self, *args, **kwargs):
-        raise NotImplementedError
-
 
 class TypedefType(BaseType):
     """
@@ -78,6 +45,7 @@ class TypedefType(BaseType):
     is_complete = False
     name = 'typedef'
     internal_type = 'typedef'
+    is_typedef = True
 
     def __init__(self, defined_type):
         self.defined_type = defined_type
@@ -87,41 +55,38 @@ class VoidType(BaseType):
     llvm_type = 'void'
     sizeof = 0
     internal_type = 'void'
+    is_void = True
 
 
 class CharType(BaseType):
     sizeof = 1
+    bits = 8
     internal_type = 'char'
     llvm_type = 'i8'
     default_value = 0
     priority = 1
+    is_integer = is_arithmetic = is_scalar = True
 
-    def cast_to_char(self, value, state):
+    def cast_to_char(self, value, state, target_type):
         state.push_result(value)
-        return ""
 
-    def cast_to_int(self, value, state):
-        target_type = state.types.get_type('int')
+    def cast_to_int(self, value, state, target_type):
         register = state.get_tmp_register()
         state.set_result(register, target_type)
-        return "%s = zext %s %s to %s" % (
-            register, self.llvm_type, value.value, target_type.llvm_type,
-        )
+        state.emit(CastInstruction(register, 'zext', self.llvm_type,
+                                   value.value, target_type.llvm_type))
 
-    def cast_to_float(self, value, state):
-        target_type = state.types.get_type('float')
+    def cast_to_float(self, value, state, target_type):
         register = state.get_tmp_register()
         state.set_result(register, target_type)
-        return "%s = sitofp %s %s to %s" % (
-            register, self.llvm_type, value.value, target_type.llvm_type,
-        )
+        state.emit(CastInstruction(register, 'sitofp', self.llvm_type,
+                                   value.value, target_type.llvm_type))
 
-    def cast_to_bool(self, value, state):
+    def cast_to_bool(self, value, state, target_type):
         register = state.get_tmp_register()
-        state.set_result(register, state.types.get_type('_Bool'))
-        return "%s = icmp ne %s %s, 0" % (
-            register, self.llvm_type, value.value,
-        )
+        state.set_result(register, target_type)
+        state.emit(CompareInstruction(register, 'icmp', 'ne', self.llvm_type,
+                                      value.value, 0))
 
 
 class IntType(BaseType):
@@ -129,41 +94,34 @@ class IntType(BaseType):
     internal_type = 'int'
     default_value = 0
     priority = 2
+    is_integer = is_arithmetic = is_scalar = True
 
     def __init__(self, sizeof, *args, **kwargs):
         self.sizeof = sizeof
+        self.bits = sizeof * 8
+        self.llvm_type = 'i%d' % (self.bits,)
         super(IntType, self).__init__(*args, **kwargs)
 
-    @property
-    def llvm_type(self):
-        return 'i%d' % (self.sizeof * 8,)
-
-    def cast_to_char(self, value, state):
-        target_type = state.types.get_type('char')
+    def cast_to_char(self, value, state, target_type):
         register = state.get_tmp_register()
         state.set_result(register, target_type)
-        return "%s = trunc %s %s to %s" % (
-            register, self.llvm_type, value.value, target_type.llvm_type,
-        )
+        state.emit(CastInstruction(register, 'trunc', self.llvm_type,
+                                   value.value, target_type.llvm_type))
 
-    def cast_to_int(self, value, state):
+    def cast_to_int(self, value, state, target_type):
         state.push_result(value)
-        return ""
 
-    def cast_to_float(self, value, state):
-        target_type = state.types.get_type('float')
+    def cast_to_float(self, value, state, target_type):
         register = state.get_tmp_register()
         state.set_result(register, target_type)
-        return "%s = sitofp %s %s to %s" % (
-            register, self.llvm_type, value.value, target_type.llvm_type,
-        )
+        state.emit(CastInstruction(register, 'sitofp', self.llvm_type,
+                                   value.value, target_type.llvm_type))
 
-    def cast_to_bool(self, value, state):
+    def cast_to_bool(self, value, state, target_type):
         register = state.get_tmp_register()
-        state.set_result(register, state.types.get_type('_Bool'))
-        return "%s = icmp ne %s %s, 0" % (
-            register, self.llvm_type, value.value,
-        )
+        state.set_result(register, target_type)
+        state.emit(CompareInstruction(register, 'icmp', 'ne', self.llvm_type,
+                                      value.value, 0))
 
 
 class FloatType(BaseType):
@@ -172,64 +130,82 @@ class FloatType(BaseType):
     llvm_type = 'double'
     default_value = 0.0
     priority = 4
+    is_float = is_arithmetic = is_scalar = True
 
-    def cast_to_char(self, value, state):
-        target_type = state.types.get_type('char')
+    def cast_to_char(self, value, state, target_type):
         register = state.get_tmp_register()
         state.set_result(register, target_type)
-        return "%s = fptosi %s %s to %s" % (
-            register, self.llvm_type, value.value, target_type.llvm_type,
-        )
+        state.emit(CastInstruction(register, 'fptosi', self.llvm_type,
+                                   value.value, target_type.llvm_type))
 
-    def cast_to_int(self, value, state):
-        target_type = state.types.get_type('int')
+    def cast_to_int(self, value, state, target_type):
         register = state.get_tmp_register()
         state.set_result(register, target_type)
-        return "%s = fptosi %s %s to %s" % (
-            register, self.llvm_type, value.value, target_type.llvm_type,
-        )
+        state.emit(CastInstruction(register, 'fptosi', self.llvm_type,
+                                   value.value, target_type.llvm_type))
 
-    def cast_to_float(self, value, state):
+    def cast_to_float(self, value, state, target_type):
         state.push_result(value)
-        return ""
 
-    def cast_to_bool(self, value, state):
+    def cast_to_bool(self, value, state, target_type):
         register = state.get_tmp_register()
-        state.set_result(register, state.types.get_type('_Bool'))
-        return "%s = fcmp one %s %s, 0.0" % (
-            register, self.llvm_type, value.value,
-        )
+        state.set_result(register, target_type)
+        state.emit(CompareInstruction(register, 'fcmp', 'one', self.llvm_type,
+                                      value.value, '0.0'))
 
 
 class BoolType(BaseType):
     sizeof = 1
+    bits = 1
     internal_type = 'bool'
     llvm_type = 'i1'
     default_value = 0
+    is_integer = is_arithmetic = is_scalar = True
+
+    def cast_to_char(self, value, state, target_type):
+        register = state.get_tmp_register()
+        state.set_result(register, target_type)
+        state.emit(CastInstruction(register, 'zext', self.llvm_type,
+                                   value.value, target_type.llvm_type))
 
-    def cast_to_bool(self, value, state):
+    cast_to_int = cast_to_char
+
+    def cast_to_float(self, value, state, target_type):
+        register = state.get_tmp_register()
+        state.set_result(register, target_type)
+        state.emit(CastInstruction(register, 'uitofp', self.llvm_type,
+                                   value.value, target_type.llvm_type))
+
+    def cast_to_bool(self, value, state, target_type):
         state.push_result(value)
-        return ""
 
 
 class PointerType(BaseType):
     sizeof = 8 # TODO: this is not portable
     internal_type = 'pointer'
+    is_pointer = is_scalar = True
 
     def __init__(self, target_type):
         self.target_type = target_type
+        self.name = "%s*" % (target_type.name,)
+        self.llvm_type = "%s *" % (target_type.llvm_type,)
 
-    @property
-    def llvm_type(self):
-        return "%s *" % (self.target_type.llvm_type,)
+    def cast_to_bool(self, value, state, target_type):
+        register = state.get_tmp_register()
+        state.set_result(register, target_type)
+        state.emit(CompareInstruction(register, 'icmp', 'ne', self.llvm_type,
+                                      value.value, 'null'))
 
-    @property
-    def name(self):
-        return "%s*" % (self.target_type.name,)
+    def cast_to_pointer(self, value, state, target_type):
+        register = state.get_tmp_register()
+        state.set_result(register, target_type)
+        state.emit(CastInstruction(register, 'bitcast', self.llvm_type,
+                                   value.value, target_type.llvm_type))
 
 
 class FunctionType(BaseType):
     internal_type = 'function'
+    is_function = True
 
     def __init__(self, name, return_type, arg_types, variable_args):
         self.name = name
@@ -237,57 +213,51 @@ class FunctionType(BaseType):
         self.arg_types = arg_types
         self.variable_args = variable_args
 
-    @property
-    def arg_types_str(self):
-        types = [t.llvm_type for t in self.arg_types]
-        if self.variable_args:
+        types = [t.llvm_type for t in arg_types]
+        if variable_args:
             types.append('...')
-        return "(%s)" % (', '.join(types),)
-
-    @property
-    def llvm_type(self):
-        return "%s %s" % (self.return_type.llvm_type, self.arg_types_str)
+        self.arg_types_str = "(%s)" % (', '.join(types),)
+        self.llvm_type = "%s %s" % (return_type.llvm_type,
+                                    self.arg_types_str)
 
 
 class ArrayType(BaseType):
     internal_type = 'array'
+    is_array = True
 
     def __init__(self, name, target_type, length):
         self.name = name
         self.target_type = target_type
         self.length = length
-
-    @property
-    def llvm_type(self):
-        return "[%d x %s]" % (self.length, self.target_type.llvm_type)
-
-    @property
-    def sizeof(self):
-        return self.length * self.target_type.sizeof
+        self.llvm_type = "[%d x %s]" % (length, target_type.llvm_type)
+        if target_type.sizeof is not None:
+            self.sizeof = length * target_type.sizeof
 
 
 class StructType(BaseType):
     internal_type = 'struct'
+    is_struct = True
 
     def __init__(self, name, struct_name):
         self.name = name
         self.struct_name = struct_name
+        self.llvm_type = "%%struct.%s" % (struct_name,)
         self.member_types = []
         self.name_indices = {}
         self.is_complete = False
-
-    @property
-    def llvm_type(self):
-        return "%%struct.%s" % (self.struct_name,)
+        self._llvm_full_type = None
 
     @property
     def llvm_full_type(self):
-        return "{ %s }" % (", ".join(t.llvm_type
-                                     for t in self.member_types),)
+        if self._llvm_full_type is None:
+            self._llvm_full_type = "{ %s }" % (
+                ", ".join(t.llvm_type for t in self.member_types),)
+        return self._llvm_full_type
 
     def add_member(self, name, type):
         self.name_indices[name] = len(self.member_types)
         self.member_types.append(type)
+        self._llvm_full_type = None
 
     def get_member(self, name):
         """
@@ -301,37 +271,49 @@ class TypeLibrary(object):
     """
     Library of known types. Prepopulated with builtin types, can create
     derived types (pointers, arrays, structures) on demand.
+
+    Builtin types are looked up by name, all spellings of the same type
+    share one instance. Derived types are interned by a tuple of their
+    kind and their components, which are themselves interned, so each
+    distinct type is only constructed once. They are registered under
+    their name as well, so get_type finds them once they exist.
     """
     def __init__(self):
-        char_type = IntType(sizeof=1, name='char')
+        void_type = VoidType(name='void')
+        char_type = CharType(name='char')
+        int_type = IntType(sizeof=8, name='int')
+        float_type = FloatType(name='float')
         builtins = {
-            'void': VoidType(name='void'),
-            'char': CharType(name='char'),
-            'signed char': CharType(name='char'),
-            'short': IntType(sizeof=8, name='int'),
-            'signed short': IntType(sizeof=8, name='int'),
-            'short int': IntType(sizeof=8, name='int'),
-            'signed short int': IntType(sizeof=8, name='int'),
-            'int': IntType(sizeof=8, name='int'),
-            'signed': IntType(sizeof=8, name='int'),
-            'signed int': IntType(sizeof=8, name='int'),
-            'long': IntType(sizeof=8, name='int'),
-            'signed long': IntType(sizeof=8, name='int'),
-            'long int': IntType(sizeof=8, name='int'),
-            'signed long int': IntType(sizeof=8, name='int'),
-            'long long': IntType(sizeof=8, name='int'),
-            'singed long long': IntType(sizeof=8, name='int'),
-            'long long int': IntType(sizeof=8, name='int'),
-            'signed long long int': IntType(sizeof=8, name='int'),
-            'float': FloatType(name='float'),
-            'double': FloatType(name='float'),
-            'long double': FloatType(name='float'),
+            'void': void_type,
+            'char': char_type,
+            'signed char': char_type,
+            'short': int_type,
+            'signed short': int_type,
+            'short int': int_type,
+            'signed short int': int_type,
+            'int': int_type,
+            'signed': int_type,
+            'signed int': int_type,
+            'long': int_type,
+            'signed long': int_type,
+            'long int': int_type,
+            'signed long int': int_type,
+            'long long': int_type,
+            'singed long long': int_type,
+            'long long int': int_type,
+            'signed long long int': int_type,
+            'float': float_type,
+            'double': float_type,
+            'long double': float_type,
             '_Bool': BoolType(name='_Bool'),
             # We create the following pointer type explicitly because LLVM
             # doesn't allow void* and suggests using i8* instead.
-            'void*': PointerType(char_type),
+            'void*': PointerType(IntType(sizeof=1, name='char')),
         }
         self._types = builtins
+        self._derived = {
+            ('pointer', void_type): builtins['void*'],
+        }
 
     def get_type(self, name):
         return self._types[name]
@@ -339,52 +321,131 @@ class TypeLibrary(object):
     def set_type(self, name, type):
         self._types[name] = type
 
+    def _add_derived(self, key, type):
+        self._derived[key] = type
+        self._types.setdefault(type.name, type)
+        return type
+
     def get_pointer_type(self, type):
-        name = "%s*" % (type.name,)
+        key = ('pointer', type)
         try:
-            return self._types[name]
+            return self._derived[key]
         except KeyError:
-            ptr_type = PointerType(type)
-            self._types[name] = ptr_type
-            return ptr_type
+            return self._add_derived(key, PointerType(type))
 
     def get_function_type(self, return_type, arg_types, variable_args):
+        key = ('function', return_type, tuple(arg_types),
+               bool(variable_args))
+        try:
+            return self._derived[key]
+        except KeyError:
+            pass
         name = "%(return)s(%(args)s%(varargs)s)" % {
             'return': return_type.name,
             'args': ','.join(type.name for type in arg_types),
             'varargs': variable_args and ',...' or '',
         }
-        try:
-            return self._types[name]
-        except KeyError:
-            func_type = FunctionType(name, return_type, arg_types,
-                                     variable_args)
-            self._types[name] = func_type
-            return func_type
+        return self._add_derived(key, FunctionType(
+            name, return_type, list(arg_types), variable_args))
 
     def get_array_type(self, target_type, length):
-        name = "%s[%d]" % (target_type.name, length)
+        key = ('array', target_type, length)
         try:
-            return self._types[name]
+            return self._derived[key]
         except KeyError:
-            array_type = ArrayType(name, target_type, length)
-            self._types[name] = array_type
-            return array_type
+            name = "%s[%d]" % (target_type.name, length)
+            return self._add_derived(key, ArrayType(name, target_type,
+                                                    length))
 
     def get_structure(self, struct_name):
-        name = "struct %s" % (struct_name,)
+        key = ('struct', struct_name)
         try:
-            return self._types[name]
+            return self._derived[key]
         except KeyError:
-            struct_type = StructType(name, struct_name)
-            self._types[name] = struct_type
-            return struct_type
+            return self._add_derived(key, StructType(
+                "struct %s" % (struct_name,), struct_name))
+
+    def cast(self, value, state, target_type, node=None):
+        """
+        Converts value to target_type and returns the converted result.
 
-    def cast_value(self, value, state, target_type):
+        Casting a value to its own type returns it as it is. Arithmetic
+        constants are converted at compile time, everything else emits
+        the conversion found in the cast table. Conversions missing from
+        the table are reported as errors at node; the value is returned
+        unchanged so that code generation can carry on.
         """
-        Returns the code required to cast value to target_type and sets
+        source_type = value.type
+        if source_type is target_type:
+            return value
+        kinds = (source_type.internal_type, target_type.internal_type)
+        if value.is_constant and kinds in CONSTANT_CASTS:
+            try:
+                return value._replace(value=CONSTANT_CASTS[kinds](value.value),
+                                      type=target_type)
+            except (OverflowError, ValueError):
+                # inf or nan; leave it to the generated code
+                pass
+        try:
+            cast_method = CAST_TABLE[kinds]
+        except KeyError:
+            message = "invalid conversion from %s to %s" % (
+                source_type.name, target_type.name)
+            if node is not None:
+                node.log_error(state, message)
+            else:
+                state.report(Diagnostic('error', None, None, message))
+            return value
+        cast_method(source_type, value, state, target_type)
+        return state.pop_result()
+
+    def cast_value(self, value, state, target_type, node=None):
+        """
+        Emits the code required to cast value to target_type and sets
         the state accordingly.
         """
-        cast_method = getattr(value.type,
-                              'cast_to_%s' % (target_type.internal_type,))
-        return cast_method(value, state)
+        state.push_result(self.cast(value, state, target_type, node))
+
+
+def _build_cast_table():
+    """
+    Collects the cast_to_* methods of all types into a dictionary keyed
+    by (source kind, target kind) pairs.
+    """
+    kinds = [VoidType, CharType, IntType, FloatType, BoolType, PointerType,
+             FunctionType, ArrayType, StructType]
+    table = {}
+    for source in kinds:
+        for target in kinds:
+            method = getattr(source, 'cast_to_%s' % (target.internal_type,),
+                             None)
+            if method is not None:
+                table[(source.internal_type, target.internal_type)] = method
+    return table
+
+
+def _char_value(value):
+    """
+    The value of an i8 constant as a signed integer.
+    """
+    value = int(value) & 0xff
+    return value - 0x100 if value & 0x80 else value
+
+
+# Compile time equivalents of the conversions emitted by the cast methods.
+CONSTANT_CASTS = {
+    ('char', 'int'): lambda value: int(value) & 0xff,
+    ('char', 'float'): lambda value: FloatConstant(_char_value(value)),
+    ('char', 'bool'): lambda value: int(int(value) & 0xff != 0),
+    ('int', 'char'): lambda value: int(value) & 0xff,
+    ('int', 'float'): FloatConstant,
+    ('int', 'bool'): lambda value: int(value != 0),
+    ('float', 'char'): lambda value: int(value) & 0xff,
+    ('float', 'int'): int,
+    ('float', 'bool'): lambda value: int(value != 0),
+    ('bool', 'char'): int,
+    ('bool', 'int'): int,
+    ('bool', 'float'): FloatConstant,
+}
+
+CAST_TABLE = _build_cast_table()
@@ -1,11 +1,14 @@
 class Variable(object):
     """
     Represents a single variable. Keeps a reference to its type, name and
-    the register through which it can be accessed.
+    the register through which it can be accessed. Variables in_register
+    have no address, their values are tracked by the SSABuilder.
     """
-    def __init__(self, name, type, register, is_global, is_defined=False):
+    def __init__(self, name, type, register, is_global, is_defined=False,
+                 in_register=False):
         self.name = name
         self.type = type
         self.register = register
         self.is_global = is_global
         self.is_defined = is_defined
+        self.in_register = in_register
@@ -28,6 +28,9 @@ translation_unit
 external_declaration
     options {
         backtrack = true;
+        // Remembers the outcome of speculative parses, so that nested
+        // block items aren't parsed again for every enclosing one.
+        memoize = true;
     }
     :	function_definition
     |	declaration
@@ -228,6 +231,7 @@ block_item
         // consisting of a single identifier as an expression, not a
         // declaration.
         backtrack = true;
+        memoize = true;
     }
     :	statement
     |	declaration
@@ -259,6 +263,7 @@ for_statement
         // declaration using a typedef'd type can start with an
         // identifier.
         backtrack = true;
+        memoize = true;
     }
     :	'for' '(' e1=optional_expression ';' e2=optional_expression ';' e3=optional_expression ')' s=statement ->
             ^(DUMMY<ForNode> $e1 $e2 $e3 $s)
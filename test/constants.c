@@ -0,0 +1,73 @@
+int printf(char *format, ...);
+
+int failures;
+
+void check(char *what, int folded, int computed)
+{
+    if (folded != computed)
+    {
+        printf("mismatch in %s: %lld != %lld\n", what, folded, computed);
+        failures += 1;
+    }
+}
+
+void check_float(char *what, double folded, double computed)
+{
+    if (folded != computed)
+    {
+        printf("mismatch in %s: %f != %f\n", what, folded, computed);
+        failures += 1;
+    }
+}
+
+int main()
+{
+    int zero, one, two, three, seven, big, minus_one;
+    double half, ten;
+    char *p;
+    zero = 0;
+    one = 1;
+    two = 2;
+    three = 3;
+    seven = 7;
+    big = 9223372036854775807;
+    minus_one = -1;
+    half = 0.5;
+    ten = 10.0;
+    p = "x";
+
+    check("wraparound +", 9223372036854775807 + 1, big + one);
+    check("wraparound *", 9223372036854775807 * 2, big * two);
+    check("wraparound -", -9223372036854775807 - 2, -big - two);
+    check("negation", -(-9223372036854775807 - 1), -(-big - one));
+    check("division", -7 / 2, -seven / two);
+    check("division", 7 / -2, seven / -two);
+    check("remainder", -7 % 3, -seven % three);
+    check("remainder", 7 % -3, seven % -three);
+    check("shift left", 1 << 63, one << (seven * 9));
+    check("shift right", -1 >> 60, minus_one >> (seven + 53));
+    check("bitwise", (7 & 3) | (1 ^ 3), (seven & three) | (one ^ three));
+    check("complement", ~7, ~seven);
+    check("comparison", (-1 < 0) + (3 >= 3) + (2 != 2), (minus_one < zero) + (three >= three) + (two != two));
+    check("and", 1 && 0, one && zero);
+    check("or", 0 || 2, zero || two);
+    check("and", 2 && 3, two && three);
+    check("not", !0 + !7, !zero + !seven);
+    check("not pointer", !p, 0);
+    check("conditional", 1 ? 3 : 7, one ? three : seven);
+    check("conditional", 0 ? 3 : 7, zero ? three : seven);
+    check("conditional", 3 ? 1 : 2.5 > 0, one ? one : half > zero);
+    check("cast", (int) 3.75, (int) (ten * 0.375));
+    check("cast", (int) -3.75, (int) (-ten * 0.375));
+    check("cast", (int) (char) 300, (int) (char) (big - 9223372036854775507));
+
+    check_float("float", 0.1 + 0.2, half / 5.0 + 0.2);
+    check_float("float", 1.0 / 3.0, one / (ten - seven));
+    check_float("float", -(2.5 * 4), -(half * 5.0 * 4));
+    check_float("float", 7 / 2.0, seven / (two + 0.0));
+    check_float("conditional", 0 ? 1 : 2.5, zero ? one : 2.5);
+
+    if (failures == 0)
+        printf("constants ok\n");
+    return failures;
+}
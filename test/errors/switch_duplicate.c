@@ -0,0 +1,16 @@
+// duplicate case value 300
+int classify(char c)
+{
+    switch (c) {
+        case 'a': return 1;
+        case 300: return 2;
+        case -1: return 3;
+        case 300: return 4;
+    }
+    return 0;
+}
+
+int main()
+{
+    return classify('a') - 1;
+}
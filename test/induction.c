@@ -0,0 +1,57 @@
+int printf(char *format, ...);
+
+int data[64];
+
+int sum_range(int *values, int count)
+{
+    int i, sum;
+    sum = 0;
+    for (i = 0; i < count; i++)
+        sum = sum + values[i];
+    return sum;
+}
+
+int main()
+{
+    int a[32], b[32];
+    int i, j, k, n, total, scale;
+    int m[8][8];
+    n = 32;
+    scale = 3;
+    for (i = 0; i < n; i++) {
+        a[i] = i * i;
+        b[i] = 0;
+    }
+    for (i = 1; i < n - 1; i++)
+        b[i] = a[i - 1] + a[i] * scale + a[i + 1];
+    i = n - 1;
+    while (i >= 0) {
+        data[i] = b[i] - a[i];
+        i = i - 1;
+    }
+    for (i = 0; i < 8; i++)
+        for (j = 0; j < 8; j++)
+            m[i][j] = i * 8 + j;
+    total = 0;
+    for (i = 0; i < 8; i++)
+        for (j = 0; j < 8; j++)
+            total = total + m[j][i] * data[j];
+    k = 0;
+    i = 0;
+    while (i < n) {
+        i++;
+        if (i % 3 == 0)
+            continue;
+        k = k + a[i - 1];
+    }
+    if (total > 0)
+        j = 5;
+    else
+        j = 7;
+    do {
+        total = total + data[j];
+        j = j + 2;
+    } while (j < 20);
+    printf("%Ld %Ld %Ld %Ld\n", total, k, sum_range(a, n), sum_range(data, 16));
+    return 0;
+}
@@ -0,0 +1,105 @@
+int printf(char *format, ...);
+
+int values[100];
+int counter;
+
+int square(int x)
+{
+    return x * x;
+}
+
+int clamp(int x, int low, int high)
+{
+    if (x < low)
+        return low;
+    if (x > high)
+        return high;
+    return x;
+}
+
+void bump(int by)
+{
+    counter = counter + by;
+}
+
+int get(int i)
+{
+    return values[i];
+}
+
+void set(int i, int v)
+{
+    values[i] = v;
+}
+
+int sum_to(int n)
+{
+    int i, s;
+    int tmp[4];
+    s = 0;
+    for (i = 0; i < n; i++) {
+        tmp[i % 4] = i;
+        s = s + tmp[i % 4];
+    }
+    return s;
+}
+
+int sign(int x)
+{
+    if (x > 0)
+        return 1;
+    else if (x < 0)
+        return -1;
+    return 0;
+}
+
+int fib(int n)
+{
+    if (n < 2)
+        return n;
+    return fib(n - 1) + fib(n - 2);
+}
+
+int twice(int x)
+{
+    return square(x) + square(x + 1);
+}
+
+int forever(int x)
+{
+    while (1) {
+        if (x > 10)
+            return x;
+        x = x + 3;
+    }
+}
+
+int nothing(int x)
+{
+    while (x) {
+        x = x - 1;
+        if (x == 5)
+            break;
+        continue;
+    }
+    return x;
+}
+
+int main()
+{
+    int i, total;
+    total = 0;
+    for (i = 0; i < 100; i++)
+        set(i, clamp(square(i) - 50, 0, 1000));
+    for (i = 0; i < 100; i++) {
+        total = total + get(i) + sign(i - 50);
+        if (get(i) > 10 && square(i) < 5000 || sign(i) == 0)
+            bump(i);
+    }
+    printf("%lld %lld\n", total, counter);
+    printf("%lld %lld\n", sum_to(10), sum_to(square(3)));
+    printf("%lld\n", fib(15));
+    printf("%lld %lld %lld\n", twice(3), forever(1), nothing(9));
+    printf("%lld\n", i > 50 ? square(i) : clamp(i, 0, 3));
+    return 0;
+}
@@ -0,0 +1,72 @@
+int printf(char *format, ...);
+
+int collatz_length(int n)
+{
+    int length;
+    length = 1;
+    while (n != 1) {
+        if (n % 2 == 0)
+            n = n / 2;
+        else
+            n = 3 * n + 1;
+        length++;
+    }
+    return length;
+}
+
+int is_prime(int n)
+{
+    int d;
+    if (n < 2)
+        return 0;
+    for (d = 2; d * d <= n; d++)
+        if (n % d == 0)
+            return 0;
+    return 1;
+}
+
+double harmonic(int n)
+{
+    double sum;
+    int i;
+    sum = 0.0;
+    for (i = 1; i <= n; i++)
+        sum = sum + 1.0 / i;
+    return sum;
+}
+
+int main()
+{
+    int i, longest, longest_start, length, primes, checksum;
+    longest = 0;
+    longest_start = 0;
+    for (i = 1; i < 300000; i++) {
+        length = collatz_length(i);
+        if (length > longest) {
+            longest = length;
+            longest_start = i;
+        }
+    }
+    printf("longest collatz sequence: %lld (%lld)\n", longest_start, longest);
+
+    primes = 0;
+    for (i = 0; i < 200000; i++)
+        primes += is_prime(i);
+    printf("primes: %lld\n", primes);
+
+    checksum = 0;
+    i = 0;
+    do {
+        switch (i % 4) {
+            case 0: checksum += i; break;
+            case 1: checksum ^= i; break;
+            case 2: checksum -= i / 2;
+            default: checksum = checksum * 3 % 1000003;
+        }
+        i++;
+    } while (i < 1000000);
+    printf("checksum: %lld\n", checksum);
+
+    printf("harmonic: %f\n", harmonic(1000000));
+    return 0;
+}
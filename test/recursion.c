@@ -0,0 +1,112 @@
+int printf(char *format, ...);
+
+int counter;
+
+int gcd(int a, int b)
+{
+    if (b == 0)
+        return a;
+    return gcd(b, a % b);
+}
+
+int fact(int n)
+{
+    if (n <= 1)
+        return 1;
+    return n * fact(n - 1);
+}
+
+int sum(int n)
+{
+    if (n == 0)
+        return 0;
+    return sum(n - 1) + n;
+}
+
+int fib(int n)
+{
+    if (n < 2)
+        return n;
+    return fib(n - 1) + fib(n - 2);
+}
+
+int fib_acc(int n, int a, int b)
+{
+    if (n == 0)
+        return a;
+    return fib_acc(n - 1, b, a + b);
+}
+
+void count_down(int n)
+{
+    if (n == 0)
+        return;
+    counter = counter + 1;
+    count_down(n - 1);
+}
+
+int bits(int n)
+{
+    if (n == 0)
+        return 0;
+    if (n % 2)
+        return 1 + bits(n / 2);
+    return bits(n / 2);
+}
+
+int global_after(int n)
+{
+    if (n == 0)
+        return 0;
+    return global_after(n - 1) + counter;
+}
+
+int helper(int x)
+{
+    return x + 1;
+}
+
+int calls_other(int x)
+{
+    return helper(x * 2);
+}
+
+int escaped(int n)
+{
+    int local;
+    int *p;
+    p = &local;
+    *p = n;
+    if (n == 0)
+        return 0;
+    return escaped(n - 1) + *p;
+}
+
+int dead(int n)
+{
+    if (n < 1)
+        return 7;
+    return dead(n - 1);
+    return dead(n - 2);
+}
+
+int with_array(int n, int acc)
+{
+    int a[100];
+    a[n % 100] = acc;
+    if (n == 0)
+        return acc;
+    return with_array(n - 1, a[n % 100] + 1);
+}
+
+int main()
+{
+    printf("%lld %lld %lld %lld\n", gcd(1071, 462), fact(10), sum(10000), fib(20));
+    printf("%lld\n", fib_acc(50, 0, 1));
+    count_down(10000);
+    printf("%lld %lld\n", counter, bits(255));
+    counter = 3;
+    printf("%lld %lld %lld %lld\n", global_after(10), calls_other(5), escaped(10), dead(100));
+    printf("%lld\n", with_array(10000, 0));
+    return 0;
+}
@@ -0,0 +1,163 @@
+int printf(char *format, ...);
+
+int days_in_month(int month)
+{
+    switch (month) {
+        case 1: return 31;
+        case 2: return 28;
+        case 3: return 31;
+        case 4: return 30;
+        case 5: return 31;
+        case 6: return 30;
+        case 7: return 31;
+        case 8: return 31;
+        case 9: return 30;
+        case 10: return 31;
+        case 11: return 30;
+        case 12: return 31;
+    }
+    return 0;
+}
+
+int digit_value(char c)
+{
+    int value;
+    switch (c) {
+        case '0': value = 0; break;
+        case '1': value = 1; break;
+        case '2': value = 2; break;
+        case '3': value = 3; break;
+        case '4': value = 4; break;
+        case '5': value = 5; break;
+        case '6': value = 6; break;
+        case '7': value = 7; break;
+        case '8': value = 8; break;
+        case '9': value = 9; break;
+        case 'a': case 'A': value = 10; break;
+        case 'b': case 'B': value = 11; break;
+        case 'c': case 'C': value = 12; break;
+        default: value = -1;
+    }
+    return value;
+}
+
+int points(char grade, int bonus)
+{
+    int points, scale;
+    scale = 1;
+    switch (grade) {
+        case 'A': points = 4; break;
+        case 'B': points = 3; scale = 2; break;
+        case 'C': points = 2; break;
+        case 'D': points = 1; scale = 3; break;
+        case 'F': points = 0; break;
+        default: points = -10;
+    }
+    return points * scale + bonus;
+}
+
+int byte_class(char c)
+{
+    // A char is promoted to a value between 0 and 255, the cases outside
+    // of that range never match. 300 mustn't be confused with 44.
+    switch (c) {
+        case ',': return 1;
+        case 300: return 2;
+        case -1: return 3;
+        case 256: return 4;
+        case 'x': return 5;
+    }
+    return 0;
+}
+
+double weight(int kind)
+{
+    switch (kind) {
+        case -2: return 0.25;
+        case -1: return 0.5;
+        case 0: return 1.0;
+        case 1: return 2.0;
+        case 2: return 4.0;
+        default: return 0.0;
+    }
+}
+
+int sparse(int x)
+{
+    switch (x) {
+        case 1: return 10;
+        case 1000: return 20;
+        case 1000000: return 30;
+        case -7: return 40;
+    }
+    return 50;
+}
+
+int flag(_Bool b)
+{
+    switch (b) {
+        case 0: return 100;
+        case 1: return 200;
+    }
+    return 300;
+}
+
+int run(int steps)
+{
+    int pc, acc, i;
+    pc = 0;
+    acc = 1;
+    for (i = 0; i < steps; i++) {
+        switch (pc) {
+            case 0: acc = acc + 3; pc = 1; break;
+            case 1: acc = acc * 2; pc = 2; break;
+            case 2: acc = acc - 5; pc = 3; break;
+            case 3: acc = acc % 1000; pc = 4; break;
+            case 4: acc = acc ^ 21; pc = 0; break;
+        }
+    }
+    return acc;
+}
+
+int main()
+{
+    int i, sum;
+    char c;
+    _Bool b;
+    sum = 0;
+    for (i = 0; i <= 13; i++)
+        sum = sum + days_in_month(i);
+    printf("days: %lld\n", sum);
+    printf("digits:");
+    c = '0';
+    while (c <= 'z') {
+        sum = digit_value(c);
+        if (sum >= 0)
+            printf(" %lld", sum);
+        c = c + 1;
+    }
+    printf("\n");
+    printf("points:");
+    c = '@';
+    while (c <= 'G') {
+        printf(" %lld", points(c, 100));
+        c = c + 1;
+    }
+    printf("\n");
+    printf("weights: %f %f %f %f\n", weight(-2), weight(0), weight(2),
+           weight(9));
+    printf("sparse: %lld %lld %lld %lld %lld\n", sparse(1), sparse(1000),
+           sparse(1000000), sparse(-7), sparse(3));
+    b = 0;
+    printf("flags: %lld", flag(b));
+    b = 1;
+    printf(" %lld\n", flag(b));
+    printf("run: %lld\n", run(100000));
+    c = ',';
+    printf("bytes: %lld", byte_class(c));
+    c = 'x';
+    printf(" %lld", byte_class(c));
+    c = 0;
+    printf(" %lld\n", byte_class(c));
+    return 0;
+}